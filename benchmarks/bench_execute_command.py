@@ -0,0 +1,61 @@
+"""
+Microbenchmark for per-call overhead of `execute_command`.
+
+Runs commands of `Commands3` from example_commands.py through `execute_command` and compares
+the time per call with calling the method directly. Run from the repository root:
+
+    python benchmarks/bench_execute_command.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from example_commands import Commands3
+from orgasm import execute_command
+
+
+CASES = [
+    ("test3", {}),
+    ("sum", {"a": 1, "b": 2}),
+    ("sum", {"a": "1", "b": "2", "c": "3"}),
+    ("mul", {"a_1": 3, "a_2": 4, "k1": 2}),
+]
+
+
+def per_call(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number
+
+
+def run_cases(number, timer=per_call):
+    """
+    Time every case of CASES called directly and through execute_command.
+    :param number: calls per measurement
+    :param timer: timer(stmt, number) returning time of one call
+    :return: list of (command, params, direct time, execute_command time)
+    """
+    classes = [Commands3]
+    instance = Commands3()
+    # registry is built outside of timing
+    execute_command(classes, "test3", {})
+    timings = []
+    for command, params in CASES:
+        direct_params = {k: int(v) for k, v in params.items()}
+        method = getattr(instance, command)
+        direct = timer(lambda: method(**direct_params), number)
+        executed = timer(lambda: execute_command(classes, command, params), number)
+        timings.append((command, params, direct, executed))
+    return timings
+
+
+def main(number=20000):
+    print("%-6s %-40s %12s %12s %12s" % ("cmd", "params", "direct [us]", "execute [us]", "overhead [us]"))
+    for command, params, direct, executed in run_cases(number):
+        print("%-6s %-40s %12.2f %12.2f %12.2f" % (
+            command, params, direct * 1e6, executed * 1e6, (executed - direct) * 1e6
+        ))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,112 @@
+"""
+Throughput comparison of REST API servers.
+
+Starts the REST API for a `Commands3.sum` style command in a subprocess with every server mode
+and hammers it from client threads. Run from the repository root:
+
+    python benchmarks/bench_rest_throughput.py [seconds] [client threads]
+"""
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SERVER = """
+import sys
+sys.path.insert(0, %(root)r)
+from orgasm.http_rest import serve_rest_api
+
+class Commands3:
+    def sum(self, a: int, b: int, *, c: int=0):
+        return a + b + c
+
+serve_rest_api([Commands3], port=%(port)d, server=%(server)r, **%(options)r)
+"""
+
+MODES = [
+    ("flask (dev server)", "flask", {}),
+    ("prefork x%d" % (os.cpu_count() or 1), "prefork", {}),
+    ("asyncio", "asyncio", {}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start on port %d" % port)
+
+
+def run_clients(port, seconds, threads):
+    body = json.dumps({"a": 1, "b": 2})
+    counts = [0] * threads
+    latencies = [[] for _ in range(threads)]
+    deadline = time.time() + seconds
+    def client(i):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request("POST", "/sum", body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                if response.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                continue
+            latencies[i].append(time.perf_counter() - start)
+            counts[i] += 1
+        conn.close()
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    all_latencies = sorted(x for l in latencies for x in l)
+    p50 = all_latencies[len(all_latencies) // 2] if all_latencies else float("nan")
+    p99 = all_latencies[int(len(all_latencies) * 0.99)] if all_latencies else float("nan")
+    return sum(counts) / seconds, p50, p99
+
+
+def bench(server, options, seconds, threads):
+    port = free_port()
+    code = SERVER % {"root": str(ROOT), "port": port, "server": server, "options": options}
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        return run_clients(port, seconds, threads)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(seconds=5.0, threads=16):
+    print("%-22s %12s %12s %12s" % ("server", "req/s", "p50 [ms]", "p99 [ms]"))
+    for name, server, options in MODES:
+        rps, p50, p99 = bench(server, options, seconds, threads)
+        print("%-22s %12.0f %12.2f %12.2f" % (name, rps, p50 * 1e3, p99 * 1e3))
+
+
+if __name__ == "__main__":
+    main(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 5.0,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 16,
+    )
@@ -0,0 +1,99 @@
+"""
+Import time regression check.
+
+Runs `python -X importtime` for `import orgasm` and for a command line call through
+`python -m orgasm <module> cli`, then checks that no frontend dependency was imported
+(Flask, prompt_toolkit, Qt, xmlrpc.server, asyncio, argcomplete, ...) and that cumulative
+import time of orgasm stays under budget. Exits with status 1 on regression. Run from the repository root:
+
+    python benchmarks/check_importtime.py [budget in ms]
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# modules which only frontends need, importing any of them in the CLI path is a regression
+FORBIDDEN = [
+    "flask", "werkzeug", "jinja2",
+    "prompt_toolkit", "pygments",
+    "PySide6",
+    "xmlrpc.server", "xmlrpc.client", "socketserver", "http.server",
+    "asyncio", "concurrent.futures",
+    "argcomplete",
+]
+
+# default budget of cumulative import time of orgasm package in milliseconds
+DEFAULT_BUDGET_MS = 60
+
+COMMANDS = """
+class Commands:
+    def add(self, a: int, b: int):
+        return a + b
+
+COMMAND_CLASSES = ["Commands"]
+"""
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+
+
+def importtime(args, cwd, env):
+    """
+    Run python with -X importtime.
+    :return: tuple (dict module -> cumulative microseconds, total microseconds, stdout)
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args, cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError("%s failed:\n%s" % (" ".join(args), process.stderr))
+    modules = {}
+    total = 0
+    for line in process.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+            if len(match.group(3)) == 1:
+                # imported at top level, time of nested imports is included
+                total += int(match.group(2))
+    return modules, total, process.stdout
+
+
+def check(name, modules, total, budget_ms):
+    failures = []
+    imported = [module for module in FORBIDDEN if module in modules]
+    if imported:
+        failures.append("%s imports %s" % (name, ", ".join(imported)))
+    orgasm_ms = modules.get("orgasm", 0) / 1000
+    print("%-28s orgasm %6.1f ms, %3d modules, total %6.1f ms" % (name, orgasm_ms, len(modules), total / 1000))
+    if orgasm_ms > budget_ms:
+        failures.append("%s: import orgasm took %.1f ms, budget is %d ms" % (name, orgasm_ms, budget_ms))
+    return failures
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT), os.environ.get("PYTHONPATH", "")]))
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        Path(directory, "importtime_commands.py").write_text(COMMANDS)
+        env["ORGASM_CACHE_DIR"] = str(Path(directory, "cache"))
+        modules, total, _ = importtime(["-c", "import orgasm"], directory, env)
+        failures += check("import orgasm", modules, total, budget_ms)
+        # first call writes the spec cache, second one is the usual case
+        for run in ["cli (cold spec cache)", "cli"]:
+            modules, total, output = importtime(["-m", "orgasm", "importtime_commands", "cli", "add", "--a", "1", "--b", "2"], directory, env)
+            if output.strip() != "3":
+                failures.append("%s printed %r instead of 3" % (run, output))
+            failures += check(run, modules, total, budget_ms)
+    for failure in failures:
+        print("FAIL: %s" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Keep-alive check of REST API servers.
+
+Starts the REST API with every server mode in a subprocess (see bench_rest_throughput.py) and calls a command
+through the connection pool of `orgasm.client`, once as is and once with "Connection: close" forced on every
+request. Prints calls per second and number of connections the pool opened, and exits with status 1
+if a server did not keep the connection open. Run from the repository root:
+
+    python benchmarks/check_keepalive.py [calls]
+"""
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_rest_throughput import MODES, ROOT, SERVER, free_port, wait_for_port
+
+sys.path.insert(0, str(ROOT))
+
+from orgasm.client import ConnectionPool
+
+
+class CountingPool(ConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+
+    def _connect(self):
+        self.connections += 1
+        return super()._connect()
+
+
+def run_calls(port, calls, headers):
+    pool = CountingPool("127.0.0.1", port, size=1)
+    body = json.dumps({"a": 1, "b": 2})
+    started = time.perf_counter()
+    for _ in range(calls):
+        status, _, data = pool.request("POST", "/sum", body, dict(headers, **{"Content-Type": "application/json"}))
+        if status != 200 or json.loads(data) != 3:
+            raise RuntimeError("Unexpected response %d %r" % (status, data))
+    elapsed = time.perf_counter() - started
+    pool.close()
+    return calls / elapsed, pool.connections
+
+
+def main(calls=500):
+    failures = []
+    print("%-22s %14s %12s %14s %12s" % ("server", "keep-alive/s", "connections", "close/s", "connections"))
+    for name, server, options in MODES:
+        port = free_port()
+        code = SERVER % {"root": str(ROOT), "port": port, "server": server, "options": options}
+        process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port)
+            kept_rate, kept_connections = run_calls(port, calls, {})
+            closed_rate, closed_connections = run_calls(port, calls, {"Connection": "close"})
+        finally:
+            process.terminate()
+            process.wait()
+        print("%-22s %14.0f %12d %14.0f %12d" % (name, kept_rate, kept_connections, closed_rate, closed_connections))
+        if kept_connections != 1:
+            failures.append("%s opened %d connections for %d calls" % (name, kept_connections, calls))
+    for failure in failures:
+        print("FAIL: %s" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,456 @@
+"""
+Benchmark suite for the dispatch path and every frontend.
+
+Groups of benchmarks (run all, or some with --only):
+
+    specs      get_command_specs and CommandRegistry build for synthetic classes with 10 to 10000 commands
+    execute    per-call overhead of execute_command over calling the method directly (bench_execute_command.py)
+    rest       requests/s and latency of Flask (werkzeug threaded server) and asyncio servers running in-process
+    rpc        requests/s and latency of the XML-RPC server running in-process
+    completer  latency of CommandCompleter.get_completions of the REPL
+    gui        rendering of large results by get_result_widget, headless (skipped without PySide6)
+
+Timings are measured several times and recorded as min and median, load tests record requests/s and latency
+percentiles. Results are written as JSON and compared against a baseline saved earlier on the same machine,
+on min of timings, exit status is 1 if some metric got worse by more than the threshold. Run from the repository root:
+
+    python benchmarks/run_benchmarks.py --save-baseline       # once, on the reference revision
+    python benchmarks/run_benchmarks.py                       # after changes, compares with the baseline
+    python benchmarks/run_benchmarks.py --only rest,rpc --quick
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import threading
+import time
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from bench_execute_command import run_cases
+
+from orgasm import CommandRegistry, get_command_specs
+
+GROUPS = ["specs", "execute", "rest", "rpc", "completer", "gui"]
+
+DEFAULT_OUTPUT = ROOT / "benchmarks" / "results.json"
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+
+# relative change of a metric reported as regression, timings of a shared machine are noisy
+# and a 25% threshold flagged runs without any code change
+DEFAULT_THRESHOLD = 0.5
+
+# measurements of every timing, quick runs use QUICK_REPEAT
+REPEAT = 7
+QUICK_REPEAT = 5
+
+# number of commands of synthetic classes, quick runs stop at 1000
+SPEC_SIZES = [10, 100, 1000, 10000]
+# synthetic commands are split into classes of this many commands
+COMMANDS_PER_CLASS = 100
+
+
+def synthetic_command(self, name: str, count: int, *, ratio: float = 1.0, verbose: bool = False):
+    """
+    Synthetic command.
+    :param name: name of the thing
+    :param count: number of things
+    :param ratio: ratio of things
+    :param verbose: print more
+    """
+    return count
+
+
+def synthetic_classes(commands, per_class=COMMANDS_PER_CLASS):
+    """
+    Classes with `commands` commands in total, named cmd0, cmd1, ...
+    Every class has VALID_VALUES for its first command.
+    """
+    classes = []
+    for start in range(0, commands, per_class):
+        names = ["cmd%d" % i for i in range(start, min(start + per_class, commands))]
+        namespace = {name: synthetic_command for name in names}
+        namespace["VALID_VALUES"] = {names[0]: {"name": ["alpha", "beta", "gamma"]}}
+        classes.append(type("Synthetic%d" % len(classes), (), namespace))
+    return classes
+
+
+class Commands:
+    def test3(self):
+        return "This is test3"
+
+    def sum(self, a: int, b: int, *, c: int = 0):
+        return a + b + c
+
+    def rows(self, count: int):
+        return [{"id": i, "name": "row %d" % i} for i in range(count)]
+
+
+def timing(func, repeat, number=1, scale=1.0):
+    """
+    Time of one call of func measured repeat times.
+    :param number: calls per measurement
+    :param scale: unit of the result, e.g. 1000 for milliseconds
+    :return: dict with min and median
+    """
+    times = [time / number * scale for time in timeit.repeat(func, number=number, repeat=repeat)]
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_specs(quick):
+    results = {}
+    for size in SPEC_SIZES:
+        if quick and size > 1000:
+            continue
+        classes = synthetic_classes(size)
+        repeat = 3 if size >= 10000 else (QUICK_REPEAT if quick else REPEAT)
+        results["get_command_specs_%d_ms" % size] = timing(lambda: get_command_specs(classes), repeat, scale=1000)
+        # registry builds specs and compiles every command
+        results["registry_%d_ms" % size] = timing(lambda: CommandRegistry(classes).warmup(), repeat, scale=1000)
+    return results
+
+
+def bench_execute(quick):
+    """
+    Cases of bench_execute_command.py, cases of the same command are numbered from the second one.
+    """
+    repeat = QUICK_REPEAT if quick else REPEAT
+    timer = lambda stmt, number: timing(stmt, repeat, number, scale=1e6)
+    results = {}
+    for command, params, direct, executed in run_cases(2000 if quick else 20000, timer):
+        name = command
+        index = 1
+        while "%s_execute_us" % name in results:
+            index += 1
+            name = "%s_%d" % (command, index)
+        results["%s_execute_us" % name] = executed
+        results["%s_overhead_us" % name] = {key: executed[key] - direct[key] for key in executed}
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start on port %d" % port)
+
+
+def run_load(make_client, seconds, threads):
+    """
+    Call requests made by make_client() from threads for seconds.
+    :param make_client: returns tuple (call, close), call sends one request
+    :return: dict with requests_per_s, p50_ms, p99_ms and errors
+    """
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+    deadline = time.perf_counter() + seconds
+    def client(i):
+        call, close = make_client()
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    call()
+                except Exception:
+                    errors[i] += 1
+                    continue
+                latencies[i].append(time.perf_counter() - start)
+        finally:
+            close()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    merged = [latency for thread_latencies in latencies for latency in thread_latencies]
+    if not merged:
+        raise RuntimeError("No request succeeded")
+    return {
+        "requests_per_s": len(merged) / elapsed,
+        "p50_ms": percentile(merged, 0.5) * 1000,
+        "p99_ms": percentile(merged, 0.99) * 1000,
+        "errors": sum(errors),
+    }
+
+
+def http_client(port, path, params):
+    body = json.dumps(params)
+    headers = {"Content-Type": "application/json"}
+    def make_client():
+        # connection is opened again by http.client when the server closes it
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        def call():
+            conn.request("POST", path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError("HTTP %d" % response.status)
+            if response.will_close:
+                conn.close()
+        return call, conn.close
+    return make_client
+
+
+def start_flask(classes):
+    from werkzeug.serving import make_server
+    from orgasm.http_rest import create_rest_app
+    port = free_port()
+    server = make_server("127.0.0.1", port, create_rest_app(classes), threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    wait_for_port(port)
+    def stop():
+        server.shutdown()
+        thread.join()
+    return port, stop
+
+
+def start_asyncio(classes):
+    import asyncio
+    from orgasm import get_registry
+    from orgasm.http_rest_asyncio import AsyncRestServer
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(AsyncRestServer(get_registry(classes)).serve("127.0.0.1", port))
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    wait_for_port(port)
+    def stop():
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+    return port, stop
+
+
+def bench_rest(quick):
+    import logging
+    # werkzeug logs every request to stderr
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    seconds = 1 if quick else 5
+    results = {}
+    for server, start in [("flask", start_flask), ("asyncio", start_asyncio)]:
+        port, stop = start([Commands])
+        try:
+            stats = run_load(http_client(port, "/sum", {"a": 1, "b": 2}), seconds, threads=8)
+            stats.update({"rows_" + key: value for key, value in
+                          run_load(http_client(port, "/rows", {"count": 1000}), seconds, threads=4).items()})
+        finally:
+            stop()
+        results.update({"%s_%s" % (server, key): value for key, value in stats.items()})
+    return results
+
+
+def bench_rpc(quick):
+    import xmlrpc.client
+    from orgasm import command_executor_rpc
+    seconds = 1 if quick else 5
+    port = free_port()
+    # server runs until the process exits
+    threading.Thread(target=command_executor_rpc, args=([Commands],), kwargs={"port": port}, daemon=True).start()
+    wait_for_port(port)
+    def client(command, params):
+        def make_client():
+            proxy = xmlrpc.client.ServerProxy("http://127.0.0.1:%d/RPC2" % port, allow_none=True)
+            return (lambda: proxy.execute(command, params)), proxy("close")
+        return make_client
+    results = run_load(client("sum", {"a": 1, "b": 2}), seconds, threads=8)
+    rows = run_load(client("rows", {"count": 1000}), seconds, threads=4)
+    results.update({"rows_" + key: value for key, value in rows.items()})
+    return results
+
+
+def bench_completer(quick):
+    from prompt_toolkit.completion import CompleteEvent
+    from prompt_toolkit.document import Document
+    from orgasm.repl import CommandCompleter
+    registry = CommandRegistry(synthetic_classes(1000))
+    registry.warmup()
+    completer = CommandCompleter(registry.specs, registry)
+    event = CompleteEvent(completion_requested=True)
+    cases = [
+        ("empty", ""),
+        ("command_prefix", "cmd12"),
+        ("arg_names", "cmd500 "),
+        ("arg_prefix", "cmd500 name=x c"),
+        ("valid_values", "cmd0 name="),
+        ("bool_values", "cmd999 verbose="),
+    ]
+    number = 50 if quick else 200
+    repeat = QUICK_REPEAT if quick else REPEAT
+    results = {}
+    for name, text in cases:
+        document = Document(text, len(text))
+        results["%s_us" % name] = timing(lambda: list(completer.get_completions(document, event)), repeat, number, 1e6)
+    return results
+
+
+def bench_gui(quick):
+    try:
+        import PySide6  # noqa: F401
+    except ImportError:
+        return {"skipped": "PySide6 is not installed"}
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from orgasm.gui import get_result_widget
+    app = QApplication.instance() or QApplication([])
+    size = 1000 if quick else 10000
+    cases = [
+        ("table_%d" % size, Commands().rows(size)),
+        ("list_%d" % size, ["item %d" % i for i in range(size)]),
+        ("dict_%d" % size, {"key %d" % i: i for i in range(size)}),
+    ]
+    results = {}
+    for name, result in cases:
+        def render():
+            widget = get_result_widget(result)
+            widget.deleteLater()
+            app.processEvents()
+        results["%s_ms" % name] = timing(render, QUICK_REPEAT if quick else REPEAT, scale=1000)
+    return results
+
+
+BENCHMARKS = {
+    "specs": bench_specs,
+    "execute": bench_execute,
+    "rest": bench_rest,
+    "rpc": bench_rpc,
+    "completer": bench_completer,
+    "gui": bench_gui,
+}
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_s")
+
+
+def metric_value(value):
+    """
+    Value of a metric compared with baseline, timings are compared on their min.
+    """
+    if isinstance(value, dict):
+        value = value.get("min")
+    return value if isinstance(value, (int, float)) else None
+
+
+def format_value(value):
+    if isinstance(value, dict):
+        return "min %.3f  median %.3f" % (value["min"], value["median"])
+    return "%.3f" % value if isinstance(value, float) else str(value)
+
+
+def rounded(value):
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    return round(value, 3) if isinstance(value, float) else value
+
+
+def compare(results, baseline, threshold):
+    """
+    Print change of every metric against baseline.
+    :return: list of regressed metrics, "group.metric"
+    """
+    regressions = []
+    print("\n%-40s %12s %12s %9s" % ("metric", "baseline", "current", "change"))
+    for group, metrics in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(group, {})
+        for metric, value in metrics.items():
+            value, old = metric_value(value), metric_value(previous.get(metric))
+            if value is None or old is None or metric.endswith("errors"):
+                continue
+            change = (value - old) / old if old else 0.0
+            worse = -change if higher_is_better(metric) else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append("%s.%s" % (group, metric))
+            print("%-40s %12.3f %12.3f %+8.1f%%%s" % ("%s.%s" % (group, metric), old, value, change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ORGASM benchmarks and compare them with a baseline")
+    parser.add_argument("--only", default=",".join(GROUPS), help="comma separated groups: %s" % ", ".join(GROUPS))
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and smaller inputs")
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT), help="where results are written as JSON")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative change of a metric reported as regression")
+    options = parser.parse_args()
+    groups = [group.strip() for group in options.only.split(",") if group.strip()]
+    unknown = [group for group in groups if group not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown groups %s" % ", ".join(unknown))
+    # requests are not logged, writing log lines would be measured too
+    from orgasm.request_log import OFF, configure_request_log
+    configure_request_log(level=OFF)
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": options.quick,
+        "benchmarks": {},
+    }
+    for group in groups:
+        print("Running %s benchmarks" % group, flush=True)
+        metrics = {metric: rounded(value) for metric, value in BENCHMARKS[group](options.quick).items()}
+        results["benchmarks"][group] = metrics
+        for metric, value in metrics.items():
+            print("  %-36s %s" % (metric, format_value(value)))
+    output = Path(options.output)
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print("Results written to %s" % output)
+    baseline_path = Path(options.baseline)
+    if options.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print("Baseline saved to %s" % baseline_path)
+        return 0
+    if not baseline_path.exists():
+        print("No baseline %s, save one with --save-baseline" % baseline_path)
+        return 0
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get("quick") != options.quick:
+        print("Baseline was run with quick=%s, results are not comparable" % baseline.get("quick"))
+    regressions = compare(results, baseline, options.threshold)
+    if regressions:
+        print("\n%d metrics regressed by more than %d%%: %s" % (
+            len(regressions), options.threshold * 100, ", ".join(regressions)))
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
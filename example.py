@@ -1,11 +1,12 @@
 from typing import Callable
-from orgasm import command_executor_main, get_classes, command_executor_rpc, get_command_specs
+from orgasm import command_executor_main, cli_main, get_classes, command_executor_rpc, get_command_specs
 from orgasm.web import serve_web
 from orgasm.http_rest import serve_rest_api
 from json import dumps
 from orgasm.repl import launch_repl
 from orgasm.gui import create_main_window
 # command_executor_main(get_classes("example_commands"), explicit_params=False)
+# cli_main("example_commands", explicit_params=False)  # caches specs on disk for fast tab completion
 # serve_rest_api(get_classes("example_commands"), port=5000)
 # serve_web(get_classes("example_commands"))
 # command_executor_rpc(get_classes("example_commands"))
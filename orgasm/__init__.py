@@ -1,19 +1,21 @@
-import argparse
-import itertools
+# Frontends (argparse, argcomplete, xmlrpc, asyncio, Flask, ...) are imported only by the functions using them,
+# so importing orgasm for one frontend does not pay for the others.
+import copy
+import functools
+import hashlib
+import os
+import queue
 from pathlib import Path
 import sys
-import traceback
+import threading
+import time
 from typing import Dict 
 import inspect 
 from orgasm.command_class_inspector import * 
-from xmlrpc.server import SimpleXMLRPCServer
-from xmlrpc.server import SimpleXMLRPCRequestHandler
-from socketserver import ThreadingMixIn
-import xmlrpc.client
-try:
-    import argcomplete
-except ImportError:
-    argcomplete = None
+from orgasm import limits
+from orgasm.metrics import metrics
+from orgasm.streaming import primed
+from orgasm.cache import TTLCache, ValidValuesCache, normalize_valid_values, valid_values_ttl
 
 
 class SuperFunction:
@@ -82,7 +84,99 @@ def tag(*tags):
         return func
     return decorator
 
+_result_caches: Dict[str, list] = {}
 
+# results of these types can not be changed by callers and are returned from result cache as they are
+_IMMUTABLE_RESULTS = (str, bytes, int, float, complex, bool, type(None), Path)
+
+def _copy_result(result):
+    if isinstance(result, _IMMUTABLE_RESULTS):
+        return result
+    return copy.deepcopy(result)
+
+def cached(ttl=None, maxsize=128, exclude=(), copy=True):
+    """
+    Decorator to memoize command results.
+    Results are keyed on the coerced and bound arguments, so all frontends share the same cache.
+    Cache is per command method, not per instance of the command class.
+    Every caller gets a deep copy of a mutable result (list, dict, ...), so changing it does not change
+    the result later callers get.
+    :param ttl: time to live of results in seconds, None means results never expire
+    :param maxsize: maximal number of cached results, least recently used are evicted first
+    :param exclude: names of arguments which are not part of the cache key
+    :param copy: copy mutable results, with False the cached object itself is returned to every caller
+        and callers must treat it as read-only
+    :return: decorated function
+    """
+    def decorator(func):
+        result_cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        func = attr(result_cache=result_cache, result_cache_exclude=tuple(exclude), result_cache_copy=copy)(func)
+        _result_caches.setdefault(func.func.__name__, []).append(result_cache)
+        return func
+    return decorator
+
+def cpu_bound(func):
+    """
+    Decorator to run command in a worker process of `orgasm.process_pool` instead of serving process thread.
+    Command class must be importable by workers, arguments and result must be picklable.
+    :return: decorated function
+    """
+    return tag("cpu_bound")(func)
+
+def invalidate_cached(command=None):
+    """
+    Drop cached results of command with given name, or of all commands if command is None.
+    """
+    for name, caches in list(_result_caches.items()):
+        if command is None or name == command:
+            for result_cache in caches:
+                result_cache.invalidate()
+
+def cache_stats(command=None):
+    """
+    Get hits, misses, evictions and size of result caches.
+    :param command: command name, if None stats for all cached commands are returned
+    :return: dict mapping command names to stats
+    """
+    stats = {}
+    for name, caches in list(_result_caches.items()):
+        if command is not None and name != command:
+            continue
+        total = {}
+        for result_cache in caches:
+            for key, value in result_cache.stats().items():
+                total[key] = total.get(key, 0) + value
+        stats[name] = total
+    return stats
+
+
+valid_values_cache = ValidValuesCache()
+
+def get_valid_values_provider(cls, command, arg):
+    """
+    Get entry of cls.VALID_VALUES for given command argument.
+    :return: list, single value, callable provider or None if values are not restricted
+    """
+    return getattr(cls, "VALID_VALUES", {}).get(command, {}).get(arg, None)
+
+def get_valid_values(cls, command, arg):
+    """
+    Get list of valid values for given command argument.
+    Callable providers are called through `valid_values_cache`.
+    :return: list of values or None if values are not restricted
+    """
+    g = get_valid_values_provider(cls, command, arg)
+    if g is None:
+        return None
+    if callable(g):
+        return valid_values_cache.get(g)
+    return normalize_valid_values(g)
+
+def invalidate_valid_values(provider=None):
+    """
+    Drop cached values of VALID_VALUES provider, or of all providers if provider is None.
+    """
+    valid_values_cache.invalidate(provider)
 
 def get_command_specs(classes):
     spec = []
@@ -103,16 +197,7 @@ def get_command_specs(classes):
                         "type": get_arg_type(f, arg),
                         "help": get_arg_description(f, arg),
                     })
-                    if hasattr(cls, "VALID_VALUES") and getattr(cls, "VALID_VALUES").get(command, {}).get(arg, None) is not None:
-                        g = getattr(cls, "VALID_VALUES")[command][arg]
-                        if callable(g):
-                            args[-1]["valid_values"] = g()
-                        elif hasattr(g, "__iter__") and not isinstance(g, str):
-                            args[-1]["valid_values"] = list(g)
-                        else:
-                            args[-1]["valid_values"] = [g]
-                    else:
-                        args[-1]["valid_values"] = None
+                    args[-1]["valid_values"] = get_valid_values(cls, command, arg)
                 for arg, value in get_optional_arguments(f):
                     args.append({
                         "name": arg,
@@ -121,140 +206,818 @@ def get_command_specs(classes):
                         "help": get_arg_description(f, arg),
                         "default": value
                     })
-                    if hasattr(cls, "VALID_VALUES") and getattr(cls, "VALID_VALUES").get(command, {}).get(arg, None) is not None:
-                        g = getattr(cls, "VALID_VALUES")[command][arg]
-                        if callable(g):
-                            args[-1]["valid_values"] = g()
-                        elif hasattr(g, "__iter__") and not isinstance(g, str):
-                            args[-1]["valid_values"] = list(g)
-                        else:
-                            args[-1]["valid_values"] = [g]
-                    else:
-                        args[-1]["valid_values"] = None
+                    args[-1]["valid_values"] = get_valid_values(cls, command, arg)
                 spec.append({
                     "name": command,
                     "args": args,
                     "method_name": command,
                     "attrs": getattr(cls, command).attrs if  is_super_function(getattr(cls, command)) else {},
-                    "tags": getattr(cls, command).tags if is_super_function(getattr(cls, command)) else []
+                    "tags": getattr(cls, command).tags if is_super_function(getattr(cls, command)) else [],
+                    "is_async": inspect.iscoroutinefunction(f),
+                    "is_generator": inspect.isgeneratorfunction(f),
                 })
     return spec
 
-def execute_command(classes, command: str, params):
-    spec = get_command_specs(classes)
-    command = [x for x in spec if x["name"] == command]
-    if len(command) == 0:
-        raise ValueError("Command %s not found" % command)
-    command = command[0]
-    for cls in classes:
-        executor = cls()
-        if hasattr(executor, command["method_name"]):
-            m = getattr(executor, command["method_name"])
-            A = {}
-            for arg in command["args"]:
-                if arg != "self":
-                    if arg["name"] in params:
-                        A[arg["name"]] = params[arg["name"]]
-                    else:
-                        if "default" in arg:
-                            A[arg["name"]] = arg["default"]
-                        else:
-                            raise ValueError("Argument %s is required" % arg)
-                # if arg is type PathLike then check if path exists
-                if arg["type"] == Path:
-                    if not Path(A[arg["name"]]).exists():
-                        raise ValueError("Path %s does not exist" % A[arg])
-                if not isinstance(A[arg["name"]], arg["type"]):
-                    try:
-                        if arg["type"] == bytes and isinstance(A[arg["name"]], xmlrpc.client.Binary):
-                            A[arg["name"]] = A[arg["name"]].data
-                        else:
-                            A[arg["name"]] = arg["type"](A[arg["name"]])
-                    except:
-                        traceback.print_exc()
-                        raise ValueError("Invalid value for argument %s" % arg["name"])
-                if arg["valid_values"] is not None:
-                    if A[arg["name"]] not in arg["valid_values"]:
-                        raise ValueError("Invalid value %s for argument %s" % (A[arg], arg))
-            if is_super_function(m):
-                return m(executor, **A)
+class PerCallProvider:
+    """
+    Creates new instance of the command class for every call.
+    """
+    def __init__(self, cls):
+        self.cls = cls
+
+    def acquire(self):
+        return self.cls()
+
+    def release(self, instance):
+        pass
+
+    def warmup(self):
+        pass
+
+class SingletonProvider(PerCallProvider):
+    """
+    Shares one instance of the command class across the whole process.
+    """
+    def __init__(self, cls):
+        super().__init__(cls)
+        self._lock = threading.Lock()
+        self._instance = None
+
+    def acquire(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self.cls()
+                instance = self._instance
+        return instance
+
+    def warmup(self):
+        self.acquire()
+
+class ThreadLocalProvider(PerCallProvider):
+    """
+    Keeps one instance of the command class per thread.
+    """
+    def __init__(self, cls):
+        super().__init__(cls)
+        self._local = threading.local()
+
+    def acquire(self):
+        instance = getattr(self._local, "instance", None)
+        if instance is None:
+            instance = self._local.instance = self.cls()
+        return instance
+
+    def warmup(self):
+        # only the calling thread can be warmed up
+        self.acquire()
+
+class PoolProvider(PerCallProvider):
+    """
+    Keeps bounded pool of instances of the command class.
+    Instances are checked out for the duration of the call and returned afterwards.
+    When all instances are in use, callers wait for one to be returned.
+    """
+    def __init__(self, cls, size):
+        super().__init__(cls)
+        if size < 1:
+            raise ValueError("Pool size for %s must be positive" % cls.__name__)
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _try_create(self):
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        try:
+            return self.cls()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        instance = self._try_create()
+        if instance is None:
+            instance = self._idle.get()
+        return instance
+
+    def release(self, instance):
+        self._idle.put(instance)
+
+    def warmup(self):
+        while True:
+            instance = self._try_create()
+            if instance is None:
+                break
+            self._idle.put(instance)
+
+PER_CALL = "per_call"
+SINGLETON = "singleton"
+THREAD = "thread"
+POOL = "pool"
+DEFAULT_POOL_SIZE = 4
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def instance_scope(scope, pool_size=None):
+    """
+    Class decorator to declare lifecycle of command class instances.
+    Equivalent to setting INSTANCE_SCOPE (and INSTANCE_POOL_SIZE) class attributes.
+    :param scope: one of "per_call" (default), "singleton", "thread" or "pool"
+    :param pool_size: maximal number of instances for "pool" scope
+    :return: decorated class
+    """
+    def decorator(cls):
+        cls.INSTANCE_SCOPE = scope
+        if pool_size is not None:
+            cls.INSTANCE_POOL_SIZE = pool_size
+        return cls
+    return decorator
+
+def get_instance_provider(cls):
+    """
+    Get provider of instances for command class according to its INSTANCE_SCOPE.
+    Providers are shared per class across the whole process.
+    :param cls: command class
+    :return: provider with acquire(), release(instance) and warmup() methods
+    """
+    provider = _providers.get(cls)
+    if provider is not None:
+        return provider
+    with _providers_lock:
+        provider = _providers.get(cls)
+        if provider is not None:
+            return provider
+        scope = getattr(cls, "INSTANCE_SCOPE", PER_CALL)
+        if scope == PER_CALL:
+            provider = PerCallProvider(cls)
+        elif scope == SINGLETON:
+            provider = SingletonProvider(cls)
+        elif scope == THREAD:
+            provider = ThreadLocalProvider(cls)
+        elif scope == POOL:
+            provider = PoolProvider(cls, getattr(cls, "INSTANCE_POOL_SIZE", DEFAULT_POOL_SIZE))
+        else:
+            raise ValueError("Invalid instance scope %s for class %s" % (scope, cls.__name__))
+        _providers[cls] = provider
+    return provider
+
+def compile_coercer(arg):
+    """
+    Build function which converts raw value of the argument into its declared type.
+    Everything that depends only on the spec (type, special cases) is decided here
+    so that per-call work is limited to the conversion itself.
+    :param arg: argument spec
+    :return: callable taking raw value and returning coerced value, or None if value should be passed as is
+    """
+    arg_type = arg["type"]
+    name = arg["name"]
+    if arg_type is None:
+        return None
+    if arg_type == Path:
+        def coerce_path(value):
+            try:
+                path = value if isinstance(value, Path) else Path(value)
+            except Exception as e:
+                raise ValueError("Invalid value for argument %s" % name) from e
+            if not path.exists():
+                raise ValueError("Path %s does not exist" % value)
+            return path
+        return coerce_path
+    if arg_type in (bytes, memoryview):
+        def coerce_bytes(value):
+            # binary request bodies arrive as memoryview, they are passed on without copying only to
+            # memoryview arguments, bytes arguments get a copy with the usual bytes methods
+            if isinstance(value, arg_type):
+                return value
+            # values can be xmlrpc.client.Binary only if XML-RPC is in use
+            xmlrpc_client = sys.modules.get("xmlrpc.client")
+            if xmlrpc_client is not None and isinstance(value, xmlrpc_client.Binary):
+                value = value.data
+            if arg_type == memoryview:
+                try:
+                    return memoryview(value)
+                except Exception as e:
+                    raise ValueError("Invalid value for argument %s" % name) from e
+            try:
+                return bytes(value)
+            except Exception as e:
+                raise ValueError("Invalid value for argument %s" % name) from e
+        return coerce_bytes
+    def coerce(value):
+        if isinstance(value, arg_type):
+            return value
+        try:
+            return arg_type(value)
+        except Exception as e:
+            raise ValueError("Invalid value for argument %s" % name) from e
+    return coerce
+
+def compile_validator(arg, provider=None):
+    """
+    Build function which checks whether value is among valid values of the argument.
+    :param arg: argument spec
+    :param provider: callable VALID_VALUES provider, its values are looked up through `valid_values_cache` on every check
+    :return: callable taking value and returning bool, or None if values are not restricted
+    """
+    if callable(provider):
+        def is_valid(value):
+            return value in valid_values_cache.get(provider)
+        return is_valid
+    valid_values = arg["valid_values"]
+    if valid_values is None:
+        return None
+    try:
+        return frozenset(valid_values).__contains__
+    except TypeError:
+        # unhashable values, fall back to linear membership test
+        return valid_values.__contains__
+
+def compile_binder(spec, providers=None):
+    """
+    Build function which maps request parameters to keyword arguments of the command.
+    The returned binder applies coercion and valid values check decided in advance for every argument.
+    Default values are coerced and checked once here; a default which fails (e.g. Path which does not exist yet)
+    is tried again on every call using it. None defaults are passed as is.
+    :param spec: command spec
+    :param providers: dict mapping argument names to their VALID_VALUES entries
+    :return: callable taking params dict and returning kwargs dict
+    """
+    providers = providers or {}
+    plan = []
+    for arg in spec["args"]:
+        coerce = compile_coercer(arg)
+        is_valid = compile_validator(arg, providers.get(arg["name"]))
+        default = arg.get("default")
+        # returns the default when it has to be checked on every call
+        check_default = None
+        if "default" in arg and default is not None:
+            try:
+                default = _bind_value(arg["name"], default, coerce, is_valid)
+                if callable(providers.get(arg["name"])):
+                    # values of callable providers change
+                    check_default = functools.partial(_bind_value, arg["name"], default, None, is_valid)
+            except ValueError:
+                check_default = functools.partial(_bind_value, arg["name"], default, coerce, is_valid)
+        plan.append((arg["name"], "default" not in arg, default, coerce, is_valid, check_default))
+    plan = tuple(plan)
+    def bind(params):
+        kwargs = {}
+        for name, required, default, coerce, is_valid, check_default in plan:
+            if name in params:
+                value = params[name]
+                if coerce is not None:
+                    value = coerce(value)
+                if is_valid is not None and not is_valid(value):
+                    raise ValueError("Invalid value %s for argument %s" % (value, name))
+            elif required:
+                raise ValueError("Argument %s is required" % name)
             else:
-                return m(**A)
-    raise ValueError("Command %s not found" % command)
+                value = default if check_default is None else check_default()
+            kwargs[name] = value
+        return kwargs
+    return bind
 
-def command_executor_main(classes, explicit_params=True):
+def _bind_value(name, value, coerce, is_valid):
+    if coerce is not None:
+        value = coerce(value)
+    if is_valid is not None and not is_valid(value):
+        raise ValueError("Invalid value %s for argument %s" % (value, name))
+    return value
+
+_MISSING = object()
+
+class CompiledCommand:
     """
-    Command line interface for executing commands in classes.
-    :param classes: list of classes to execute commands from
-    :param explicit_params: if True, all parameters must be specified in the command line which are required for the command. If False, then only values for these parameters which are not default values must be specified.
+    Command prepared for execution: its spec, the class implementing it, provider of
+    class instances and precompiled argument binder.
+    """
+    def __init__(self, spec, cls):
+        self.spec = spec
+        self.name = spec["name"]
+        self.method_name = spec["method_name"]
+        self.cls = cls
+        self.provider = get_instance_provider(cls)
+        self.valid_values_providers = {}
+        for arg in spec["args"]:
+            g = get_valid_values_provider(cls, self.name, arg["name"])
+            if g is not None:
+                self.valid_values_providers[arg["name"]] = g
+        self.bind = compile_binder(spec, self.valid_values_providers)
+        self.result_cache = spec["attrs"].get("result_cache")
+        self.result_cache_exclude = frozenset(spec["attrs"].get("result_cache_exclude", ()))
+        self.copy_result = _copy_result if spec["attrs"].get("result_cache_copy", True) else lambda result: result
+        self.is_async = spec.get("is_async", False)
+        self.cpu_bound = "cpu_bound" in spec["tags"]
+        self.limiter = limits.get_command_limiter(cls, spec)
+        self.metrics = metrics.command(self.name)
 
-    Example:
-    if we have class with method `def foo(self, a: int, *, b: str = "default", c: str = "default")` then:
-    if explicit_params = True, then we must specify all parameters in the command line:
-        app foo --a 1 
-    if explicit_params = False, then we can specify only the parameters which are not default values:
-        app foo 1 
+    def valid_values(self, arg_name):
+        """
+        Get current valid values of the argument, refreshing them through `valid_values_cache`
+        when provider is callable. The argument spec is updated with refreshed values.
+        :return: list of values or None if values are not restricted
+        """
+        g = self.valid_values_providers.get(arg_name)
+        if not callable(g):
+            return next((arg["valid_values"] for arg in self.spec["args"] if arg["name"] == arg_name), None)
+        values = valid_values_cache.get(g)
+        for arg in self.spec["args"]:
+            if arg["name"] == arg_name:
+                arg["valid_values"] = values
+        return values
+
+    def invalidate_valid_values(self):
+        """
+        Drop cached values of all callable VALID_VALUES providers of this command.
+        """
+        for g in self.valid_values_providers.values():
+            if callable(g):
+                valid_values_cache.invalidate(g)
+
+    def _cache_key(self, kwargs):
+        if self.result_cache is None:
+            return None
+        try:
+            key = tuple(
+                # memoryview hashes only if the object it views is hashable, binary arguments are keyed
+                # on a digest of their content, computed on the view without copying it
+                (name, (memoryview, hashlib.blake2b(value).digest()) if isinstance(value, memoryview) else value)
+                for name, value in kwargs.items() if name not in self.result_cache_exclude
+            )
+            hash(key)
+        except (TypeError, ValueError, BufferError):
+            # unhashable arguments (e.g. lists or non-contiguous memoryview) can not be cached
+            return None
+        return key
+
+    def __call__(self, params):
+        """
+        Execute command synchronously. Async commands are run to completion in a new event loop.
+        """
+        started = self.metrics.enter()
+        bound = None
+        try:
+            kwargs = self.bind(params)
+            bound = time.perf_counter()
+            key = self._cache_key(kwargs)
+            if key is None:
+                result = self.invoke(kwargs)
+            else:
+                result = self.result_cache.get(key, _MISSING)
+                if result is _MISSING:
+                    result = self.invoke(kwargs)
+                    # streamed results can be consumed only once
+                    if not inspect.isgenerator(result):
+                        self.result_cache.set(key, result)
+                        result = self.copy_result(result)
+                else:
+                    result = self.copy_result(result)
+        except BaseException:
+            self.metrics.exit(started, bound, error=True)
+            raise
+        if inspect.isgenerator(result):
+            # call is recorded when the stream ends
+            return self.metrics.measure_stream(result, started, bound)
+        self.metrics.exit(started, bound)
+        return result
+
+    async def call_async(self, params, executor=None):
+        """
+        Execute command from a running event loop. Async commands are awaited directly,
+        sync commands are offloaded to executor.
+        :param params: dict of parameter values
+        :param executor: concurrent.futures.Executor for sync commands, None for loop default executor
+        """
+        started = self.metrics.enter()
+        bound = None
+        try:
+            kwargs = self.bind(params)
+            bound = time.perf_counter()
+            key = self._cache_key(kwargs)
+            result = _MISSING if key is None else self.result_cache.get(key, _MISSING)
+            if result is _MISSING:
+                if self.is_async and not self.cpu_bound:
+                    result = await self.invoke_async(kwargs)
+                else:
+                    import asyncio
+                    result = await asyncio.get_running_loop().run_in_executor(executor, self.invoke, kwargs)
+                if key is not None and not inspect.isgenerator(result):
+                    self.result_cache.set(key, result)
+                    result = self.copy_result(result)
+            else:
+                result = self.copy_result(result)
+        except BaseException:
+            self.metrics.exit(started, bound, error=True)
+            raise
+        if inspect.isgenerator(result):
+            return self.metrics.measure_stream(result, started, bound)
+        self.metrics.exit(started, bound)
+        return result
+
+    def _method(self, executor):
+        m = getattr(executor, self.method_name)
+        if is_super_function(m):
+            return functools.partial(m, executor)
+        return m
+
+    def _limiters(self):
+        limiters = [self.limiter] if self.limiter is not None else []
+        if limits.global_limiter is not None:
+            limiters.append(limits.global_limiter)
+        return limiters
+
+    def _release_slots(self, slots):
+        for limiter, started in reversed(slots):
+            limiter.release(started)
+
+    def invoke(self, kwargs):
+        """
+        Call the command with already bound arguments.
+        Waits for a slot if the command or all commands are limited by max_concurrency.
+        :raises orgasm.limits.Overloaded: if limit and its queue are full
+        """
+        slots = []
+        streaming = False
+        try:
+            for limiter in self._limiters():
+                slots.append((limiter, limiter.acquire()))
+            result = self._invoke(kwargs)
+            if inspect.isgenerator(result):
+                # generator runs after we return, slots are held until it is exhausted or closed
+                streaming = True
+                return self._stream(result, lambda: self._release_slots(slots))
+            return result
+        finally:
+            if not streaming:
+                self._release_slots(slots)
+
+    def _invoke(self, kwargs):
+        if self.cpu_bound:
+            from orgasm.process_pool import get_process_pool
+            return get_process_pool().run(self.cls, self.method_name, kwargs)
+        if self.is_async:
+            import asyncio
+            return asyncio.run(self._invoke_async(kwargs))
+        executor = self.provider.acquire()
+        streaming = False
+        try:
+            result = self._method(executor)(**kwargs)
+            if inspect.isgenerator(result):
+                # generator runs after we return, instance is released once it is exhausted or closed
+                streaming = True
+                return self._stream(result, lambda: self.provider.release(executor))
+            return result
+        finally:
+            if not streaming:
+                self.provider.release(executor)
+
+    @primed
+    def _stream(self, result, release):
+        try:
+            yield
+            yield from result
+        finally:
+            release()
+
+    async def invoke_async(self, kwargs):
+        """
+        Await async command with already bound arguments.
+        Instance of the command class is held until the coroutine finishes.
+        Waiting for concurrency limit slot does not block the event loop.
+        :raises orgasm.limits.Overloaded: if limit and its queue are full
+        """
+        import asyncio
+        slots = []
+        try:
+            for limiter in self._limiters():
+                started = limiter.try_acquire()
+                if started is None:
+                    waiting = asyncio.get_running_loop().run_in_executor(None, limiter.acquire)
+                    try:
+                        started = await asyncio.shield(waiting)
+                    except asyncio.CancelledError:
+                        # slot taken after caller went away is given back
+                        waiting.add_done_callback(lambda f, limiter=limiter: f.exception() or limiter.release(f.result()))
+                        raise
+                slots.append((limiter, started))
+            return await self._invoke_async(kwargs)
+        finally:
+            self._release_slots(slots)
+
+    async def _invoke_async(self, kwargs):
+        if isinstance(self.provider, PoolProvider):
+            import asyncio
+            # checkout may block until an instance is returned to the pool
+            executor = await asyncio.get_running_loop().run_in_executor(None, self.provider.acquire)
+        else:
+            executor = self.provider.acquire()
+        try:
+            return await self._method(executor)(**kwargs)
+        finally:
+            self.provider.release(executor)
+
+class CommandRegistry:
     """
-    if not isinstance(classes, list):
+    Compiled view of the commands exposed by a list of classes.
+    Specs are built once (on first access) and commands are looked up by name in O(1).
+    Call `invalidate()` to force specs to be rebuilt on next access, e.g. after
+    VALID_VALUES changed or classes were modified at runtime.
+    :param classes: list of classes to expose commands from
+    """
+    def __init__(self, classes):
+        if not isinstance(classes, (list, tuple)):
+            classes = [classes]
+        self.classes = list(classes)
+        self._lock = threading.Lock()
+        self._specs = None
+        self._commands = {}
+
+    def _build(self):
+        with self._lock:
+            if self._specs is not None:
+                return self._specs
+            specs = get_command_specs(self.classes)
+            commands = {}
+            for spec in specs:
+                # first class defining the command wins, same as linear lookup did
+                if spec["name"] in commands:
+                    continue
+                cls = next(cls for cls in self.classes if hasattr(cls, spec["method_name"]))
+                commands[spec["name"]] = CompiledCommand(spec, cls)
+            self._commands = commands
+            self._specs = specs
+            return specs
+
+    @property
+    def specs(self):
+        """
+        List of command specs in the same format as returned by `get_command_specs`.
+        """
+        specs = self._specs
+        if specs is None:
+            specs = self._build()
+        return specs
+
+    def command(self, name) -> CompiledCommand:
+        """
+        Get compiled command with given name.
+        :param name: command name
+        :return: CompiledCommand
+        :raises ValueError: if command does not exist
+        """
+        if self._specs is None:
+            self._build()
+        try:
+            return self._commands[name]
+        except KeyError:
+            raise ValueError("Command %s not found" % name) from None
+
+    def get(self, name):
+        """
+        Get spec of the command with given name.
+        :param name: command name
+        :return: command spec
+        :raises ValueError: if command does not exist
+        """
+        return self.command(name).spec
+
+    def owner(self, name):
+        """
+        Get class which implements command with given name.
+        """
+        return self.command(name).cls
+
+    def warmup(self):
+        """
+        Build specs and create instances of singleton and pooled command classes upfront,
+        so the first request does not pay for expensive constructors. Servers call it at start.
+        Worker processes for cpu_bound commands are started too.
+        """
+        for cls in self.classes:
+            get_instance_provider(cls).warmup()
+        if any("cpu_bound" in spec["tags"] for spec in self.specs):
+            from orgasm.process_pool import get_process_pool
+            get_process_pool().warmup()
+
+    def invalidate(self):
+        """
+        Drop compiled specs so they are rebuilt on next access.
+        Instances of command classes are kept.
+        """
+        with self._lock:
+            self._specs = None
+            self._commands = {}
+
+    def __contains__(self, name):
+        if self._specs is None:
+            self._build()
+        return name in self._commands
+
+    def __iter__(self):
+        return iter(self.specs)
+
+    def __len__(self):
+        return len(self.specs)
+
+
+_registries: Dict[tuple, CommandRegistry] = {}
+_registries_lock = threading.Lock()
+
+def get_registry(classes) -> CommandRegistry:
+    """
+    Get shared registry for given classes. Registries are cached per class set so
+    every frontend and every `execute_command` call for the same classes reuses it.
+    :param classes: list of classes, single class or already built CommandRegistry
+    :return: CommandRegistry
+    """
+    if isinstance(classes, CommandRegistry):
+        return classes
+    if not isinstance(classes, (list, tuple)):
         classes = [classes]
-    parser = argparse.ArgumentParser()
-    command_parsers = parser.add_subparsers(dest="command")
-    spec = get_command_specs(classes)
-    commands: Dict[str, argparse.ArgumentParser] = {}
-    for command in spec:
-        commands[command["name"]] = command_parsers.add_parser(command["name"])
-        short_options = set()
-        for arg in command["args"]:
-            parser_params = {}
-            if arg["type"] != bool:
-                if not explicit_params and arg["required"]:
-                    commands[command["name"]].add_argument("%s" % arg["name"],
-                        type=arg["type"],
-                        help=arg["help"],
-                        choices=arg["valid_values"],
-                        default=arg.get("default", None),
-                        action="store" 
-                    )
-                else:
-                    short = ""
-                    if arg["name"][0] not in short_options:
-                        short = "-%s " % arg["name"][0]
-                        short_options.add(arg["name"][0])
-                    if short != "":
-                        commands[command["name"]].add_argument(short, "--%s" % arg["name"].replace("_", "-"),
-                            required=arg["required"], 
-                            type=arg["type"],
-                            help=arg["help"],
-                            choices=arg["valid_values"],
-                            default=arg.get("default", None),
-                            action="store" 
-                        )
-                    else:
-                        commands[command["name"]].add_argument("--%s" % arg["name"].replace("_", "-"),
-                            required=arg["required"], 
-                            type=arg["type"],
-                            help=arg["help"],
-                            choices=arg["valid_values"],
-                            default=arg.get("default", None),
-                            action="store" 
-                        )
+    key = tuple(classes)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = CommandRegistry(classes)
+                _registries[key] = registry
+    return registry
+
+def invalidate_registries():
+    """
+    Invalidate all shared registries so specs are rebuilt on next access.
+    """
+    with _registries_lock:
+        for registry in _registries.values():
+            registry.invalidate()
+
+def execute_command(classes, command: str, params):
+    """
+    Execute command with given parameters.
+    :param classes: list of classes or CommandRegistry
+    :param command: command name
+    :param params: dict of parameter values, coerced to declared argument types
+    :return: command result
+    """
+    return get_registry(classes).command(command)(params)
+
+async def execute_command_async(classes, command: str, params, executor=None):
+    """
+    Execute command from a running event loop.
+    Async commands are awaited directly, sync commands are run in executor.
+    :param classes: list of classes or CommandRegistry
+    :param command: command name
+    :param params: dict of parameter values
+    :param executor: concurrent.futures.Executor for sync commands, None for loop default executor
+    :return: command result
+    """
+    return await get_registry(classes).command(command).call_async(params, executor)
+
+def _add_command_arguments(command_parser, command, explicit_params):
+    short_options = set()
+    for arg in command["args"]:
+        parser_params = {}
+        if arg["type"] != bool:
+            if not explicit_params and arg["required"]:
+                command_parser.add_argument("%s" % arg["name"],
+                    type=arg["type"],
+                    help=arg["help"],
+                    choices=arg["valid_values"],
+                    default=arg.get("default", None),
+                    action="store" 
+                )
             else:
                 short = ""
                 if arg["name"][0] not in short_options:
                     short = "-%s " % arg["name"][0]
                     short_options.add(arg["name"][0])
                 if short != "":
-                    commands[command["name"]].add_argument(short, "--%s" % arg["name"].replace("_", "-"),
+                    command_parser.add_argument(short, "--%s" % arg["name"].replace("_", "-"),
                         required=arg["required"], 
+                        type=arg["type"],
                         help=arg["help"],
-                        action="store_true" 
+                        choices=arg["valid_values"],
+                        default=arg.get("default", None),
+                        action="store" 
                     )
                 else:
-                    commands[command["name"]].add_argument("--%s" % arg["name"].replace("_", "-"),
+                    command_parser.add_argument("--%s" % arg["name"].replace("_", "-"),
                         required=arg["required"], 
+                        type=arg["type"],
                         help=arg["help"],
-                        action="store_true" 
-                    )    
+                        choices=arg["valid_values"],
+                        default=arg.get("default", None),
+                        action="store" 
+                    )
+        else:
+            short = ""
+            if arg["name"][0] not in short_options:
+                short = "-%s " % arg["name"][0]
+                short_options.add(arg["name"][0])
+            if short != "":
+                command_parser.add_argument(short, "--%s" % arg["name"].replace("_", "-"),
+                    required=arg["required"], 
+                    help=arg["help"],
+                    action="store_true" 
+                )
+            else:
+                command_parser.add_argument("--%s" % arg["name"].replace("_", "-"),
+                    required=arg["required"], 
+                    help=arg["help"],
+                    action="store_true" 
+                )
+
+def build_command_parser(specs, explicit_params=True, command=None):
+    """
+    Build argument parser of the command line interface.
+    Every command gets its subparser, but arguments are added only to the subparser of the chosen command,
+    so the cost does not grow with the number of commands.
+    :param specs: command specs
+    :param explicit_params: see `command_executor_main`
+    :param command: name of the chosen command, None if no command was chosen yet
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true",
+        help="run the command under cProfile, write pstats and collapsed stacks files and print hottest functions")
+    parser.add_argument("--profile-output", metavar="FILE",
+        help="pstats file written by --profile, collapsed stacks go next to it (default orgasm-<command>-<time>.pstats)")
+    command_parsers = parser.add_subparsers(dest="command")
+    for spec in specs:
+        command_parser = command_parsers.add_parser(spec["name"])
+        if spec["name"] == command:
+            _add_command_arguments(command_parser, spec, explicit_params)
+    return parser
+
+def _command_line_words():
+    if "_ARGCOMPLETE" in os.environ:
+        # argcomplete passes the line being completed in environment, the last word may be incomplete
+        line = os.environ.get("COMP_LINE", "")
+        line = line[:int(os.environ.get("COMP_POINT", len(line)))]
+        words = line.split()
+        if words and not line.endswith(" "):
+            words = words[:-1]
+        return words[1:]
+    return sys.argv[1:]
+
+def _argcomplete():
+    """
+    Get argcomplete module when the program runs to complete the command line, None otherwise.
+    """
+    if "_ARGCOMPLETE" not in os.environ:
+        return None
+    try:
+        import argcomplete
+        return argcomplete
+    except ImportError:
+        return None
+
+def _chosen_command(names):
+    """
+    Find command chosen on the command line (or on the line being completed) before it is parsed.
+    :return: command name or None
+    """
+    words = iter(_command_line_words())
+    for word in words:
+        if word == "--profile-output":
+            next(words, None)
+        elif word in names:
+            return word
+        elif not word.startswith("-"):
+            return None
+    return None
+
+def command_executor_main(classes, explicit_params=True):
+    """
+    Command line interface for executing commands in classes.
+    :param classes: list of classes to execute commands from
+    :param explicit_params: if True, all parameters must be specified in the command line which are required for the command. If False, then only values for these parameters which are not default values must be specified.
+
+    Example:
+    if we have class with method `def foo(self, a: int, *, b: str = "default", c: str = "default")` then:
+    if explicit_params = True, then we must specify all parameters in the command line:
+        app foo --a 1 
+    if explicit_params = False, then we can specify only the parameters which are not default values:
+        app foo 1 
+    """
+    if not isinstance(classes, list):
+        classes = [classes]
+    registry = get_registry(classes)
+    names = set(spec["name"] for spec in registry.specs)
+    parser = build_command_parser(registry.specs, explicit_params, _chosen_command(names))
+    argcomplete = _argcomplete()
     if argcomplete is not None:
         argcomplete.autocomplete(parser)
     args, _ = parser.parse_known_args()
@@ -262,15 +1025,21 @@ def command_executor_main(classes, explicit_params=True):
         parser.print_help()
         sys.exit(1)
     params = {}
-    command = [x for x in spec if x["name"] == args.command]
-    if len(command) == 0:
-        raise ValueError("Command %s not found" % args.command)
-    command = command[0]
+    command = registry.get(args.command)
     for arg in command["args"]:
         if arg["name"] in vars(args):
             params[arg["name"]] = getattr(args, arg["name"])
     try:
-        result = execute_command(classes, args.command, params)
+        if args.profile or args.profile_output:
+            from orgasm import profiling
+            def save_profile(profile):
+                path = args.profile_output or "orgasm-%s-%s.pstats" % (args.command, time.strftime("%Y%m%d-%H%M%S"))
+                path, collapsed = profiling.write_profile(profile, path)
+                profiling.print_summary(profile)
+                print("Profile written to %s and %s" % (path, collapsed), file=sys.stderr)
+            result = profiling.run_profiled(execute_command, (registry, args.command, params), save_profile)
+        else:
+            result = execute_command(registry, args.command, params)
         if isinstance(result, str):
             print(result)
         elif isinstance(result, dict):
@@ -279,6 +1048,10 @@ def command_executor_main(classes, explicit_params=True):
         elif isinstance(result, list):
             for item in result:
                 print(item)
+        elif inspect.isgenerator(result):
+            # print streamed items as they are produced
+            for item in result:
+                print(item, flush=True)
         else:
             print(result)
     except Exception as e:
@@ -286,6 +1059,35 @@ def command_executor_main(classes, explicit_params=True):
         # sys.exit(1)
         raise e
 
+def cli_main(module_names, explicit_params=True):
+    """
+    Command line interface for commands of classes in modules, see `command_executor_main`.
+    Specs are cached on disk (see `orgasm.spec_cache`), so with a fresh cache tab completion under argcomplete
+    is answered without importing the modules. Add "# PYTHON_ARGCOMPLETE_OK" to the script to enable it.
+    :param module_names: name or list of names of modules, classes are found with `get_classes`
+    :param explicit_params: see `command_executor_main`
+    """
+    from orgasm import spec_cache
+    if isinstance(module_names, str):
+        module_names = [module_names]
+    argcomplete = _argcomplete()
+    if argcomplete is not None:
+        specs = spec_cache.load_spec_cache(module_names)
+        if specs is not None:
+            commands = {spec["name"]: spec for spec in specs}
+            command = _chosen_command(commands)
+            if command is None or not spec_cache.has_expired_values(commands[command]):
+                # exits after printing completions
+                argcomplete.autocomplete(build_command_parser(specs, explicit_params, command))
+    classes = []
+    for module_name in module_names:
+        classes += get_classes(module_name)
+    registry = get_registry(classes)
+    if spec_cache.load_spec_cache(module_names) is None or "_ARGCOMPLETE" in os.environ:
+        # completion got here because cache is stale or values expired
+        spec_cache.write_spec_cache(module_names, registry)
+    command_executor_main(classes, explicit_params)
+
 def get_classes(module_name):
     import importlib
     module = importlib.import_module(module_name)
@@ -300,33 +1102,187 @@ def get_classes(module_name):
     result = list(classes.values())
     return result
 
-def command_executor_rpc(classes, port: int = 8000):
+def command_executor_rpc(classes, port: int = 8000, binary_port: int = None, compress_threshold: int = 16 * 1024,
+                         workers: int = 32, queue_size: int = 128, queue_full: str = "block", drain_timeout: float = 30,
+                         keepalive_timeout: float = 15, profile_rate: int = 0, profile_dir: str = None,
+                         profile_forced: bool = False):
+    """
+    Serve commands over XML-RPC. Commands are called with `execute(command, params)`,
+    several calls can be combined into one request with `system.multicall`.
+    Long-running commands can be run in background with `submit(command, params)`, which returns job status
+    with its id, then polled with `job_status(id)`, `job_result(id)` and cancelled with `job_cancel(id)`.
+    Commands with background attribute are always submitted as jobs.
+    Per-command call counts, errors and latency histograms are returned by `system.stats()`
+    (`stats()` over binary transport).
+    Calls are profiled when sampled, or called as `execute(command, params, True)` if profile_forced is set,
+    hottest functions per command are returned by `system.profiles(command, limit)` (`profiles()` over binary
+    transport).
+    :param classes: list of classes to execute commands from
+    :param port: port of XML-RPC server
+    :param binary_port: if set, the same dispatcher is also served over binary transport on this port,
+        see `orgasm.rpc.BinaryRPCClient`
+    :param compress_threshold: binary transport compresses frames larger than this many bytes
+    :param workers: number of threads handling connections, binary transport has the same number of connection
+        threads, queue_size and queue_full
+    :param queue_size: number of accepted connections waiting for a worker
+    :param queue_full: what happens to new connections when queue is full, "block" (wait in listen backlog),
+        "reject" (503 response) or "drop" (close), see `orgasm.server_pool.PooledMixIn`
+    :param drain_timeout: on shutdown (SIGTERM, SIGINT) wait this many seconds for calls in progress
+    :param keepalive_timeout: close keep-alive connections idle for this many seconds
+    :param profile_rate: profile 1 in profile_rate calls, 0 disables sampling
+    :param profile_dir: directory for profiles, see `orgasm.profiling.RequestProfiler`
+    :param profile_forced: whether calls may ask to be profiled
+    """
+    import signal
+    import xmlrpc.client
+    from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+    from orgasm import request_log
+    from orgasm.server_pool import PooledMixIn
+    if queue_full not in ["block", "reject", "drop"]:
+        raise ValueError("Invalid queue_full %s" % queue_full)
     if not isinstance(classes, list):
         classes = [classes]
     class RequestHandler(SimpleXMLRPCRequestHandler):
         rpc_paths = ('/RPC2',)
+        # keep connections alive so clients can reuse them
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+        # close idle keep-alive connections
+        timeout = keepalive_timeout
 
-    # Create a class that combines ThreadingMixIn and SimpleXMLRPCServer
-    class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
-        pass
-    server = ThreadedXMLRPCServer(("0.0.0.0", port), requestHandler=RequestHandler)
+        def log_message(self, format, *args):
+            # per-request lines are off (logRequests=False), calls are logged by the dispatcher,
+            # only protocol errors get here
+            request_log.logger.log(request_log.WARNING, "rpc_http_error", client=self.address_string(),
+                                   message=format % args)
+
+        def setup(self):
+            super().setup()
+            self.requests_handled = 0
+
+        def handle_one_request(self):
+            # idle keep-alive connection must not hold the worker while other connections wait for one
+            if self.requests_handled and not self.server.wait_for_request(self.connection, self.timeout, self.rfile):
+                self.close_connection = True
+                return
+            self.requests_handled += 1
+            super().handle_one_request()
+
+    # Create a class that combines worker pool and SimpleXMLRPCServer
+    class PooledXMLRPCServer(PooledMixIn, SimpleXMLRPCServer):
+        def reject_request(self, request, client_address):
+            request.sendall(
+                b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+            )
+    PooledXMLRPCServer.workers = workers
+    PooledXMLRPCServer.queue_size = queue_size
+    PooledXMLRPCServer.queue_full = queue_full
+    PooledXMLRPCServer.drain_timeout = drain_timeout
+    # requests are logged through orgasm.request_log, not written to stderr by the handler
+    server = PooledXMLRPCServer(("0.0.0.0", port), requestHandler=RequestHandler, logRequests=False)
     class Dispatcher:
         def __init__(self, classes):
+            from orgasm.jobs import JobManager
+            from orgasm.profiling import RequestProfiler
             self.classes = classes
-        def execute(self, command, params):
+            self.registry = get_registry(classes)
+            self.registry.warmup()
+            self.jobs = JobManager(self.registry)
+            self.profiler = RequestProfiler(profile_dir, profile_rate, allow_forced=profile_forced)
+        def execute(self, command, params, profile=False):
+            if command in self.registry and self.registry.get(command)["attrs"].get("background"):
+                return self.submit(command, params)
             # do it as separate thread 
-            print("Executing %s with params %s" % (command , params))
+            started = time.perf_counter()
             result = None
             try:
-                result = execute_command(self.classes, command, params)
+                if self.profiler.should_profile(profile):
+                    result = self.profiler.call(command, execute_command, self.registry, command, params)
+                else:
+                    result = execute_command(self.registry, command, params)
+                if inspect.isgenerator(result):
+                    # XML-RPC has no streaming, whole response is built at once
+                    result = list(result)
+            except limits.Overloaded as e:
+                request_log.logger.request("rpc", command, params, started, error=e, status="overloaded")
+                raise xmlrpc.client.Fault(limits.OVERLOADED_FAULT_CODE, "%s (retry after %d s)" % (e, e.retry_after))
             except Exception as e:
-                print("Error: %s" % e)
-                print(traceback.format_exc())
+                request_log.logger.request("rpc", command, params, started, error=e)
                 raise e 
-            print("Result: %s" % result)
+            request_log.logger.request("rpc", command, params, started, result)
             if isinstance(result, Path):
                 return str(result)
             else:
                 return result
-    server.register_instance(Dispatcher(classes))
-    server.serve_forever()
\ No newline at end of file
+        def execute_stream(self, command, params, profile=False):
+            # items of generator results are sent as they are produced, only binary transport can stream
+            started = time.perf_counter()
+            try:
+                if self.profiler.should_profile(profile):
+                    result = self.profiler.call(command, execute_command, self.registry, command, params)
+                else:
+                    result = execute_command(self.registry, command, params)
+            except Exception as e:
+                request_log.logger.request("rpc", command, params, started, error=e,
+                                           status="overloaded" if isinstance(e, limits.Overloaded) else None)
+                raise
+            request_log.logger.request("rpc", command, params, started, result)
+            return result
+        def submit(self, command, params):
+            from orgasm.jobs import JobQueueFull
+            started = time.perf_counter()
+            try:
+                job = self._job_status(self.jobs.submit(command, params))
+            except JobQueueFull as e:
+                request_log.logger.request("rpc", command, params, started, error=e, status="overloaded")
+                raise ValueError(str(e))
+            request_log.logger.request("rpc", command, params, started, job, status="submitted")
+            return job
+        def job_status(self, job_id):
+            return self._job_status(self._job(job_id))
+        def job_result(self, job_id):
+            from orgasm.jobs import DONE, FAILED
+            job = self._job(job_id)
+            if job.status == FAILED:
+                raise ValueError(job.error)
+            if job.status != DONE:
+                raise ValueError("Job %s is %s" % (job_id, job.status))
+            return str(job.result) if isinstance(job.result, Path) else job.result
+        def job_cancel(self, job_id):
+            self._job(job_id)
+            return self.jobs.cancel(job_id)
+        def stats(self):
+            # per-command metrics, see orgasm.metrics
+            return metrics.to_dict()
+        def profiles(self, command="", limit=20):
+            # hottest functions of profiled calls, empty command means all commands
+            return self.profiler.top(command or None, limit)
+        def _job(self, job_id):
+            job = self.jobs.get(job_id)
+            if job is None:
+                raise ValueError("Job %s not found" % job_id)
+            return job
+        def _job_status(self, job):
+            # XML-RPC can not send None
+            return {key: value for key, value in job.to_dict().items() if value is not None}
+    dispatcher = Dispatcher(classes)
+    server.register_instance(dispatcher)
+    server.register_function(dispatcher.stats, "system.stats")
+    server.register_function(dispatcher.profiles, "system.profiles")
+    server.register_multicall_functions()
+    if binary_port is not None:
+        from orgasm.rpc import serve_binary_rpc
+        serve_binary_rpc(
+            dispatcher, binary_port, compress_threshold=compress_threshold,
+            connections=workers, queue_size=queue_size, queue_full=queue_full,
+        )
+    if threading.current_thread() is threading.main_thread():
+        # serve_forever has to be stopped from another thread
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Shutting down, waiting for calls in progress")
+        server.server_close()
\ No newline at end of file
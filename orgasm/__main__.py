@@ -0,0 +1,57 @@
+# Launcher serving commands of a module with any frontend:
+#     python -m orgasm <module> cli|rest|web|rpc|repl|gui [options]
+# Only the chosen frontend is imported, so e.g. the command line interface does not load Flask or Qt.
+# With cli mode all further arguments are passed to the command line interface of the module.
+import sys
+
+MODES = ["cli", "rest", "web", "rpc", "repl", "gui"]
+
+USAGE = "usage: python -m orgasm <module> {%s} [options]" % ",".join(MODES)
+
+
+def parse_options(module_name, mode, argv, **defaults):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m orgasm %s %s" % (module_name, mode))
+    for name, default in defaults.items():
+        parser.add_argument("--%s" % name.replace("_", "-"), type=type(default) if default is not None else int, default=default)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2 or argv[1] not in MODES:
+        print(USAGE, file=sys.stderr)
+        return 2
+    module_name, mode, rest = argv[0], argv[1], argv[2:]
+    if mode == "cli":
+        from orgasm import cli_main
+        sys.argv = ["python -m orgasm %s cli" % module_name] + rest
+        cli_main(module_name)
+        return 0
+    from orgasm import get_classes
+    if mode == "rest":
+        options = parse_options(module_name, mode, rest, host="127.0.0.1", port=5000, server="flask")
+        from orgasm.http_rest import serve_rest_api
+        serve_rest_api(get_classes(module_name), port=options.port, host=options.host, server=options.server)
+    elif mode == "web":
+        options = parse_options(module_name, mode, rest, host="127.0.0.1", port=8080, server="flask")
+        from orgasm.web import serve_web
+        serve_web(get_classes(module_name), port=options.port, host=options.host, server=options.server, debug=False)
+    elif mode == "rpc":
+        options = parse_options(module_name, mode, rest, port=8000, binary_port=None)
+        from orgasm import command_executor_rpc
+        command_executor_rpc(get_classes(module_name), port=options.port, binary_port=options.binary_port)
+    elif mode == "repl":
+        parse_options(module_name, mode, rest)
+        from orgasm.repl import launch_repl
+        launch_repl(get_classes(module_name))
+    elif mode == "gui":
+        options = parse_options(module_name, mode, rest, title="ORGASM GUI")
+        from orgasm.gui import create_main_window
+        # window runs until it is closed
+        create_main_window(get_classes(module_name), options.title)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+
+from orgasm import request_log
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry expiration.
+    :param maxsize: maximal number of entries, least recently used entries are evicted first
+    :param ttl: default time to live of entries in seconds, None means entries never expire
+    """
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_entry(self, key, count=False):
+        """
+        Get (value, expires_at) for key without checking expiration, so expired values can still be served.
+        :param count: count missing key as miss and entry which did not expire as hit, expired entry counts
+            as neither
+        :return: tuple or None if key is not cached
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if count and (entry[1] is None or entry[1] > now):
+                self.hits += 1
+            return entry
+
+    def get(self, key, default=None):
+        """
+        Get value for key if it is cached and not expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[1] is not None and entry[1] <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """
+        Store value for key.
+        :param ttl: time to live in seconds, defaults to cache ttl
+        :param expires_at: absolute expiration as time.monotonic() timestamp, overrides ttl
+        """
+        if expires_at is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        Remove key from the cache, or all keys if key is None.
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """
+        Remove all entries whose key satisfies predicate.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def valid_values_ttl(ttl):
+    """
+    Decorator to set time to live of cached values for a VALID_VALUES provider.
+    ttl=0 disables caching and the provider is called every time.
+
+    Example:
+        VALID_VALUES = {"cmd": {"arg": valid_values_ttl(300)(lambda: load_from_db())}}
+    """
+    def decorator(provider):
+        provider.valid_values_ttl = ttl
+        return provider
+    return decorator
+
+
+def normalize_valid_values(values):
+    """
+    Convert value returned by VALID_VALUES entry (or its provider) into list.
+    """
+    if hasattr(values, "__iter__") and not isinstance(values, str):
+        return list(values)
+    return [values]
+
+
+class ValidValuesCache:
+    """
+    Cache for callable VALID_VALUES providers.
+    Values are fetched synchronously the first time. After ttl expires, stale values are
+    served while the provider is called again in a background thread.
+    :param ttl: default time to live in seconds, providers can override it with valid_values_ttl
+    :param maxsize: maximal number of cached providers
+    """
+    def __init__(self, ttl=30.0, maxsize=256):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize=maxsize)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _ttl(self, provider):
+        ttl = getattr(provider, "valid_values_ttl", None)
+        return self.ttl if ttl is None else ttl
+
+    def refresh(self, provider):
+        """
+        Call provider synchronously and store its values.
+        :return: new values
+        """
+        values = normalize_valid_values(provider())
+        self._cache.set(provider, values, ttl=self._ttl(provider))
+        return values
+
+    def _refresh_in_background(self, provider):
+        with self._lock:
+            if provider in self._refreshing:
+                return
+            self._refreshing.add(provider)
+        def refresh():
+            try:
+                self.refresh(provider)
+            except Exception as e:
+                # keep serving stale values, next access retries
+                request_log.logger.log(
+                    request_log.ERROR, "valid_values_refresh_failed",
+                    provider=getattr(provider, "__qualname__", repr(provider)), error="%s: %s" % (type(e).__name__, e),
+                )
+            finally:
+                with self._lock:
+                    self._refreshing.discard(provider)
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def get(self, provider):
+        """
+        Get values of provider, calling it only when needed.
+        """
+        if self._ttl(provider) == 0:
+            return normalize_valid_values(provider())
+        entry = self._cache.get_entry(provider, count=True)
+        if entry is None:
+            return self.refresh(provider)
+        values, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._refresh_in_background(provider)
+        return values
+
+    def invalidate(self, provider=None):
+        """
+        Drop cached values of provider, or of all providers if provider is None.
+        Next access calls the provider synchronously.
+        """
+        self._cache.invalidate(provider)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,321 @@
+# Client library for ORGASM servers. Methods are generated from command specs, arguments are
+# validated locally before anything is sent, and connections are kept alive in a thread-safe pool.
+import http.client
+import inspect
+import json
+import queue
+import xmlrpc.client
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+from orgasm import compile_binder
+from orgasm.http_rest import binary_arg, get_http_method, is_binary
+
+TYPES = {
+    "int": int,
+    "str": str,
+    "float": float,
+    "bool": bool,
+    "bytes": bytes,
+    "memoryview": memoryview,
+    "list": list,
+    "dict": dict,
+    # paths refer to server file system, they can not be checked on client
+    "Path": str,
+}
+
+
+class CommandError(Exception):
+    """
+    Error returned by the server for a command call.
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def client_spec(spec):
+    """
+    Convert command spec (from `get_command_specs` or REST /commands endpoint) into spec used by client.
+    Type names are resolved to types, Path arguments become strings and argument filled in by the server
+    from authorization (http_auth user_arg) is removed.
+    """
+    server_filled = spec.get("attrs", {}).get("http_auth_pass_user_id")
+    args = []
+    for arg in spec["args"]:
+        if arg["name"] == server_filled:
+            continue
+        arg_type = arg.get("type")
+        if isinstance(arg_type, str):
+            arg_type = TYPES.get(arg_type)
+        elif arg_type == Path:
+            arg_type = str
+        args.append(dict(arg, type=arg_type))
+    return dict(spec, args=args)
+
+
+def query_value(value):
+    """
+    Encode value of query string parameter the way the server coerces it back,
+    bool arguments are converted with bool() so False is sent as empty string.
+    """
+    if isinstance(value, bool):
+        return "1" if value else ""
+    return str(value)
+
+
+def command_signature(spec):
+    parameters = [inspect.Parameter("self", inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+    for arg in spec["args"]:
+        annotation = arg["type"] if arg["type"] is not None else inspect.Parameter.empty
+        if arg["required"]:
+            parameters.append(inspect.Parameter(arg["name"], inspect.Parameter.POSITIONAL_OR_KEYWORD, annotation=annotation))
+    for arg in spec["args"]:
+        annotation = arg["type"] if arg["type"] is not None else inspect.Parameter.empty
+        if not arg["required"]:
+            parameters.append(inspect.Parameter(arg["name"], inspect.Parameter.KEYWORD_ONLY, default=arg.get("default"), annotation=annotation))
+    return inspect.Signature(parameters)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP connections to one server.
+    :param host: server host
+    :param port: server port
+    :param size: maximal number of idle connections kept open
+    :param timeout: socket timeout in seconds
+    """
+    def __init__(self, host, port, size=8, timeout=None, https=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection_class = http.client.HTTPSConnection if https else http.client.HTTPConnection
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out connection for exclusive use. Broken connections are not returned to the pool.
+        """
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._connect(), False
+        ok = False
+        try:
+            yield conn, reused
+            ok = True
+        finally:
+            if ok and conn.sock is not None:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            else:
+                conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Send request and read whole response.
+        Request is retried once on new connection if reused keep-alive connection was closed by the server.
+        :return: tuple (status, response headers, body)
+        """
+        for attempt in range(2):
+            with self.connection() as (conn, reused):
+                try:
+                    conn.request(method, path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                if response.will_close:
+                    conn.close()
+                return response.status, response.headers, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class CommandClient:
+    """
+    Base class of generated clients. Every command is available as method with the signature of the command,
+    and through `call(command, **params)`. Arguments are coerced and checked against valid values locally.
+    Subclasses implement `send(spec, params)`.
+    :param specs: list of command specs
+    """
+    def __init__(self, specs):
+        self.specs = {}
+        self._binders = {}
+        for spec in specs:
+            spec = client_spec(spec)
+            self.specs[spec["name"]] = spec
+            self._binders[spec["name"]] = compile_binder(spec)
+            if not hasattr(self, spec["name"]):
+                setattr(self, spec["name"], self._make_method(spec))
+
+    def _make_method(self, spec):
+        signature = command_signature(spec)
+        name = spec["name"]
+        def method(*args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.arguments.pop("self")
+            return self.call(name, **bound.arguments)
+        method.__name__ = name
+        method.__signature__ = signature.replace(parameters=list(signature.parameters.values())[1:])
+        method.__doc__ = "\n".join(
+            ":param %s: %s" % (arg["name"], arg.get("help") or "") for arg in spec["args"]
+        ) or None
+        return method
+
+    def call(self, command, **params):
+        """
+        Validate arguments locally and execute command on the server.
+        :raises ValueError: if arguments are invalid
+        :raises CommandError: if server reported an error
+        """
+        if command not in self.specs:
+            raise ValueError("Command %s not found" % command)
+        kwargs = self._binders[command](params)
+        # only send what caller provided, server applies its own defaults
+        params = {name: value for name, value in kwargs.items() if name in params}
+        return self.send(self.specs[command], params)
+
+    def send(self, spec, params):
+        raise NotImplementedError()
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.specs)
+
+
+class RestClient(CommandClient):
+    """
+    Client for REST API served by `serve_rest_api`.
+    Specs are fetched from /commands endpoint unless given.
+
+    Example:
+        client = RestClient("http://localhost:5000", token="v1....")
+        client.sum(1, 2, c=3)
+    """
+    def __init__(self, url, token=None, specs=None, pool_size=8, timeout=None):
+        parts = urlsplit(url)
+        https = parts.scheme == "https"
+        self.base_path = parts.path.rstrip("/")
+        self.token = token
+        self.pool = ConnectionPool(parts.hostname, parts.port or (443 if https else 80), pool_size, timeout, https)
+        if specs is None:
+            specs = self._request("GET", "/commands")
+        super().__init__(specs)
+
+    def _request(self, method, path, body=None):
+        headers = {}
+        if self.token is not None:
+            headers["Authorization"] = "Bearer " + self.token
+        if is_binary(body):
+            headers["Content-Type"] = "application/octet-stream"
+        elif body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+        status, response_headers, data = self.pool.request(method, self.base_path + path, body, headers)
+        if status < 400 and response_headers.get_content_type() == "application/octet-stream":
+            return data
+        result = json.loads(data) if data else None
+        if status >= 400:
+            message = result.get("error") if isinstance(result, dict) else data.decode(errors="replace")
+            raise CommandError(message, status)
+        return result
+
+    def send(self, spec, params):
+        method = get_http_method(spec)
+        path = "/" + spec["method_name"]
+        if method in ["GET", "DELETE"]:
+            query = urlencode({name: query_value(value) for name, value in params.items()})
+            return self._request(method, path + ("?" + query if query else ""))
+        name = binary_arg(spec)
+        if name is not None and is_binary(params.get(name)):
+            # binary value is sent as raw body instead of JSON, other arguments go to query string
+            query = urlencode({key: query_value(value) for key, value in params.items() if key != name})
+            return self._request(method, path + ("?" + query if query else ""), params[name])
+        return self._request(method, path, params)
+
+    def batch(self, calls, parallel=False):
+        """
+        Execute several commands in one request through /batch endpoint.
+        :param calls: list of (command, params) tuples, params are validated locally
+        :return: list of {"result": value} or {"error": message, "status": code}
+        """
+        items = []
+        for command, params in calls:
+            kwargs = self._binders[command](params)
+            items.append({"command": command, "params": {k: v for k, v in kwargs.items() if k in params}})
+        return self._request("POST", "/batch", {"items": items, "parallel": parallel})
+
+    def close(self):
+        self.pool.close()
+
+
+class RPCClient(CommandClient):
+    """
+    Client for XML-RPC server started with `command_executor_rpc`.
+    XML-RPC server does not expose specs, they have to be given or built from command classes.
+    Each pooled proxy keeps its own HTTP/1.1 connection alive.
+
+    Example:
+        client = RPCClient("http://localhost:8000", classes=get_classes("example_commands"))
+        client.sum(1, 2)
+    """
+    def __init__(self, url, specs=None, classes=None, pool_size=8):
+        if specs is None:
+            if classes is None:
+                raise ValueError("Either specs or classes must be given")
+            from orgasm import get_registry
+            specs = get_registry(classes).specs
+        self.url = url
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        super().__init__(specs)
+
+    @contextmanager
+    def proxy(self):
+        """
+        Check out ServerProxy for exclusive use, proxies are not thread-safe.
+        """
+        try:
+            proxy = self._idle.get_nowait()
+        except queue.Empty:
+            proxy = xmlrpc.client.ServerProxy(self.url, allow_none=True)
+        ok = False
+        try:
+            yield proxy
+            ok = True
+        finally:
+            if ok:
+                try:
+                    self._idle.put_nowait(proxy)
+                except queue.Full:
+                    proxy("close")()
+            else:
+                proxy("close")()
+
+    def send(self, spec, params):
+        with self.proxy() as proxy:
+            try:
+                return proxy.execute(spec["name"], params)
+            except xmlrpc.client.Fault as e:
+                raise CommandError(e.faultString, e.faultCode) from None
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait()("close")()
+            except queue.Empty:
+                return
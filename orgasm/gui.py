@@ -1,6 +1,9 @@
 from ast import Str
+import inspect
 from pathlib import Path
 import sys
+import threading
+import time
 from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
 
 from PySide6.QtWidgets import (
@@ -24,11 +27,16 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtGui import QIntValidator, QDoubleValidator
 from PySide6.QtWidgets import QFileDialog
-from PySide6.QtCore import Qt
+from PySide6.QtCore import QObject, Qt, Signal
 
-from orgasm import get_command_specs, execute_command
+from orgasm import get_command_specs, execute_command, get_registry
 
 
+# maximum number of streamed items sent to result widget at once
+STREAM_BATCH_SIZE = 100
+# seconds after which a partial batch of streamed items is sent to result widget
+STREAM_BATCH_INTERVAL = 0.1
+
 FieldSpec = Tuple[str, Type, List[str]]  # (label, kind, options) where kind in {"text", "dropdown"}
 
 
@@ -73,6 +81,8 @@ def get_result_widget(result: Any) -> QWidget:
                 for item in result:
                     list_widget.addItem(str(item))
                 layout.addWidget(list_widget)
+    elif inspect.isgenerator(result):
+        add_streamed_rows(parent, layout, result)
     elif isinstance(result, QWidget):
         # if result is already a QWidget, just return it
         return result
@@ -85,6 +95,110 @@ def get_result_widget(result: Any) -> QWidget:
         raise ValueError(f"Unsupported result type: {type(result)}")
     return parent
 
+class StreamReader(QObject):
+    """
+    Consumes generator result in a worker thread and sends its items to the GUI thread in batches.
+    :param result: generator to consume
+    :param parent: owner of the reader, generator is closed when it is destroyed
+    """
+    items = Signal(list)
+    finished = Signal()
+    failed = Signal(str)
+
+    def __init__(self, result, parent: QWidget | None = None) -> None:
+        super().__init__(parent)
+        self._result = result
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="orgasm-stream-reader", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        # generator can only be closed by the thread which runs it, see _run
+        self._stopped.set()
+
+    def _emit(self, signal, *args) -> bool:
+        if self._stopped.is_set():
+            return False
+        try:
+            signal.emit(*args)
+        except RuntimeError:
+            # reader was deleted together with its widget
+            self._stopped.set()
+            return False
+        return True
+
+    def _run(self) -> None:
+        batch = []
+        sent = time.monotonic()
+        try:
+            for item in self._result:
+                batch.append(item)
+                # slow generators still show their items shortly after they are produced
+                if len(batch) >= STREAM_BATCH_SIZE or time.monotonic() - sent >= STREAM_BATCH_INTERVAL:
+                    if not self._emit(self.items, batch):
+                        break
+                    batch = []
+                    sent = time.monotonic()
+                if self._stopped.is_set():
+                    break
+            else:
+                if batch and not self._emit(self.items, batch):
+                    return
+                self._emit(self.finished)
+        except Exception as e:
+            self._emit(self.failed, str(e))
+        finally:
+            self._result.close()
+
+
+def add_streamed_rows(parent: QWidget, layout: QVBoxLayout, result):
+    """
+    Show items of generator result as they are produced. Generator is consumed by a worker thread,
+    so a slow generator does not block the window, and it is closed when the widget is destroyed.
+    """
+    status = QLabel("Loading...")
+    layout.addWidget(status)
+    state = {"widget": None, "count": 0}
+
+    def add_item(item):
+        widget = state["widget"]
+        if widget is None:
+            if isinstance(item, dict):
+                widget = QTableWidget(0, len(item))
+                widget.setHorizontalHeaderLabels([str(key) for key in item.keys()])
+                widget.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+            else:
+                widget = QListWidget()
+            layout.addWidget(widget)
+            state["widget"] = widget
+        if isinstance(widget, QTableWidget):
+            row_idx = widget.rowCount()
+            widget.insertRow(row_idx)
+            values = item.values() if isinstance(item, dict) else [item]
+            for col_idx, value in enumerate(values):
+                widget.setItem(row_idx, col_idx, QTableWidgetItem(str(value)))
+        else:
+            widget.addItem(str(item))
+        state["count"] += 1
+
+    def add_items(items):
+        for item in items:
+            add_item(item)
+        status.setText("Loading... %d results so far." % state["count"])
+
+    def finish():
+        status.setText("%d results." % state["count"] if state["count"] else "No results returned.")
+
+    reader = StreamReader(result, parent)
+    # signals are emitted by the worker thread, slots must run in the GUI thread
+    reader.items.connect(add_items, Qt.ConnectionType.QueuedConnection)
+    reader.finished.connect(finish, Qt.ConnectionType.QueuedConnection)
+    reader.failed.connect(lambda message: status.setText("Error: %s" % message), Qt.ConnectionType.QueuedConnection)
+    parent.destroyed.connect(lambda *args: reader.stop())
+    reader.start()
+
 class ActionWidget(QWidget):
     """Generic widget composed of input fields and an execute button."""
 
@@ -203,7 +317,9 @@ class MainWindow(QMainWindow):
     def __init__(self, classes, title) -> None:
         super().__init__()
         self.setWindowTitle(title)
-        self.spec = get_command_specs(classes)
+        self.registry = get_registry(classes)
+        self.registry.warmup()
+        self.spec = self.registry.specs
         self.classes = classes
         central = QWidget()
         self.setCentralWidget(central)
@@ -242,12 +358,12 @@ class MainWindow(QMainWindow):
     # ------------------------------------------------------------------
     def _execute_action(self, action_name: str, values: Dict[str, str]) -> str:
         """Dispatch execution based on action name. Returns string result."""
-        cmd = next((cmd for cmd in self.spec if cmd["name"] == action_name), None)
+        cmd = self.registry.get(action_name) if action_name in self.registry else None
         match cmd:
             case None:
                 raise ValueError(f"Unknown action: {action_name}")
             case _:
-                return execute_command(self.classes, cmd["name"], values)
+                return execute_command(self.registry, cmd["name"], values)
 
 
 
@@ -1,12 +1,19 @@
 
 from typing import Callable, Optional
-from orgasm import get_available_commands, get_command_specs, execute_command
+from orgasm import get_available_commands, get_command_specs, execute_command, get_registry
 from orgasm import attr, tag 
+from orgasm import request_log
+from orgasm.cache import TTLCache
+from orgasm.limits import Overloaded
+from orgasm.metrics import PROMETHEUS_CONTENT_TYPE, metrics
+from orgasm.profiling import PROFILE_HEADER, RequestProfiler, profile_requested
+from orgasm.streaming import primed
 
-from flask import Flask, jsonify, request
+import inspect, io, json
 import secrets, base64, hashlib
 from datetime import timedelta, datetime
 import hmac, datetime as dt
+import time
 
 
 def issue_token(user_id: str, save_to_db, expiration_days = 90) -> str:
@@ -21,12 +28,81 @@ def issue_token(user_id: str, save_to_db, expiration_days = 90) -> str:
                datetime.now() + timedelta(days=expiration_days)) 
     return token
 
-def validate_token(token: str, db_lookup: Callable) -> Optional[str]:
+def issue_tokens(user_ids, store, expiration_days = 90) -> dict:
+    """
+    Issue tokens for many users with one write to the store.
+    :param user_ids: iterable of user ids
+    :param store: TokenStore
+    :return: dict mapping user ids to raw tokens
+    """
+    tokens = {}
+    records = []
+    issued = datetime.now()
+    expiration = issued + timedelta(days=expiration_days)
+    for user_id in user_ids:
+        raw = secrets.token_bytes(32)
+        token = f"v1.{base64.urlsafe_b64encode(raw).rstrip(b'=').decode()}"
+        tokens[user_id] = token
+        records.append((user_id, hashlib.sha256(token.encode()).hexdigest(), issued, expiration))
+    store.save_many(records)
+    return tokens
+
+class TokenCache:
+    """
+    Bounded, thread-safe cache of validated token digests.
+    Valid tokens are cached until their expiration (capped by max_ttl, so revocations done by other
+    processes are noticed), unknown and expired tokens are cached for negative_ttl seconds.
+    :param maxsize: maximal number of cached digests
+    :param max_ttl: maximal time in seconds for which valid token is trusted without asking the store
+    :param negative_ttl: time in seconds for which unknown token is rejected without asking the store
+    """
+    def __init__(self, maxsize=10000, max_ttl=300, negative_ttl=5):
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def validate(self, digest: str, db_lookup: Callable) -> Optional[str]:
+        """
+        Get user of token digest, asking db_lookup only on cache miss.
+        :return: user id or None if token is unknown or expired
+        """
+        entry = self._cache.get(digest)
+        if entry is not None and entry[0] == db_lookup:
+            return entry[1]
+        user, _, expiration = db_lookup(digest)
+        now = dt.datetime.now()
+        if not user or expiration < now:
+            self._cache.set(digest, (db_lookup, None), ttl=self.negative_ttl)
+            return None
+        ttl = min((expiration - now).total_seconds(), self.max_ttl)
+        self._cache.set(digest, (db_lookup, user), expires_at=time.monotonic() + ttl)
+        return user
+
+    def invalidate(self, digests=None):
+        """
+        Drop cached digests, or all of them if digests is None.
+        """
+        if digests is None:
+            self._cache.invalidate()
+            return
+        if isinstance(digests, str):
+            digests = [digests]
+        for digest in digests:
+            self._cache.invalidate(digest)
+
+    def stats(self):
+        return self._cache.stats()
+
+token_cache = TokenCache()
+
+def validate_token(token: str, db_lookup: Callable, cache: TokenCache = None) -> Optional[str]:
     # Reject wrong version up-front
     if not token.startswith("v1."):
         return None
 
     digest = hashlib.sha256(token.encode()).hexdigest()
+    if cache is not None:
+        return cache.validate(digest, db_lookup)
     user, digest, expiration = db_lookup(digest)
 
     if not user:
@@ -79,6 +155,16 @@ def json_db_lookup(path: str):
     return db_lookup
 
 
+# tokens stored in SQLite database, indexed by digest
+
+def sqlite_save_to_db(path: str):
+    from orgasm.token_store import get_sqlite_token_store
+    return get_sqlite_token_store(path).save
+
+def sqlite_db_lookup(path: str):
+    from orgasm.token_store import get_sqlite_token_store
+    return get_sqlite_token_store(path).lookup
+
 
 http_post = attr(http_method ="POST")
 http_get = attr(http_method ="GET")
@@ -86,17 +172,25 @@ http_delete = attr(http_method ="DELETE")
 http_put = attr(http_method ="PUT")
 no_http = tag("no_http")
 
-def http_auth(db_save, db_lookup, user_arg=None):
+def http_auth(db_save, db_lookup, user_arg=None, cache=token_cache):
     """
     Decorator to protect endpoints with token-based authentication.
     The token is expected to be passed in the 'Authorization' header in the format
     Authorization: Bearer <token>
+    Validated tokens are cached in cache (shared `token_cache` by default), pass cache=None to
+    look every token up in the store. When db_lookup is a method of TokenStore, revoked tokens
+    are dropped from the cache right away.
     """
+    from orgasm.token_store import TokenStore
+    store = getattr(db_lookup, "__self__", None)
+    if cache is not None and isinstance(store, TokenStore):
+        store.add_listener(cache.invalidate)
     return attr(
         http_authorization=True,
         http_auth_db_save=db_save,
         http_auth_db_lookup=db_lookup,
-        http_auth_pass_user_id=user_arg if user_arg else None
+        http_auth_pass_user_id=user_arg if user_arg else None,
+        http_auth_token_cache=cache,
     )
 
 def http_auth_json_file(path: str, user_arg=None):
@@ -108,67 +202,458 @@ def http_auth_json_file(path: str, user_arg=None):
     db_lookup = json_db_lookup(path)
     return http_auth(db_save, db_lookup, user_arg)
 
+def http_auth_sqlite(path: str, user_arg=None):
+    """
+    Convenience function to create a decorator for token-based authentication
+    using SQLite database as token store. Drop-in replacement for `http_auth_json_file`
+    which does not re-read all tokens on every request.
+    """
+    db_save = sqlite_save_to_db(path)
+    db_lookup = sqlite_db_lookup(path)
+    return http_auth(db_save, db_lookup, user_arg)
+
+
+
+def serialize_spec(spec):
+    """
+    Convert command spec into JSON serializable dict without modifying the original spec.
+    Types and callables are replaced by their names.
+    """
+    attrs = {}
+    for attr, value in spec['attrs'].items():
+        if isinstance(value, Callable) or isinstance(value, type):
+            value = getattr(value, "__name__", str(value))
+        elif not isinstance(value, (str, int, float, bool, list, tuple, dict, type(None))):
+            value = str(value)
+        attrs[attr] = value
+    args = []
+    for arg in spec['args']:
+        arg = dict(arg)
+        if 'type' in arg and arg['type'] is not None:
+            if isinstance(arg['type'], tuple):
+                arg['type'] = arg['type'][0].__name__
+            else:
+                arg['type'] = arg['type'].__name__
+        if 'help' in arg:
+            if isinstance(arg['help'], tuple):
+                arg['help'] = arg['help'][1]
+        args.append(arg)
+    return dict(spec, attrs=attrs, args=args)
+
+def get_http_method(spec):
+    """
+    Get HTTP method of the endpoint for command.
+    Commands without arguments are served with GET, others with POST unless http_method attribute is set.
+    """
+    method = "GET" if len(spec["args"]) == 0 else "POST"
+    if "http_method" in spec["attrs"]:
+        method = spec["attrs"]["http_method"].upper()
+        if method not in ["GET", "POST", "PUT", "DELETE"]:
+            raise ValueError(f"Invalid HTTP method {method} for command {spec['method_name']}")
+    return method
+
+def authorize(spec, auth_header):
+    """
+    Check token-based authorization of the request for command.
+    :param spec: command spec
+    :param auth_header: value of Authorization header or None
+    :return: tuple (user_id, error) where error is None or tuple (payload, status) to be returned to the client
+    """
+    if "http_authorization" not in spec["attrs"]:
+        return None, None
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None, ({"error": "Unauthorized"}, 401)
+    token = auth_header.split(' ')[1]
+    user_id = validate_token(token, spec["attrs"]["http_auth_db_lookup"], spec["attrs"].get("http_auth_token_cache"))
+    if not user_id:
+        return None, ({"error": "Invalid or expired token"}, 401)
+    return user_id, None
+
+def pass_user_id(spec, params, user_id):
+    """
+    Put id of authorized user into params if command requested it with user_arg.
+    """
+    if "http_auth_pass_user_id" in spec["attrs"] and spec["attrs"]["http_auth_pass_user_id"]:
+        params[spec["attrs"]["http_auth_pass_user_id"]] = user_id
+    return params
+
+def wants_background(spec, prefer_header):
+    """
+    Check whether command should run as background job, either because it has background attribute
+    or because client sent "Prefer: respond-async" header.
+    """
+    return bool(spec["attrs"].get("background")) or "respond-async" in (prefer_header or "").lower()
+
+def overload_error(e):
+    """
+    Response for call rejected by concurrency limits: 429 when limit of the command was hit,
+    503 when the whole server is overloaded.
+    :param e: orgasm.limits.Overloaded
+    :return: tuple (payload, status)
+    """
+    return {"error": str(e), "retry_after": e.retry_after}, 429 if e.scope == "command" else 503
+
+def submit_job(jobs, spec, params, user_id):
+    """
+    Submit command as background job.
+    :return: tuple (payload, status)
+    """
+    from orgasm.jobs import JobQueueFull
+    try:
+        job = jobs.submit(spec["name"], params, user_id)
+    except JobQueueFull as e:
+        return {"error": str(e)}, 503
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return dict(job.to_dict(), url="/jobs/" + job.id), 202
+
+def handle_job_request(jobs, registry, method, job_id, action, auth_header):
+    """
+    Handle requests to /jobs/<id> (GET status, DELETE cancel) and /jobs/<id>/result (GET result).
+    Jobs of commands with http_auth are visible only to the user who submitted them.
+    :return: tuple (payload, status)
+    """
+    from orgasm.jobs import DONE, FAILED, CANCELLED
+    job = jobs.get(job_id)
+    if job is not None:
+        user_id, error = authorize(registry.get(job.command), auth_header)
+        if error is not None:
+            return error
+        if user_id != job.user_id:
+            job = None
+    if job is None:
+        return {"error": "Job not found"}, 404
+    if action == "result":
+        if job.status == DONE:
+            return job.result, 200
+        if job.status == FAILED:
+            return {"error": job.error}, 400
+        if job.status == CANCELLED:
+            return {"error": "Job was cancelled"}, 410
+        # not finished yet, items produced so far by generator commands are returned as partial result
+        return dict(job.to_dict(), partial=list(job.partial or [])), 202
+    if method == "DELETE":
+        if not jobs.cancel(job_id):
+            return {"error": "Job is %s and can not be cancelled" % job.status}, 409
+    return job.to_dict(), 200
+
+BATCH_MAX_WORKERS = 16
+BATCH_MAX_ITEMS = 1000
+
+def handle_profiles_request(profiler, registry, query, auth_header):
+    """
+    List hottest functions of profiled requests, see `orgasm.profiling.RequestProfiler.top`.
+    Profiles of a command are listed only to clients authorized to call the command.
+    :param query: dict of query parameters command, limit and sort
+    :param auth_header: value of Authorization header or None
+    :return: tuple (payload, status)
+    """
+    def find(command):
+        if command not in registry or "no_http" in registry.get(command)["tags"]:
+            return None, ({"error": "Command %s not found" % command}, 404)
+        return authorize(registry.get(command), auth_header)
+    command = query.get("command")
+    if command is not None:
+        _, error = find(command)
+        if error is not None:
+            return error
+    try:
+        limit = int(query.get("limit", 20))
+        top = profiler.top(command, limit, query.get("sort", "tottime"))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {name: rows for name, rows in top.items() if name == command or find(name)[1] is None}, 200
+
+def parse_batch(body):
+    """
+    Parse body of /batch request.
+    Body is either list of items or dict {"items": [...], "parallel": bool, "max_workers": int}.
+    Every item is dict {"command": name, "params": {...}}.
+    :return: tuple (items, parallel, max_workers)
+    :raises ValueError: if body is malformed
+    """
+    if isinstance(body, list):
+        body = {"items": body}
+    if not isinstance(body, dict) or not isinstance(body.get("items"), list):
+        raise ValueError("Batch body must be a list of items or a dict with 'items' list")
+    items = body["items"]
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError("Batch can contain at most %d items" % BATCH_MAX_ITEMS)
+    try:
+        max_workers = min(int(body.get("max_workers", BATCH_MAX_WORKERS)), BATCH_MAX_WORKERS)
+    except (TypeError, ValueError):
+        # e.g. null or a list
+        raise ValueError("Batch 'max_workers' must be an integer") from None
+    return items, bool(body.get("parallel", False)), max(max_workers, 1)
+
+def prepare_batch_item(registry, item, auth_header):
+    """
+    Check single batch item and authorize it.
+    :return: tuple (command, params, error) where error is None or dict to be returned for the item
+    """
+    if not isinstance(item, dict) or not isinstance(item.get("command"), str):
+        return None, None, {"error": "Item must be a dict with 'command' name", "status": 400}
+    command = item["command"]
+    if command not in registry or "no_http" in registry.get(command)["tags"]:
+        return None, None, {"error": "Command %s not found" % command, "status": 404}
+    spec = registry.get(command)
+    params = item.get("params") or {}
+    if not isinstance(params, dict):
+        return None, None, {"error": "Params must be a dict", "status": 400}
+    user_id, error = authorize(spec, auth_header)
+    if error is not None:
+        return None, None, dict(error[0], status=error[1])
+    return command, pass_user_id(spec, dict(params), user_id), None
+
+# argument types which can receive raw application/octet-stream request body
+BINARY_TYPES = (bytes, memoryview)
+
+# default maximal size of request body in bytes, the same as of the asyncio server
+MAX_BODY_SIZE = 16 * 1024 * 1024
+# request body buffer grows by at most this many bytes at once
+READ_CHUNK_SIZE = 64 * 1024
+
+def binary_arg(spec):
+    """
+    Get name of the argument receiving binary request body, the first bytes or memoryview argument of command.
+    :return: argument name or None if command has no binary arguments
+    """
+    for arg in spec["args"]:
+        if arg["type"] in BINARY_TYPES:
+            return arg["name"]
+    return None
+
+def read_into_buffer(stream, length, chunk_size=READ_CHUNK_SIZE):
+    """
+    Read exactly length bytes from stream into one buffer, without intermediate copies.
+    The buffer grows with the data actually received, so a client claiming a large Content-Length
+    without sending it does not make the server allocate it.
+    :return: read-only memoryview of the buffer
+    """
+    buffer = bytearray(min(length, chunk_size))
+    received = 0
+    while received < length:
+        if received == len(buffer):
+            buffer.extend(bytes(min(len(buffer), chunk_size, length - received)))
+        # view has to be released before the buffer can grow
+        with memoryview(buffer)[received:] as view:
+            count = stream.readinto(view)
+        if not count:
+            raise ValueError("Request body is incomplete")
+        received += count
+    # commands must not modify the body
+    return memoryview(buffer).toreadonly()
+
+def is_binary(result):
+    return isinstance(result, (bytes, bytearray, memoryview))
 
+@primed
+def iter_ndjson(result):
+    """
+    Encode items of streamed (generator) result as newline delimited JSON, one line per item.
+    Error raised while producing items is reported as a last line {"error": message},
+    as status code was already sent.
+    """
+    try:
+        yield
+        for item in result:
+            yield json.dumps(item, default=str) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    finally:
+        result.close()
+
+def execute_batch(registry, items, auth_header, parallel=False, max_workers=BATCH_MAX_WORKERS):
+    """
+    Execute batch of commands. Every item is authorized on its own and commands tagged no_http are rejected.
+    :param items: list of dicts {"command": name, "params": {...}}
+    :param auth_header: value of Authorization header used for every item
+    :param parallel: run items on a thread pool of max_workers threads instead of one after another
+    :return: list of {"result": value} or {"error": message, "status": code} in order of items
+    """
+    def run(item):
+        command, params, error = prepare_batch_item(registry, item, auth_header)
+        if error is not None:
+            return error
+        try:
+            result = execute_command(registry, command, params)
+            if inspect.isgenerator(result):
+                # batch response is a single JSON document, streamed results are collected
+                result = list(result)
+            return {"result": result}
+        except Overloaded as e:
+            payload, status = overload_error(e)
+            return dict(payload, status=status)
+        except Exception as e:
+            return {"error": str(e), "status": 400}
+    if not parallel or len(items) < 2:
+        return [run(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(run, items))
 
-def serve_rest_api(classes, port=5000, host="127.0.0.1"):
+def serve_rest_api(classes, port=5000, host="127.0.0.1", server="flask", **options):
+    """
+    Serve commands as REST API. Every command is exposed at /<command>, specs are available at /commands,
+    per-command metrics at /metrics.
+    :param classes: list of classes or CommandRegistry
+    :param server: one of
+        "flask" - Flask development server,
+        "prefork" - pre-forked worker processes for production, see `orgasm.prefork.serve_prefork` for options,
+        "asyncio" - asyncio based server which awaits async commands directly and runs sync commands
+        in a thread pool, see `orgasm.http_rest_asyncio.serve_rest_api_asyncio` for options
+    :param options: server specific options, every server accepts max_body_size
+    """
+    if server == "asyncio":
+        from orgasm.http_rest_asyncio import serve_rest_api_asyncio
+        return serve_rest_api_asyncio(classes, port=port, host=host, **options)
+    if server == "prefork":
+        from orgasm.prefork import serve_prefork
+        max_body_size = options.pop("max_body_size", MAX_BODY_SIZE)
+        return serve_prefork(lambda: create_rest_app(classes, max_body_size=max_body_size), host=host, port=port, **options)
+    if server != "flask":
+        raise ValueError(f"Unknown server {server}")
+    from orgasm.keepalive import KeepAliveRequestHandler
+    app = create_rest_app(classes, **options)
+    app.run(port=port, host=host, request_handler=KeepAliveRequestHandler)
+
+def create_rest_app(classes, jobs=None, profiler=None, max_body_size=MAX_BODY_SIZE):
+    """
+    Create Flask app serving commands as REST API.
+    Commands with background attribute, or requested with "Prefer: respond-async" header, are run as background
+    jobs: response is 202 with job id, status is at /jobs/<id> and result at /jobs/<id>/result.
+    Jobs are kept in memory of the process, so they are not shared between workers of prefork server.
+    Per-command metrics are served at /metrics in Prometheus text format, unless a command is named metrics.
+    With prefork server every worker reports metrics of its own calls.
+    Sampled requests, and requests with "X-Orgasm-Profile: 1" header if the profiler allows forced profiling,
+    are profiled, hottest functions per command are listed at /profiles (query parameters command, limit, sort)
+    to clients authorized to call the command.
+    /batch, /metrics and /profiles are not added when a command has the same name, the command is served instead.
+    :param classes: list of classes or CommandRegistry
+    :param jobs: JobManager running background jobs, created with default settings if not given
+    :param profiler: orgasm.profiling.RequestProfiler, by default no requests are profiled
+    :param max_body_size: maximal size of request body in bytes, larger requests are rejected with 413
+    :return: Flask app
+    """
+    from flask import Flask, Response, jsonify, request
+    from werkzeug.exceptions import RequestEntityTooLarge
+    from orgasm.jobs import JobManager
+    registry = get_registry(classes)
+    jobs = jobs if jobs is not None else JobManager(registry)
+    profiler = profiler if profiler is not None else RequestProfiler()
     app = Flask(__name__)
+    # werkzeug stops reading request bodies, including chunked and multipart ones, at this size
+    app.config["MAX_CONTENT_LENGTH"] = max_body_size
+
+    class Request(app.request_class):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            # multipart parts are kept in memory so binary arguments can get a view of them without copying,
+            # their total size is limited by MAX_CONTENT_LENGTH
+            return io.BytesIO()
+    app.request_class = Request
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def body_too_large(e):
+        return jsonify({"error": "Request body too large"}), 413
 
     @app.route('/commands', methods=['GET'])
     def command_specs():
-        specs = get_command_specs(classes)
-        for spec in specs:
-            if "no_http" in spec['tags']:
-                continue
-            for attr, value in spec['attrs'].items():
-                if isinstance(value, Callable):
-                    spec['attrs'][attr] = value.__name__
-                elif isinstance(value, type):
-                    spec['attrs'][attr] = value.__name__
-            for arg in spec['args']:
-                if 'type' in arg:
-                    if isinstance(arg['type'], tuple):
-                        arg['type'] = arg['type'][0].__name__
-                    else:
-                        arg['type'] = arg['type'].__name__
-                if 'help' in arg:
-                    if isinstance(arg['help'], tuple):
-                        arg['help'] = arg['help'][1]
+        specs = [serialize_spec(spec) for spec in registry.specs if "no_http" not in spec['tags']]
         return jsonify(specs)
 
-    for spec in get_command_specs(classes):
+    method_names = [spec["method_name"] for spec in registry.specs]
+    # built-in endpoints are not added when a command uses their path
+    for path in ["batch", "metrics", "profiles"]:
+        if path in method_names:
+            print(f"Skipping /{path} endpoint, command {path} uses its path")
+
+    if "batch" not in method_names:
+        @app.route('/batch', methods=['POST'], endpoint='orgasm_batch')
+        def batch():
+            try:
+                items, parallel, max_workers = parse_batch(request.json)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(execute_batch(registry, items, request.headers.get('Authorization'), parallel, max_workers))
+
+    @app.route('/jobs/<job_id>', methods=['GET', 'DELETE'], endpoint='orgasm_job')
+    @app.route('/jobs/<job_id>/<action>', methods=['GET'], endpoint='orgasm_job_result')
+    def job(job_id, action=None):
+        if action not in [None, "result"]:
+            return jsonify({"error": "Not found"}), 404
+        payload, status = handle_job_request(jobs, registry, request.method, job_id, action, request.headers.get('Authorization'))
+        return jsonify(payload), status
+
+    if "metrics" not in method_names:
+        @app.route('/metrics', methods=['GET'], endpoint='orgasm_metrics')
+        def command_metrics():
+            return Response(metrics.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    if "profiles" not in method_names:
+        @app.route('/profiles', methods=['GET'], endpoint='orgasm_profiles')
+        def command_profiles():
+            payload, status = handle_profiles_request(profiler, registry, request.args, request.headers.get('Authorization'))
+            return jsonify(payload), status
+
+    for spec in registry.specs:
         if "no_http" in spec['tags']:
             print(f"Skipping command {spec['method_name']} due to 'no_http' tag")
             continue
         # create endpoint for particular command
-        method = "GET" if len(spec["args"]) == 0 else "POST"  
-        if "http_method" in spec["attrs"]:
-            method = spec["attrs"]["http_method"].upper()
-            if method not in ["GET", "POST", "PUT", "DELETE"]:
-                raise ValueError(f"Invalid HTTP method {method} for command {spec['method_name']}")      
+        method = get_http_method(spec)
         def command_endpoint(command=spec["method_name"], spec=spec):
-            print(f"Executing command: {command}")
-            if "http_authorization" in spec["attrs"]:
-                # Check for authorization
-                auth_header = request.headers.get('Authorization')
-                if not auth_header or not auth_header.startswith('Bearer '):
-                    return jsonify({"error": "Unauthorized"}), 401
-                token = auth_header.split(' ')[1]
-                user_id = validate_token(token, spec["attrs"]["http_auth_db_lookup"])
-                if not user_id:
-                    return jsonify({"error": "Invalid or expired token"}), 401
-                
+            started = time.perf_counter()
+            user_id, error = authorize(spec, request.headers.get('Authorization'))
+            if error is not None:
+                return jsonify(error[0]), error[1]
+            if request.content_length is not None and request.content_length > max_body_size:
+                # rejected before anything is allocated for the body
+                return jsonify({"error": "Request body too large"}), 413
             if request.method in ["GET", "DELETE"]:
                 A = request.args.to_dict()
+            elif request.mimetype == "application/octet-stream" and binary_arg(spec) is not None:
+                # raw body goes to the binary argument, other arguments are in query string
+                A = request.args.to_dict()
+                if request.content_length is not None:
+                    A[binary_arg(spec)] = read_into_buffer(request.stream, request.content_length)
+                else:
+                    A[binary_arg(spec)] = memoryview(request.get_data())
+            elif request.mimetype == "multipart/form-data":
+                A = request.args.to_dict()
+                A.update(request.form.to_dict())
+                for name, file in request.files.items():
+                    A[name] = file.stream.getbuffer().toreadonly()
             else:
                 A = request.json or {}
-            if "http_auth_pass_user_id" in spec["attrs"] and spec["attrs"]["http_auth_pass_user_id"]:
-                    A[spec["attrs"]["http_auth_pass_user_id"]] = user_id    
+            pass_user_id(spec, A, user_id)
+            if wants_background(spec, request.headers.get('Prefer')):
+                payload, status = submit_job(jobs, spec, A, user_id)
+                headers = {"Location": payload["url"]} if status == 202 else {}
+                return jsonify(payload), status, headers
             try:
-                result = execute_command(classes, command, A)
+                if profiler.should_profile(profile_requested(request.headers.get(PROFILE_HEADER))):
+                    result = profiler.call(spec["name"], execute_command, registry, command, A)
+                else:
+                    result = execute_command(registry, command, A)
+                request_log.logger.request("rest", spec["name"], A, started, result, status=200)
+                if inspect.isgenerator(result):
+                    return Response(iter_ndjson(result), mimetype="application/x-ndjson")
+                if is_binary(result):
+                    # sent as is, WSGI only accepts bytes so memoryview has to be copied once
+                    return Response(
+                        bytes(result) if isinstance(result, memoryview) else result,
+                        mimetype="application/octet-stream",
+                    )
                 return jsonify(result)
+            except Overloaded as e:
+                payload, status = overload_error(e)
+                request_log.logger.request("rest", spec["name"], A, started, error=e, status=status)
+                return jsonify(payload), status, {"Retry-After": str(e.retry_after)}
             except Exception as e:
+                request_log.logger.request("rest", spec["name"], A, started, error=e, status=400)
                 return jsonify({"error": str(e)}), 400
         print(f"Adding endpoint: {spec['method_name']} with method {method}")
         app.add_url_rule(f'/{spec["method_name"]}', spec["method_name"], command_endpoint, methods=[method])
 
-    app.run(port=port, host=host)
\ No newline at end of file
+    registry.warmup()
+    return app
@@ -0,0 +1,328 @@
+# Asyncio based server for the REST API. Connections are handled by coroutines instead of threads,
+# so many requests to I/O bound async commands can be in flight at once.
+import asyncio
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from orgasm import get_registry, request_log
+from orgasm.http_rest import authorize, binary_arg, get_http_method, handle_job_request, is_binary, iter_ndjson
+from orgasm.http_rest import handle_profiles_request, overload_error, parse_batch, pass_user_id, prepare_batch_item, serialize_spec, submit_job, wants_background
+from orgasm.jobs import JobManager
+from orgasm.limits import Overloaded
+from orgasm.metrics import PROMETHEUS_CONTENT_TYPE, metrics
+from orgasm.profiling import PROFILE_HEADER, RequestProfiler, profile_requested
+
+# number of streamed items encoded into one chunk
+STREAM_BATCH_SIZE = 64
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_body(reader, headers, max_body_size):
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        size = 0
+        while True:
+            length = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if length == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            size += length
+            if size > max_body_size:
+                raise HttpError(413, "Request body too large")
+            chunks.append(await reader.readexactly(length))
+            await reader.readline()
+        return b"".join(chunks)
+    length = int(headers.get("content-length", 0) or 0)
+    if length > max_body_size:
+        raise HttpError(413, "Request body too large")
+    return await reader.readexactly(length) if length else b""
+
+
+def encode_head(status, length, version="HTTP/1.1", keep_alive=True, content_type="application/json", headers=None):
+    head = "%s %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n%s\r\n" % (
+        version,
+        status,
+        HTTPStatus(status).phrase,
+        content_type,
+        length,
+        "keep-alive" if keep_alive else "close",
+        "".join("%s: %s\r\n" % item for item in (headers or {}).items()),
+    )
+    return head.encode("latin-1")
+
+
+def encode_response(status, payload, version="HTTP/1.1", keep_alive=True, content_type="application/json", headers=None):
+    body = payload if isinstance(payload, bytes) else (json.dumps(payload, default=str) + "\n").encode()
+    return encode_head(status, len(body), version, keep_alive, content_type, headers) + body
+
+
+def _next_lines(lines, count):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= count:
+            break
+    return "".join(batch).encode()
+
+
+class AsyncRestServer:
+    """
+    REST API server running on asyncio event loop.
+    :param registry: CommandRegistry
+    :param max_workers: number of threads for sync commands
+    :param max_body_size: maximal size of request body in bytes
+    :param jobs: JobManager running background jobs, see `orgasm.http_rest.create_rest_app`
+    :param profiler: RequestProfiler for sampled requests, see `orgasm.http_rest.create_rest_app`
+    """
+    def __init__(self, registry, max_workers=32, max_body_size=16 * 1024 * 1024, jobs=None, profiler=None):
+        self.registry = registry
+        self.max_body_size = max_body_size
+        self.jobs = jobs if jobs is not None else JobManager(registry)
+        self.profiler = profiler if profiler is not None else RequestProfiler()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orgasm-rest")
+        self.routes = {}
+        for spec in registry.specs:
+            if "no_http" in spec["tags"]:
+                continue
+            self.routes["/" + spec["method_name"]] = (get_http_method(spec), spec)
+
+    async def run_blocking(self, func, *args):
+        """
+        Run func(*args) which may block (token lookups, binding arguments, ...) in the executor,
+        so it does not stall other connections.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def authorize(self, spec, auth_header):
+        """
+        Authorize request for command, see `orgasm.http_rest.authorize`.
+        Token is validated in the executor, commands without http_auth are authorized right away.
+        """
+        if "http_authorization" not in spec["attrs"]:
+            return None, None
+        return await self.run_blocking(authorize, spec, auth_header)
+
+    async def handle_request(self, method, target, headers, body):
+        """
+        Handle single request.
+        :return: tuple (status, payload), payload is generator for streamed results,
+            or (status, payload, content_type) for bytes payloads which are not application/octet-stream,
+            or (status, payload, content_type, headers) with additional response headers, content_type None
+            means the default one
+        """
+        url = urlsplit(target)
+        if url.path == "/metrics" and url.path not in self.routes:
+            if method != "GET":
+                return 405, {"error": "Method not allowed"}
+            return 200, metrics.render_prometheus().encode(), PROMETHEUS_CONTENT_TYPE
+        if url.path == "/profiles" and url.path not in self.routes:
+            if method != "GET":
+                return 405, {"error": "Method not allowed"}
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            # authorization may look tokens up in a database
+            payload, status = await self.run_blocking(
+                handle_profiles_request, self.profiler, self.registry, query, headers.get("authorization")
+            )
+            return status, payload
+        if url.path == "/commands":
+            if method != "GET":
+                return 405, {"error": "Method not allowed"}
+            return 200, [serialize_spec(spec) for spec in self.registry.specs if "no_http" not in spec["tags"]]
+        if url.path == "/batch" and url.path not in self.routes:
+            if method != "POST":
+                return 405, {"error": "Method not allowed"}
+            try:
+                items, parallel, max_workers = parse_batch(json.loads(body) if body else None)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+            return 200, await self.execute_batch(items, headers.get("authorization"), parallel, max_workers)
+        if url.path.startswith("/jobs/"):
+            parts = url.path.split("/")
+            action = parts[3] if len(parts) == 4 else None
+            if len(parts) > 4 or action not in [None, "result"]:
+                return 404, {"error": "Not found"}
+            if method not in (["GET"] if action else ["GET", "DELETE"]):
+                return 405, {"error": "Method not allowed"}
+            payload, status = await self.run_blocking(
+                handle_job_request, self.jobs, self.registry, method, parts[2], action, headers.get("authorization")
+            )
+            return status, payload
+        route = self.routes.get(url.path)
+        if route is None:
+            return 404, {"error": "Not found"}
+        http_method, spec = route
+        if method != http_method:
+            return 405, {"error": "Method not allowed"}
+        user_id, error = await self.authorize(spec, headers.get("authorization"))
+        if error is not None:
+            return error[1], error[0]
+        if method in ["GET", "DELETE"]:
+            params = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        elif headers.get("content-type", "").split(";")[0].strip() == "application/octet-stream" and binary_arg(spec):
+            # raw body goes to the binary argument, other arguments are in query string
+            params = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+            params[binary_arg(spec)] = memoryview(body)
+        else:
+            try:
+                params = json.loads(body) if body else {}
+            except ValueError:
+                return 400, {"error": "Invalid JSON body"}
+            params = params or {}
+        pass_user_id(spec, params, user_id)
+        if wants_background(spec, headers.get("prefer")):
+            # arguments are bound and instance provider is set up when the job is submitted
+            payload, status = await self.run_blocking(submit_job, self.jobs, spec, params, user_id)
+            if status == 202:
+                return status, payload, None, {"Location": payload["url"]}
+            return status, payload
+        started = time.perf_counter()
+        try:
+            command = self.registry.command(spec["name"])
+            if self.profiler.should_profile(profile_requested(headers.get(PROFILE_HEADER.lower()))):
+                # profiler sees only its own thread, so the whole call runs in a worker thread,
+                # async commands in their own event loop there
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.profiler.call, spec["name"], command, params
+                )
+            else:
+                result = await command.call_async(params, self.executor)
+        except Overloaded as e:
+            payload, status = overload_error(e)
+            request_log.logger.request("rest", spec["name"], params, started, error=e, status=status)
+            return status, payload
+        except Exception as e:
+            request_log.logger.request("rest", spec["name"], params, started, error=e, status=400)
+            return 400, {"error": str(e)}
+        request_log.logger.request("rest", spec["name"], params, started, result, status=200)
+        return 200, result
+
+    async def execute_batch(self, items, auth_header, parallel, max_workers):
+        """
+        Execute batch of commands, see `orgasm.http_rest.execute_batch`.
+        """
+        semaphore = asyncio.Semaphore(max_workers if parallel else 1)
+        async def run(item):
+            command, params, error = await self.run_blocking(prepare_batch_item, self.registry, item, auth_header)
+            if error is not None:
+                return error
+            async with semaphore:
+                try:
+                    result = await self.registry.command(command).call_async(params, self.executor)
+                    if inspect.isgenerator(result):
+                        result = await asyncio.get_running_loop().run_in_executor(self.executor, list, result)
+                    return {"result": result}
+                except Overloaded as e:
+                    payload, status = overload_error(e)
+                    return dict(payload, status=status)
+                except Exception as e:
+                    return {"error": str(e), "status": 400}
+        return list(await asyncio.gather(*[run(item) for item in items]))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                if headers.get("expect", "").lower() == "100-continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                try:
+                    body = await read_body(reader, headers, self.max_body_size)
+                    response = await self.handle_request(method, target, headers, body)
+                except HttpError as e:
+                    response, keep_alive = (e.status, {"error": str(e)}), False
+                status, payload = response[0], response[1]
+                content_type = response[2] if len(response) > 2 else None
+                extra_headers = dict(response[3]) if len(response) > 3 else {}
+                if inspect.isgenerator(payload):
+                    await self.write_stream(writer, payload, keep_alive)
+                elif is_binary(payload):
+                    # raw body written after the head, without joining them into a new buffer
+                    payload = memoryview(payload)
+                    writer.write(encode_head(
+                        status, payload.nbytes, "HTTP/1.1", keep_alive, content_type or "application/octet-stream",
+                        extra_headers
+                    ))
+                    writer.write(payload)
+                    await writer.drain()
+                else:
+                    if status in (429, 503) and "retry_after" in payload:
+                        extra_headers["Retry-After"] = payload["retry_after"]
+                    writer.write(encode_response(
+                        status, payload, "HTTP/1.1", keep_alive, content_type or "application/json", extra_headers
+                    ))
+                    await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_stream(self, writer, result, keep_alive):
+        """
+        Send streamed result as newline delimited JSON with chunked transfer encoding.
+        Sync generator is advanced in the executor, so slow items do not block the event loop.
+        """
+        writer.write((
+            "HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n"
+            "Connection: %s\r\n\r\n" % ("keep-alive" if keep_alive else "close")
+        ).encode("latin-1"))
+        loop = asyncio.get_running_loop()
+        lines = iter_ndjson(result)
+        try:
+            while True:
+                data = await loop.run_in_executor(self.executor, _next_lines, lines, STREAM_BATCH_SIZE)
+                if not data:
+                    break
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                # wait for slow clients so memory stays bounded
+                await writer.drain()
+        finally:
+            # runs generator cleanup (and releases command instance) if client went away
+            await loop.run_in_executor(self.executor, lines.close)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        print(f"Serving REST API on http://{host}:{port} (asyncio)")
+        async with server:
+            await server.serve_forever()
+
+
+def serve_rest_api_asyncio(classes, port=5000, host="127.0.0.1", max_workers=32, max_body_size=16 * 1024 * 1024, jobs=None,
+                           profiler=None):
+    """
+    Serve commands as REST API on asyncio event loop.
+    :param classes: list of classes or CommandRegistry
+    :param max_workers: number of threads running sync commands
+    :param max_body_size: maximal size of request body in bytes
+    :param jobs: JobManager running background jobs
+    :param profiler: orgasm.profiling.RequestProfiler for sampled requests
+    """
+    registry = get_registry(classes)
+    registry.warmup()
+    server = AsyncRestServer(registry, max_workers=max_workers, max_body_size=max_body_size, jobs=jobs, profiler=profiler)
+    asyncio.run(server.serve(host, port))
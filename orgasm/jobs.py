@@ -0,0 +1,181 @@
+# Background execution of long-running commands. Jobs are run on a bounded pool of worker threads,
+# clients get job id right away and poll for status and result.
+import contextvars
+import inspect
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# how often (in seconds) expired jobs are looked for
+SWEEP_INTERVAL = 1
+
+_current_job = contextvars.ContextVar("orgasm_current_job", default=None)
+
+
+class JobQueueFull(Exception):
+    """
+    Job was rejected because maximal number of queued jobs was reached.
+    """
+
+
+def set_progress(progress):
+    """
+    Report progress of command running as background job, e.g. fraction done or a status message.
+    Does nothing when command is not running as a job.
+    :param progress: JSON serializable value shown in job status
+    """
+    job = _current_job.get()
+    if job is not None:
+        job.progress = progress
+
+
+class Job:
+    """
+    Single execution of command in background.
+    Items of generator results are collected as they are produced and are available as partial result.
+    """
+    def __init__(self, command, params, user_id=None):
+        self.id = secrets.token_hex(16)
+        self.command = command
+        self.params = params
+        self.user_id = user_id
+        self.status = QUEUED
+        self.progress = None
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def to_dict(self):
+        """
+        Status of the job without its result.
+        """
+        status = {
+            "id": self.id,
+            "command": self.command,
+            "status": self.status,
+            "progress": self.progress,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.partial is not None:
+            status["items"] = len(self.partial)
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+class JobManager:
+    """
+    Runs commands from registry as background jobs.
+    :param registry: CommandRegistry
+    :param max_workers: number of jobs running at once
+    :param max_queued: maximal number of jobs waiting for a worker, further submissions raise JobQueueFull
+    :param result_ttl: seconds for which finished jobs and their results are kept
+    """
+    def __init__(self, registry, max_workers=4, max_queued=1000, result_ttl=3600):
+        self.registry = registry
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orgasm-job")
+        self._jobs = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+
+    def submit(self, command, params, user_id=None) -> Job:
+        """
+        Validate arguments and queue command for execution.
+        :raises ValueError: if command does not exist or arguments are invalid
+        :raises JobQueueFull: if too many jobs are waiting
+        """
+        compiled = self.registry.command(command)
+        # report invalid arguments right away instead of in job status
+        compiled.bind(params)
+        job = Job(command, params, user_id)
+        self.sweep()
+        with self._lock:
+            if self._queued >= self.max_queued:
+                raise JobQueueFull("Job queue is full")
+            self._queued += 1
+            self._jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job, compiled)
+        return job
+
+    def _run(self, job, compiled):
+        with self._lock:
+            self._queued -= 1
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+        job.started = time.time()
+        token = _current_job.set(job)
+        try:
+            result = compiled(job.params)
+            if inspect.isgenerator(result):
+                job.partial = []
+                for item in result:
+                    job.partial.append(item)
+                result = job.partial
+            job.result = result
+            job.finished = time.time()
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.finished = time.time()
+            job.status = FAILED
+        finally:
+            _current_job.reset(token)
+
+    def get(self, job_id) -> Job:
+        """
+        :return: job or None if it does not exist or expired
+        """
+        self.sweep()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id) -> bool:
+        """
+        Cancel job which has not started yet.
+        :return: True if job was cancelled
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.finished = time.time()
+        # frees the queue slot at once if worker did not pick the job up yet
+        if job.future.cancel():
+            with self._lock:
+                self._queued -= 1
+        return True
+
+    def sweep(self, force=False):
+        """
+        Remove finished jobs older than result_ttl. Runs at most once per SWEEP_INTERVAL unless forced.
+        """
+        now = time.time()
+        expired = now - self.result_ttl
+        with self._lock:
+            if not force and now - self._last_sweep < SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.status in FINISHED and job.finished < expired]:
+                del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,130 @@
+# Keep-alive request handler for werkzeug based servers (Flask development server and prefork workers).
+# werkzeug sends "Connection: close" with every response, because http.server does not know how much
+# of the request body is left to read before the next request line. Here the request body is limited to its
+# Content-Length, so what the app did not read is drained without touching the next request,
+# and connections stay open while responses have Content-Length.
+import io
+
+from werkzeug.serving import WSGIRequestHandler
+
+
+class RequestBody(io.RawIOBase):
+    """
+    Request body stream which never reads past Content-Length.
+    :param stream: buffered input of the connection
+    :param length: value of Content-Length
+    """
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        size = self._limit(size)
+        if size == 0:
+            return b""
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        size = self._limit(len(view))
+        if size == 0:
+            return 0
+        count = self.stream.readinto(view[:size])
+        self.remaining -= count
+        return count
+
+    def readline(self, size=-1):
+        size = self._limit(size)
+        if size == 0:
+            return b""
+        line = self.stream.readline(size)
+        self.remaining -= len(line)
+        return line
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    WSGI request handler keeping HTTP/1.1 connections open between requests.
+    A connection is closed when the client asks for it, when the response has no Content-Length (streamed
+    results), when the request body was chunked or not read whole by the app, when `should_close` says so,
+    when `wait_for_request` gives it up, or after it was idle for `timeout` seconds.
+    """
+    protocol_version = "HTTP/1.1"
+    # head and body are written separately, with Nagle's algorithm the body would wait for delayed ACK
+    disable_nagle_algorithm = True
+    # seconds an idle keep-alive connection is kept open
+    timeout = 15
+
+    _body = None
+    _chunked_response = False
+    _requests_handled = 0
+
+    def should_close(self) -> bool:
+        """
+        Whether connection should be closed after the current response, e.g. because other connections wait.
+        """
+        return False
+
+    def wait_for_request(self) -> bool:
+        """
+        Wait for the next request of a kept-alive connection while it is idle.
+        By default the request is read as it arrives, within `timeout` seconds.
+        :return: False if connection should be closed instead, e.g. because other connections wait
+        """
+        return True
+
+    def handle_one_request(self):
+        if self._requests_handled and not self.wait_for_request():
+            self.close_connection = True
+            return
+        self._requests_handled += 1
+        super().handle_one_request()
+
+    def make_environ(self):
+        environ = super().make_environ()
+        if not environ.get("wsgi.input_terminated"):
+            try:
+                length = max(0, int(environ.get("CONTENT_LENGTH") or 0))
+            except ValueError:
+                length = None
+            if length is not None:
+                # werkzeug drains self.rfile after the response, it must stop at the end of this request
+                self._body = self.rfile = RequestBody(self.rfile, length)
+                environ["wsgi.input"] = self._body
+        return environ
+
+    def run_wsgi(self):
+        rfile = self.rfile
+        self._body = None
+        self._chunked_response = False
+        try:
+            super().run_wsgi()
+        finally:
+            self.rfile = rfile
+        if self._body is None or self._body.remaining or self._chunked_response:
+            self.close_connection = True
+
+    def _keep_alive(self):
+        return (
+            not self.close_connection and self._body is not None and not self._body.remaining
+            and not self._chunked_response and not self.should_close()
+        )
+
+    def send_header(self, keyword, value):
+        name = keyword.lower()
+        if name == "transfer-encoding":
+            self._chunked_response = True
+        elif name == "connection" and value.lower() == "close" and self._keep_alive():
+            # werkzeug asks to close every connection
+            return
+        super().send_header(keyword, value)
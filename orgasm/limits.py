@@ -0,0 +1,144 @@
+# Concurrency limits for commands. Commands declare limits with attr(max_concurrency=..., queue=...),
+# a global limit shared by all commands is set with `set_global_limit`.
+import math
+import threading
+import time
+
+# XML-RPC fault code of calls rejected by concurrency limits
+OVERLOADED_FAULT_CODE = -32000
+
+
+class Overloaded(Exception):
+    """
+    Command was rejected because its concurrency limit and queue are full.
+    :ivar retry_after: estimated number of seconds after which the call may succeed
+    :ivar scope: "command" if limit of the command was hit, "global" if the global limit was hit
+    """
+    def __init__(self, message, retry_after=1, scope="command"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope
+
+
+class ConcurrencyLimiter:
+    """
+    Allows at most max_concurrency calls to run at once, up to queue further calls wait for a free slot,
+    calls beyond that are rejected with Overloaded right away.
+    :param max_concurrency: number of calls running at once
+    :param queue: number of calls waiting for a slot
+    :param timeout: maximal waiting time in seconds, None means waiting until slot is free
+    :param name: name used in error messages
+    :param scope: scope reported in Overloaded
+    """
+    def __init__(self, max_concurrency, queue=0, timeout=None, name="", scope="command"):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.name = name
+        self.scope = scope
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        # moving average of call duration, used to estimate Retry-After
+        self.average_duration = 0.0
+        self._condition = threading.Condition()
+
+    def _overloaded(self):
+        self.rejected += 1
+        backlog = (self.waiting + 1) / self.max_concurrency
+        retry_after = max(1, math.ceil(self.average_duration * backlog))
+        return Overloaded(
+            "Too many concurrent calls%s, try again later" % (" of %s" % self.name if self.name else ""),
+            retry_after,
+            self.scope,
+        )
+
+    def _start(self):
+        self.running += 1
+        return time.monotonic()
+
+    def try_acquire(self):
+        """
+        Take a slot without waiting.
+        :return: start timestamp to pass to `release`, or None if caller has to wait in the queue with `acquire`
+        :raises Overloaded: if queue is full
+        """
+        with self._condition:
+            if self.running < self.max_concurrency:
+                return self._start()
+            if self.waiting >= self.queue:
+                raise self._overloaded()
+            return None
+
+    def acquire(self):
+        """
+        Take a slot, waiting in the queue if all slots are taken.
+        :return: start timestamp to pass to `release`
+        :raises Overloaded: if queue is full or slot was not free within timeout
+        """
+        with self._condition:
+            if self.running < self.max_concurrency:
+                return self._start()
+            if self.waiting >= self.queue:
+                raise self._overloaded()
+            self.waiting += 1
+            try:
+                if not self._condition.wait_for(lambda: self.running < self.max_concurrency, self.timeout):
+                    raise self._overloaded()
+            finally:
+                self.waiting -= 1
+            return self._start()
+
+    def release(self, started):
+        duration = time.monotonic() - started
+        with self._condition:
+            self.running -= 1
+            self.average_duration += (duration - self.average_duration) * 0.1
+            self._condition.notify()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue": self.queue,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+_command_limiters = {}
+_command_limiters_lock = threading.Lock()
+global_limiter = None
+
+def get_command_limiter(cls, spec):
+    """
+    Get limiter of command declared with max_concurrency attribute, shared by all registries.
+    :return: ConcurrencyLimiter or None if command is not limited
+    """
+    attrs = spec["attrs"]
+    if attrs.get("max_concurrency") is None:
+        return None
+    key = (cls, spec["method_name"])
+    with _command_limiters_lock:
+        limiter = _command_limiters.get(key)
+        if limiter is None:
+            limiter = _command_limiters[key] = ConcurrencyLimiter(
+                attrs["max_concurrency"], attrs.get("queue", 0), attrs.get("queue_timeout"), spec["name"]
+            )
+        return limiter
+
+def set_global_limit(max_concurrency, queue=0, timeout=None):
+    """
+    Limit number of calls of all commands running at once in this process.
+    :param max_concurrency: number of calls running at once, None removes the limit
+    :param queue: number of calls waiting for a slot
+    :param timeout: maximal waiting time in seconds
+    """
+    global global_limiter
+    if max_concurrency is None:
+        global_limiter = None
+    else:
+        global_limiter = ConcurrencyLimiter(max_concurrency, queue, timeout, scope="global")
+    return global_limiter
@@ -0,0 +1,178 @@
+# Per-command metrics: call and error counts, in-flight gauge, latency histogram and time spent binding
+# arguments vs executing the command. Every CompiledCommand records into `metrics`, frontends expose it
+# as /metrics in Prometheus text format (REST, web) or as system.stats (RPC).
+import bisect
+import threading
+import time
+
+from orgasm.streaming import primed
+
+# upper bounds of latency histogram buckets in seconds, +Inf bucket is implicit
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class CommandMetrics:
+    """
+    Metrics of single command. Updates take one uncontended lock, so they are cheap enough to be always on.
+    """
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.duration_sum = 0.0
+        self.bind_seconds = 0.0
+        self.exec_seconds = 0.0
+        # non-cumulative counts, last one is +Inf bucket
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+
+    def enter(self):
+        """
+        Record start of a call.
+        :return: perf_counter timestamp to pass to `exit`
+        """
+        with self._lock:
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def exit(self, started, bound=None, error=False):
+        """
+        Record end of a call.
+        :param started: timestamp returned by `enter`
+        :param bound: perf_counter timestamp when arguments were bound, None if binding failed
+        :param error: whether the call raised
+        """
+        now = time.perf_counter()
+        duration = now - started
+        bind = duration if bound is None else bound - started
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            self.in_flight -= 1
+            self.calls += 1
+            if error:
+                self.errors += 1
+            self.duration_sum += duration
+            self.bind_seconds += bind
+            self.exec_seconds += duration - bind
+            self.bucket_counts[index] += 1
+
+    @primed
+    def measure_stream(self, result, started, bound):
+        """
+        Wrap generator result so the call is recorded when the stream is exhausted, fails or is closed.
+        """
+        error = False
+        try:
+            yield
+            yield from result
+        except GeneratorExit:
+            # consumer stopped reading, not an error of the command
+            raise
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.exit(started, bound, error)
+
+    def to_dict(self):
+        with self._lock:
+            counts = list(self.bucket_counts)
+            stats = {
+                "calls": self.calls,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "duration_sum": self.duration_sum,
+                "bind_seconds": self.bind_seconds,
+                "exec_seconds": self.exec_seconds,
+            }
+        # cumulative counts keyed by upper bound, keys are strings so the dict can be sent over XML-RPC
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            buckets[_format_bound(bound)] = total
+        stats["buckets"] = buckets
+        return stats
+
+
+def _format_bound(bound):
+    if bound == float("inf"):
+        return "+Inf"
+    return repr(float(bound))
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """
+    Metrics of all commands in this process, keyed by command name.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def command(self, name) -> CommandMetrics:
+        """
+        Get metrics of the command, created on first access.
+        """
+        metrics = self._commands.get(name)
+        if metrics is None:
+            with self._lock:
+                metrics = self._commands.get(name)
+                if metrics is None:
+                    metrics = self._commands[name] = CommandMetrics(name, self.buckets)
+        return metrics
+
+    def to_dict(self):
+        """
+        Metrics of all commands as dict command name -> stats, see `CommandMetrics.to_dict`.
+        """
+        return {name: metrics.to_dict() for name, metrics in sorted(self._commands.items())}
+
+    def render_prometheus(self) -> str:
+        """
+        Render metrics in Prometheus text exposition format.
+        """
+        stats = self.to_dict()
+        lines = []
+        def family(name, metric_type, help_text, values):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for command, value in values:
+                lines.append('%s{command="%s"} %s' % (name, _escape_label(command), _format_value(value)))
+        family("orgasm_command_calls_total", "counter", "Number of finished command calls.",
+               [(command, s["calls"]) for command, s in stats.items()])
+        family("orgasm_command_errors_total", "counter", "Number of command calls which raised an error.",
+               [(command, s["errors"]) for command, s in stats.items()])
+        family("orgasm_command_in_flight", "gauge", "Number of command calls in progress.",
+               [(command, s["in_flight"]) for command, s in stats.items()])
+        family("orgasm_command_bind_seconds_total", "counter", "Time spent binding and coercing arguments.",
+               [(command, s["bind_seconds"]) for command, s in stats.items()])
+        family("orgasm_command_exec_seconds_total", "counter", "Time spent executing commands.",
+               [(command, s["exec_seconds"]) for command, s in stats.items()])
+        name = "orgasm_command_duration_seconds"
+        lines.append("# HELP %s Duration of command calls including argument binding." % name)
+        lines.append("# TYPE %s histogram" % name)
+        for command, s in stats.items():
+            label = _escape_label(command)
+            for bound, count in s["buckets"].items():
+                lines.append('%s_bucket{command="%s",le="%s"} %d' % (name, label, bound, count))
+            lines.append('%s_sum{command="%s"} %s' % (name, label, _format_value(s["duration_sum"])))
+            lines.append('%s_count{command="%s"} %d' % (name, label, s["calls"]))
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,192 @@
+# Pre-forking multi-process server for WSGI apps (REST API and web interface).
+import os
+import select
+import signal
+import socket
+import time
+
+
+def create_listen_socket(host, port, reuse_port=False, backlog=1024):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+# workers exiting with error sooner than this after start count as failed to start
+MIN_WORKER_LIFETIME = 1.0
+# delay before respawning worker which failed to start, doubled with every further failure
+RESPAWN_DELAY = 0.1
+MAX_RESPAWN_DELAY = 30.0
+# seconds between checks whether worker was asked to stop while a keep-alive connection is idle
+IDLE_POLL_INTERVAL = 0.5
+
+
+def has_pending_connection(listen_socket) -> bool:
+    return bool(select.select([listen_socket], [], [], 0)[0])
+
+
+def run_worker(app_factory, host, port, listen_socket, reuse_port, max_requests, keepalive_timeout):
+    """
+    Serve requests in worker process until it is asked to stop or handled max_requests requests.
+    """
+    from werkzeug.serving import BaseWSGIServer
+    from orgasm.keepalive import KeepAliveRequestHandler
+    from orgasm.server_pool import has_buffered_data
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    if reuse_port:
+        listen_socket = create_listen_socket(host, port, reuse_port=True)
+    # listening socket is non-blocking so workers which lost the race for a connection go back to waiting
+    listen_socket.setblocking(False)
+    # app (and with it command registry) is built once per worker, after fork
+    app = app_factory()
+    handled = [0]
+    def counting_app(environ, start_response):
+        handled[0] += 1
+        return app(environ, start_response)
+    class RequestHandler(KeepAliveRequestHandler):
+        timeout = keepalive_timeout
+
+        def should_close(self):
+            # worker serves one connection at a time, keep-alive connection must not hold it
+            # while other connections wait, or when the worker is about to stop
+            return (
+                bool(stopping) or bool(max_requests and handled[0] >= max_requests)
+                or has_pending_connection(listen_socket)
+            )
+
+        def wait_for_request(self):
+            # idle connection and listening socket are watched together, so the idle connection
+            # is dropped as soon as a new connection waits for the worker
+            if has_buffered_data(self.connection, self.rfile):
+                return True
+            deadline = time.monotonic() + keepalive_timeout
+            while not stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    readable = select.select([self.connection, listen_socket], [], [],
+                                             min(remaining, IDLE_POLL_INTERVAL))[0]
+                except (OSError, ValueError):
+                    return False
+                if self.connection in readable:
+                    return True
+                if readable:
+                    return False
+            return False
+    server = BaseWSGIServer(host, port, counting_app, handler=RequestHandler, fd=listen_socket.fileno())
+    server.timeout = 0.5
+    while not stopping and (not max_requests or handled[0] < max_requests):
+        server.handle_request()
+    server.server_close()
+
+
+def serve_prefork(app_factory, host="127.0.0.1", port=5000, workers=None, max_requests=0, reuse_port=False,
+                  keepalive_timeout=5, max_start_failures=10):
+    """
+    Serve WSGI app from multiple pre-forked worker processes sharing one listening port.
+    Each worker handles one connection at a time. Connections are kept alive between requests,
+    an idle connection is closed as soon as another connection waits for the worker.
+
+    SIGHUP restarts workers one by one (graceful restart), SIGTERM and SIGINT stop the server after
+    workers finish requests in progress.
+    Workers which fail right after start (e.g. app_factory raises) are respawned with exponential backoff,
+    the server gives up with RuntimeError after max_start_failures such failures in a row.
+    :param app_factory: callable returning WSGI app, called once in every worker
+    :param workers: number of worker processes, defaults to number of CPUs
+    :param max_requests: recycle worker after it handled this many requests, 0 means never
+    :param reuse_port: bind separate socket with SO_REUSEPORT in every worker instead of sharing inherited socket
+    :param keepalive_timeout: close keep-alive connections idle for this many seconds
+    :param max_start_failures: number of workers failing on start in a row after which the server stops
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Pre-fork server requires os.fork")
+    workers = workers or os.cpu_count() or 1
+    # with SO_REUSEPORT every worker binds its own socket, master must not listen or it would get connections too
+    listen_socket = None if reuse_port else create_listen_socket(host, port)
+    # pid -> time.monotonic() of start
+    children = {}
+    state = {"stop": False, "restart": False}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(app_factory, host, port, listen_socket, reuse_port, max_requests, keepalive_timeout)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+        return pid
+
+    def on_stop(signum, frame):
+        state["stop"] = True
+
+    def on_restart(signum, frame):
+        state["restart"] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_restart)
+    print(f"Serving on http://{host}:{port} with {workers} worker processes (master pid {os.getpid()})")
+    failures = 0
+    next_spawn = 0.0
+    try:
+        while not state["stop"]:
+            if state["restart"]:
+                state["restart"] = False
+                for pid in list(children):
+                    # start replacement before stopping old worker so capacity never drops
+                    spawn()
+                    os.kill(pid, signal.SIGTERM)
+            if len(children) < workers and time.monotonic() >= next_spawn:
+                # initial workers, and replacements of recycled or crashed ones
+                spawn()
+                continue
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and time.monotonic() - started < MIN_WORKER_LIFETIME:
+                failures += 1
+                if failures >= max_start_failures:
+                    raise RuntimeError("Workers failed on start %d times in a row, giving up" % failures)
+                delay = min(RESPAWN_DELAY * 2 ** (failures - 1), MAX_RESPAWN_DELAY)
+                print(f"Worker {pid} failed on start (exit code {code}), respawning in {delay:.1f} s")
+                next_spawn = time.monotonic() + delay
+            else:
+                failures = 0
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        if listen_socket is not None:
+            listen_socket.close()
@@ -0,0 +1,267 @@
+# Pool of worker processes for CPU-bound commands (tagged cpu_bound).
+#
+# Every worker imports command modules once and keeps one instance of every command class it was asked to run.
+# Workers are replaced after max_tasks tasks or when their resident memory grows above max_rss.
+# Large results are passed back through shared memory instead of the pipe: the worker pickles the result
+# with protocol 5, writes pickle and out-of-band buffers into a SharedMemory block and sends only its name.
+import asyncio
+import atexit
+import importlib
+import inspect
+import multiprocessing
+import os
+import pickle
+import queue
+import resource
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+DEFAULT_SHM_THRESHOLD = 1024 * 1024
+
+# workers are started from threads of running servers, forking such a process could copy a lock held
+# by another thread into the child; forkserver forks from a separate single-threaded process
+DEFAULT_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_RESULT = "result"
+_SHM_RESULT = "shm"
+_ERROR = "error"
+
+
+def current_rss():
+    """
+    Resident set size of the current process in bytes.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # peak instead of current size, kilobytes on Linux and bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def _resolve_class(module_name, qualname):
+    obj = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _pack_result(result, shm_threshold):
+    buffers = []
+    data = pickle.dumps(result, protocol=5, buffer_callback=buffers.append)
+    raw = [buffer.raw() for buffer in buffers]
+    size = len(data) + sum(view.nbytes for view in raw)
+    if shm_threshold is None or size < shm_threshold:
+        return _RESULT, (data, [bytes(view) for view in raw])
+    block = shared_memory.SharedMemory(create=True, size=size)
+    # parent process removes the block, worker must not remove it when it exits
+    resource_tracker.unregister(block._name, "shared_memory")
+    try:
+        offset = len(data)
+        block.buf[:offset] = data
+        sizes = []
+        for view in raw:
+            block.buf[offset:offset + view.nbytes] = view.cast("B")
+            offset += view.nbytes
+            sizes.append(view.nbytes)
+        return _SHM_RESULT, (block.name, len(data), sizes)
+    finally:
+        block.close()
+
+
+def _unpack_shm_result(name, data_size, sizes):
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        offset = data_size
+        buffers = []
+        for size in sizes:
+            # one copy out of shared memory, block is removed right after
+            buffers.append(bytearray(block.buf[offset:offset + size]))
+            offset += size
+        return pickle.loads(block.buf[:data_size], buffers=buffers)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def _worker_main(conn, shm_threshold):
+    classes = {}
+    instances = {}
+    from orgasm import is_super_function
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        if task is None:
+            return
+        module_name, qualname, method_name, kwargs = task
+        try:
+            key = (module_name, qualname)
+            if key not in classes:
+                classes[key] = _resolve_class(module_name, qualname)
+                instances[key] = classes[key]()
+            instance = instances[key]
+            method = getattr(instance, method_name)
+            result = method(instance, **kwargs) if is_super_function(method) else method(**kwargs)
+            if inspect.iscoroutine(result):
+                result = asyncio.run(result)
+            elif inspect.isgenerator(result):
+                # generators can not cross process boundary, items are collected
+                result = list(result)
+            kind, payload = _pack_result(result, shm_threshold)
+        except Exception as e:
+            try:
+                kind, payload = _ERROR, pickle.dumps(e)
+            except Exception:
+                kind, payload = _ERROR, pickle.dumps(RuntimeError("%s: %s" % (type(e).__name__, e)))
+        conn.send((kind, payload, current_rss()))
+
+
+class Worker:
+    def __init__(self, context, shm_threshold):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, shm_threshold), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        self.rss = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class ProcessPool:
+    """
+    Runs methods of command classes in worker processes. Calling thread waits for the result,
+    so the pool can be used from any number of threads; at most `workers` commands run at once.
+    :param workers: number of worker processes, defaults to number of CPUs
+    :param max_tasks: replace worker after it ran this many tasks, None means never
+    :param max_rss: replace worker when its resident memory exceeds this many bytes, None means never
+    :param shm_threshold: results larger than this many bytes are passed through shared memory,
+        None disables shared memory
+    :param start_method: multiprocessing start method, "forkserver" where available, otherwise "spawn".
+        With both, command classes are imported in workers, classes defined in the main script are imported
+        from it again, so it has to guard its entry point with `if __name__ == "__main__"`
+    """
+    def __init__(self, workers=None, max_tasks=1000, max_rss=None, shm_threshold=DEFAULT_SHM_THRESHOLD,
+                 start_method=DEFAULT_START_METHOD):
+        self.size = workers or os.cpu_count() or 1
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.shm_threshold = shm_threshold
+        self.context = multiprocessing.get_context(start_method)
+        self.recycled = 0
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+
+    def _acquire(self):
+        # workers are started lazily, up to pool size
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Process pool is shut down")
+            if self._idle.empty() and self._started < self.size:
+                self._started += 1
+                return Worker(self.context, self.shm_threshold)
+        return self._idle.get()
+
+    def warmup(self):
+        """
+        Start all worker processes now instead of on first use. Servers call it at start.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Process pool is shut down")
+            while self._started < self.size:
+                self._started += 1
+                self._idle.put(Worker(self.context, self.shm_threshold))
+
+    def _release(self, worker, broken=False):
+        recycle = (self.max_tasks and worker.tasks >= self.max_tasks) or (self.max_rss and worker.rss > self.max_rss)
+        if not broken and not recycle:
+            self._idle.put(worker)
+            return
+        worker.stop()
+        with self._lock:
+            self.recycled += 1
+            if self._closed:
+                self._started -= 1
+                return
+        # replacement is started right away, other callers may be waiting for an idle worker
+        self._idle.put(Worker(self.context, self.shm_threshold))
+
+    def run(self, cls, method_name, kwargs):
+        """
+        Run method of command class in a worker process and wait for its result.
+        Class must be importable by its module and qualified name.
+        """
+        task = (cls.__module__, cls.__qualname__, method_name, kwargs)
+        worker = self._acquire()
+        try:
+            worker.conn.send(task)
+            kind, payload, worker.rss = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._release(worker, broken=True)
+            raise RuntimeError("Worker process running %s died" % method_name) from e
+        except BaseException:
+            # result of interrupted task would be read by the next caller
+            self._release(worker, broken=True)
+            raise
+        worker.tasks += 1
+        self._release(worker)
+        if kind == _SHM_RESULT:
+            return _unpack_shm_result(*payload)
+        if kind == _ERROR:
+            raise pickle.loads(payload)
+        data, buffers = payload
+        return pickle.loads(data, buffers=buffers)
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPool:
+    """
+    Get process pool used for cpu_bound commands, created with default settings on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPool()
+        return _pool
+
+def configure_process_pool(**options) -> ProcessPool:
+    """
+    Replace process pool used for cpu_bound commands, see `ProcessPool` for options.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPool(**options)
+        return _pool
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown()
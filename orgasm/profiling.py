@@ -0,0 +1,277 @@
+# Profiling of command calls with cProfile. The CLI profiles a single call with --profile, servers profile
+# sampled requests (1-in-N, or requests asking for it) with RequestProfiler. Every profile is written
+# as pstats file and as collapsed stacks (input of flamegraph.pl, speedscope) and added to per-command totals.
+import cProfile
+import inspect
+import io
+import itertools
+import os
+import pstats
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from orgasm import request_log
+from orgasm.streaming import primed
+
+# header of REST requests asking to be profiled
+PROFILE_HEADER = "X-Orgasm-Profile"
+
+# collapsed stacks deeper than this are cut, recursion in cProfile call graph is not followed anyway
+MAX_STACK_DEPTH = 64
+
+
+def profile_requested(value) -> bool:
+    """
+    Whether value of PROFILE_HEADER asks for profiling.
+    """
+    return str(value or "").strip().lower() in ["1", "true", "yes", "on"]
+
+def _enable(profile):
+    try:
+        profile.enable()
+        return True
+    except ValueError:
+        # since Python 3.12 only one profiler can be active in the process
+        return False
+
+def run_profiled(func, args, on_finish):
+    """
+    Call func(*args) under cProfile. Generator results are profiled while they are consumed,
+    even when items are pulled from different threads.
+    :param on_finish: called with the cProfile.Profile once the call, or the stream, is finished
+    :return: result of the call, wrapped if it is a generator
+    """
+    profile = cProfile.Profile()
+    if not _enable(profile):
+        return func(*args)
+    try:
+        result = func(*args)
+    except BaseException:
+        profile.disable()
+        on_finish(profile)
+        raise
+    profile.disable()
+    if not inspect.isgenerator(result):
+        on_finish(profile)
+        return result
+    return _profile_stream(profile, result, on_finish)
+
+@primed
+def _profile_stream(profile, result, on_finish):
+    try:
+        yield
+        while True:
+            enabled = _enable(profile)
+            try:
+                item = next(result)
+            except StopIteration:
+                return
+            finally:
+                if enabled:
+                    profile.disable()
+            yield item
+    finally:
+        result.close()
+        on_finish(profile)
+
+
+def _label(func):
+    filename, lineno, name = func
+    if filename == "~":
+        # built-in function
+        label = name
+    else:
+        label = "%s (%s:%d)" % (name, os.path.basename(filename), lineno)
+    return label.replace(";", ",")
+
+def collapsed_stacks(stats: pstats.Stats):
+    """
+    Convert profile to collapsed stacks, one "root;caller;function microseconds" line per stack.
+    cProfile records only caller -> callee edges, so time of functions reachable by several paths is split
+    between the paths in proportion to time spent in every caller.
+    :return: list of lines
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge))
+    totals = {}
+    def walk(func, stack, share):
+        stack.append(_label(func))
+        key = ";".join(stack)
+        totals[key] = totals.get(key, 0) + entries[func][2] * share
+        if len(stack) < MAX_STACK_DEPTH:
+            for callee, edge in callees.get(func, ()):
+                # recursive calls are folded into the outermost frame of the function
+                if _label(callee) in stack:
+                    continue
+                callee_time = entries[callee][3]
+                # part of callee time spent under this path
+                walk(callee, stack, share * (edge[3] / callee_time if callee_time else 0))
+        stack.pop()
+    for func, (cc, nc, tt, ct, callers) in entries.items():
+        if not callers:
+            walk(func, [], 1.0)
+    lines = []
+    for key, seconds in totals.items():
+        microseconds = int(seconds * 1e6)
+        if microseconds > 0:
+            lines.append("%s %d" % (key, microseconds))
+    return lines
+
+def write_profile(profile, path):
+    """
+    Write profile as pstats file to path and as collapsed stacks next to it with .collapsed suffix.
+    :return: tuple (pstats path, collapsed stacks path)
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    stats = pstats.Stats(profile)
+    stats.dump_stats(str(path))
+    collapsed = path.with_suffix(".collapsed")
+    with open(collapsed, "w") as f:
+        for line in collapsed_stacks(stats):
+            f.write(line + "\n")
+    return path, collapsed
+
+def top_functions(stats: pstats.Stats, limit=20, sort="tottime"):
+    """
+    Hottest functions of the profile.
+    :param sort: "tottime" (time in the function itself) or "cumtime" (including callees)
+    :return: list of dicts with function, calls, tottime and cumtime
+    """
+    if sort not in ["tottime", "cumtime"]:
+        raise ValueError("Invalid sort %s" % sort)
+    rows = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({"function": _label(func), "calls": nc, "tottime": tt, "cumtime": ct})
+    rows.sort(key=lambda row: row[sort], reverse=True)
+    return rows[:limit]
+
+def print_summary(profile, limit=15, file=sys.stderr):
+    """
+    Print hottest functions of the profile by cumulative time.
+    """
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(limit)
+    print(out.getvalue(), file=file)
+
+
+class RequestProfiler:
+    """
+    Profiles sampled server requests. A request is profiled if it is every sample_rate-th request,
+    or if it asks for it (header or flag) and forced profiling is allowed.
+    Only one call is profiled at a time, other requests picked meanwhile run without profiler.
+    Profiles are saved by a background thread, so requests never wait for it: they are written to directory,
+    oldest files are removed once there are more than max_files, and are added to per-command totals
+    listed by `top`. Profiles finished while queue_size profiles wait to be saved are dropped.
+    :param directory: where profiles are written, defaults to orgasm-profiles in the system temporary directory
+    :param sample_rate: profile 1 in sample_rate requests, 0 disables sampling
+    :param max_files: number of profiles kept in directory
+    :param allow_forced: whether requests may ask to be profiled, off by default as any client could
+        make the server profile, and save profiles of, all its requests
+    :param queue_size: maximal number of profiles waiting to be saved
+    """
+    def __init__(self, directory=None, sample_rate=0, max_files=100, allow_forced=False, queue_size=16):
+        self.directory = Path(directory or os.path.join(tempfile.gettempdir(), "orgasm-profiles"))
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.allow_forced = allow_forced
+        self.dropped = 0
+        self._requests = itertools.count(1)
+        self._sequence = itertools.count()
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        # command name -> aggregated pstats.Stats
+        self._stats = {}
+        self._pending = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def should_profile(self, forced=False) -> bool:
+        """
+        Decide whether request is profiled, counts requests for sampling.
+        :param forced: request asked to be profiled
+        """
+        if forced and self.allow_forced:
+            return True
+        return self.sample_rate > 0 and next(self._requests) % self.sample_rate == 0
+
+    def call(self, command, func, *args):
+        """
+        Call func(*args) for command, profiled unless another request is being profiled.
+        """
+        if not self._active.acquire(blocking=False):
+            return func(*args)
+        try:
+            return run_profiled(func, args, lambda profile: self._finish(command, profile))
+        finally:
+            # streamed items are profiled without holding the lock, so abandoned streams can not block profiling
+            self._active.release()
+
+    def _finish(self, command, profile):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write, name="orgasm-profiler", daemon=True)
+                    self._writer.start()
+        try:
+            self._pending.put_nowait((command, profile))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            command, profile = self._pending.get()
+            try:
+                self._save(command, profile)
+            finally:
+                self._pending.task_done()
+
+    def flush(self):
+        """
+        Wait until all finished profiles are saved.
+        """
+        if self._writer is not None:
+            self._pending.join()
+
+    def _save(self, command, profile):
+        try:
+            name = "%s-%06d-%s.pstats" % (
+                time.strftime("%Y%m%d-%H%M%S"), next(self._sequence) % 1000000, re.sub(r"[^\w.-]", "_", command)
+            )
+            write_profile(profile, self.directory / name)
+            self._rotate()
+            with self._lock:
+                stats = self._stats.get(command)
+                if stats is None:
+                    self._stats[command] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+        except Exception as e:
+            request_log.logger.log(request_log.ERROR, "profile_save_failed", command=command, error=str(e))
+
+    def _rotate(self):
+        profiles = sorted(self.directory.glob("*.pstats"))
+        for path in profiles[:max(0, len(profiles) - self.max_files)]:
+            for stale in [path, path.with_suffix(".collapsed")]:
+                try:
+                    stale.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def top(self, command=None, limit=20, sort="tottime"):
+        """
+        Hottest functions aggregated over profiled requests of every command.
+        :param command: only this command, None for all profiled commands
+        :return: dict command name -> list of dicts, see `top_functions`
+        """
+        with self._lock:
+            commands = sorted(self._stats) if command is None else [c for c in [command] if c in self._stats]
+            return {c: top_functions(self._stats[c], limit, sort) for c in commands}
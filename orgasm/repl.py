@@ -1,5 +1,6 @@
 
 #!/usr/bin/env python
+import inspect
 from pathlib import Path
 import re
 import sqlite3
@@ -14,15 +15,18 @@ from prompt_toolkit.document import Document
 from prompt_toolkit.lexers import PygmentsLexer
 from prompt_toolkit.styles import Style
 
-from orgasm import get_command_specs, execute_command
+from orgasm import get_command_specs, execute_command, get_registry
 
 class CommandCompleter(Completer):
 
     def __init__(
         self,
-        spec
+        spec,
+        registry=None
     ) -> None:
         self.spec = spec 
+        # when registry is given, valid values are looked up through its cached providers
+        self.registry = registry
 
     def get_completions(
         self, document: Document, complete_event: CompleteEvent
@@ -71,6 +75,8 @@ class CommandCompleter(Completer):
                         arg_name = document.text_before_cursor.split()[-1][:-1]
                         for arg in command.get("args", []):
                             if arg["name"] == arg_name:
+                                if self.registry is not None and command["name"] in self.registry:
+                                    arg = dict(arg, valid_values=self.registry.command(command["name"]).valid_values(arg_name))
                                 # if the argument has valid values, we complete them
                                 if "valid_values" in arg and arg["valid_values"] is not None:
                                     if callable(arg["valid_values"]):
@@ -100,9 +106,11 @@ style = Style.from_dict(
 
 
 def launch_repl(classes):
-    specs = get_command_specs(classes)
+    registry = get_registry(classes)
+    registry.warmup()
+    specs = registry.specs
     session = PromptSession(
-        lexer=PygmentsLexer(BashLexer), completer=CommandCompleter(specs), style=style
+        lexer=PygmentsLexer(BashLexer), completer=CommandCompleter(specs, registry), style=style
     )
 
     while True:
@@ -135,10 +143,10 @@ def launch_repl(classes):
                 
             command = command.strip()
             args = [arg.strip() for arg in args if arg.strip()]
-            if command not in [c["name"] for c in specs]:
+            if command not in registry:
                 print(f"Unknown command: {command}")
                 continue  # Skip unknown commands
-            command_spec = next(c for c in specs if c["name"] == command)
+            command_spec = registry.get(command)
             # Prepare arguments for execution
             kwargs = {}
             for arg in args:
@@ -190,8 +198,12 @@ def launch_repl(classes):
                         kwargs[arg["name"]] = arg["type"](kwargs[arg["name"]])
             # Execute the command
             try:
-                result = execute_command(classes, command, kwargs)
-                if result is not None:
+                result = execute_command(registry, command, kwargs)
+                if inspect.isgenerator(result):
+                    # print streamed items as they are produced
+                    for item in result:
+                        print(item, flush=True)
+                elif result is not None:
                     print(result)
             except Exception as e:
                 print(str(e))
@@ -0,0 +1,235 @@
+# Structured request logging. Frontends report every call with `request_log.logger.request(...)`, records are put
+# into a bounded queue and written as JSON lines by a background thread, so request threads never wait for I/O.
+# Params and results are summarized (long strings cut, large collections shortened) before they are queued.
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+import types
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "off": OFF}
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+# number of items of lists and dicts kept in summaries
+MAX_ITEMS = 20
+# nesting of lists and dicts kept in summaries
+MAX_DEPTH = 3
+
+_MISSING = object()
+
+
+def summarize(value, max_length=200, depth=0):
+    """
+    Bounded JSON friendly summary of value: long strings are cut to max_length, binary data is replaced
+    by its size and only first MAX_ITEMS items of collections up to MAX_DEPTH levels are kept.
+    Cost does not depend on size of the value.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        if len(value) > max_length:
+            return value[:max_length] + "...(%d chars)" % len(value)
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        try:
+            return "<%d bytes>" % (value.nbytes if isinstance(value, memoryview) else len(value))
+        except ValueError:
+            # released memoryview
+            return "<bytes>"
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return "<dict of %d items>" % len(value)
+        summary = {}
+        for key, item in value.items():
+            if len(summary) >= MAX_ITEMS:
+                summary["..."] = "%d items" % len(value)
+                break
+            summary[str(key)] = summarize(item, max_length, depth + 1)
+        return summary
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if depth >= MAX_DEPTH:
+            return "<%s of %d items>" % (type(value).__name__, len(value))
+        items = value if isinstance(value, (list, tuple)) else list(value)
+        summary = [summarize(item, max_length, depth + 1) for item in items[:MAX_ITEMS]]
+        if len(items) > MAX_ITEMS:
+            summary.append("...(%d items)" % len(items))
+        return summary
+    if isinstance(value, types.GeneratorType):
+        # streamed result, items are not logged
+        return "<stream>"
+    text = repr(value)
+    if len(text) > max_length:
+        return text[:max_length] + "...(%d chars)" % len(text)
+    return text
+
+
+class RequestLogger:
+    """
+    Writes one JSON line per request: time, level, frontend, command, status, duration_ms and summaries
+    of params and result (or error).
+    Successful requests are logged at info level and can be sampled, rejected requests at warning level,
+    failed requests at error level with traceback. Records of level below `level` are skipped
+    before anything is summarized.
+    :param stream: file object to write to, defaults to sys.stdout
+    :param level: minimal level, one of DEBUG, INFO, WARNING, ERROR, OFF or its name
+    :param sample_rate: fraction of successful requests which are logged
+    :param max_length: maximal length of strings in params and result summaries
+    :param log_params: include params summary
+    :param log_results: include result summary
+    :param queue_size: maximal number of records waiting to be written, further records are dropped
+    :param close_stream: close stream in `close`, for streams opened for the logger
+    """
+    def __init__(self, stream=None, level=INFO, sample_rate=1.0, max_length=200, log_params=True, log_results=True,
+                 queue_size=10000, close_stream=False):
+        self.stream = stream
+        self.close_stream = close_stream
+        self.level = LEVELS[level] if isinstance(level, str) else level
+        self.sample_rate = sample_rate
+        self.max_length = max_length
+        self.log_params = log_params
+        self.log_results = log_results
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def request(self, frontend, command, params, started, result=_MISSING, error=None, status=None):
+        """
+        Log finished request.
+        :param frontend: name of the frontend, e.g. "rest", "web", "rpc"
+        :param started: time.perf_counter() timestamp of request start
+        :param result: command result, omitted for failed requests
+        :param error: exception of failed or rejected request
+        :param status: status reported in the record, e.g. HTTP status, defaults to "ok" or "error"
+        """
+        duration = time.perf_counter() - started
+        if error is None:
+            level = INFO
+        elif status in [429, 503, "overloaded"]:
+            level = WARNING
+        else:
+            level = ERROR
+        if level < self.level:
+            return
+        if level == INFO and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        record = {
+            "time": time.time(),
+            "level": LEVEL_NAMES[level],
+            "frontend": frontend,
+            "command": command,
+            "status": status if status is not None else ("ok" if error is None else "error"),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        if self.log_params:
+            record["params"] = summarize(params, self.max_length)
+        if error is not None:
+            record["error"] = summarize(str(error), self.max_length)
+            if level == ERROR:
+                record["traceback"] = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        elif self.log_results and result is not _MISSING:
+            record["result"] = summarize(result, self.max_length)
+        self._put(record)
+
+    def log(self, level, event, **fields):
+        """
+        Log event which is not a request, fields are summarized.
+        """
+        if level < self.level:
+            return
+        record = {"time": time.time(), "level": LEVEL_NAMES.get(level, str(level)), "event": event}
+        for key, value in fields.items():
+            record[key] = summarize(value, self.max_length)
+        self._put(record)
+
+    def _put(self, record):
+        if self._writer is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write, name="orgasm-request-log", daemon=True)
+                self._writer.start()
+
+    def _write(self):
+        while True:
+            records = [self._queue.get()]
+            # write everything queued meanwhile at once
+            while len(records) < 1000:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            stop = False
+            for record in records:
+                if record is None:
+                    stop = True
+                    continue
+                lines.append(json.dumps(record, default=str))
+            stream = self.stream or sys.stdout
+            try:
+                if lines:
+                    stream.write("\n".join(lines) + "\n")
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+            for _ in records:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """
+        Wait until all queued records are written.
+        """
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        """
+        Write queued records and stop the writer thread.
+        """
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        if self.close_stream and self.stream is not None:
+            self.stream.close()
+
+
+# logger used by frontends, looked up on every request so it can be replaced with `configure_request_log`
+logger = RequestLogger()
+
+def configure_request_log(path=None, **options) -> RequestLogger:
+    """
+    Replace logger used by frontends, see `RequestLogger` for options.
+    :param path: append records to this file instead of stdout
+    """
+    global logger
+    if path is not None:
+        options["stream"] = open(path, "a", buffering=1024 * 1024)
+        options["close_stream"] = True
+    previous, logger = logger, RequestLogger(**options)
+    previous.close()
+    return logger
+
+@atexit.register
+def _close_request_log():
+    logger.close()
@@ -0,0 +1,441 @@
+# Binary RPC transport served alongside XML-RPC.
+#
+# Messages are encoded with a compact msgpack-style binary encoding and sent as length-prefixed frames:
+#     4 bytes big-endian payload length | 1 byte flags | payload
+# Flag FLAG_COMPRESSED means payload is zlib compressed.
+# Request payload is [request_id, method, params], response payload is [request_id, status, value].
+# Every request carries its own id, so client can send many requests on one connection without
+# waiting for responses, and server answers them in order of completion.
+# Generator results are streamed as STATUS_CHUNK responses carrying lists of items, followed by
+# STATUS_END (or STATUS_ERROR if the generator failed).
+import datetime
+import inspect
+import itertools
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from orgasm.server_pool import PooledMixIn
+
+FLAG_COMPRESSED = 1
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+DEFAULT_COMPRESS_THRESHOLD = 16 * 1024
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_CHUNK = 2
+STATUS_END = 3
+
+# number of streamed items sent in one frame
+STREAM_BATCH_SIZE = 256
+
+_HEADER = struct.Struct(">IB")
+_INT = struct.Struct(">q")
+_FLOAT = struct.Struct(">d")
+_LEN = struct.Struct(">I")
+
+
+class RPCError(Exception):
+    """
+    Error raised by the remote command.
+    """
+
+
+def _encode(obj, out):
+    if obj is None:
+        out += b"N"
+    elif obj is True:
+        out += b"T"
+    elif obj is False:
+        out += b"F"
+    elif isinstance(obj, int):
+        if -(1 << 63) <= obj < (1 << 63):
+            out += b"i"
+            out += _INT.pack(obj)
+        else:
+            data = str(obj).encode()
+            out += b"I"
+            out += _LEN.pack(len(data))
+            out += data
+    elif isinstance(obj, float):
+        out += b"d"
+        out += _FLOAT.pack(obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        out += b"s"
+        out += _LEN.pack(len(data))
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out += b"b"
+        out += _LEN.pack(len(obj) if not isinstance(obj, memoryview) else obj.nbytes)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        out += b"l"
+        out += _LEN.pack(len(obj))
+        for item in obj:
+            _encode(item, out)
+    elif isinstance(obj, dict):
+        out += b"m"
+        out += _LEN.pack(len(obj))
+        for key, value in obj.items():
+            _encode(key, out)
+            _encode(value, out)
+    elif isinstance(obj, datetime.datetime):
+        data = obj.isoformat().encode()
+        out += b"t"
+        out += _LEN.pack(len(data))
+        out += data
+    else:
+        raise TypeError("Can not encode value of type %s" % type(obj).__name__)
+
+
+def encode(obj) -> bytes:
+    """
+    Encode value into binary format. Supported types are None, bool, int, float, str,
+    bytes, list, tuple, dict and datetime.
+    """
+    out = bytearray()
+    _encode(obj, out)
+    return bytes(out)
+
+
+def _decode(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == 0x4E:  # N
+        return None, offset
+    if tag == 0x54:  # T
+        return True, offset
+    if tag == 0x46:  # F
+        return False, offset
+    if tag == 0x69:  # i
+        return _INT.unpack_from(data, offset)[0], offset + 8
+    if tag == 0x64:  # d
+        return _FLOAT.unpack_from(data, offset)[0], offset + 8
+    if tag in (0x73, 0x62, 0x49, 0x74):  # s b I t
+        length = _LEN.unpack_from(data, offset)[0]
+        offset += 4
+        raw = bytes(data[offset:offset + length])
+        offset += length
+        if tag == 0x73:
+            return raw.decode("utf-8"), offset
+        if tag == 0x62:
+            return raw, offset
+        if tag == 0x49:
+            return int(raw), offset
+        return datetime.datetime.fromisoformat(raw.decode()), offset
+    if tag == 0x6C:  # l
+        count = _LEN.unpack_from(data, offset)[0]
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == 0x6D:  # m
+        count = _LEN.unpack_from(data, offset)[0]
+        offset += 4
+        result = {}
+        for _ in range(count):
+            key, offset = _decode(data, offset)
+            value, offset = _decode(data, offset)
+            result[key] = value
+        return result, offset
+    raise ValueError("Unknown type tag %r" % chr(tag))
+
+
+def decode(data):
+    """
+    Decode value encoded with `encode`.
+    """
+    value, offset = _decode(memoryview(data), 0)
+    if offset != len(data):
+        raise ValueError("Trailing data after encoded value")
+    return value
+
+
+def write_frame(sock, obj, compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+    payload = encode(obj)
+    flags = 0
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        compressed = zlib.compress(payload, 1)
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_COMPRESSED
+    sock.sendall(_HEADER.pack(len(payload), flags) + payload)
+
+
+def _read_exactly(sock, n):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received)
+        if count == 0:
+            raise ConnectionError("Connection closed")
+        received += count
+    return buffer
+
+
+def read_frame(sock):
+    length, flags = _HEADER.unpack(_read_exactly(sock, _HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("Frame of %d bytes exceeds maximal size" % length)
+    payload = _read_exactly(sock, length)
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    return decode(payload)
+
+
+class BinaryRPCServer(PooledMixIn, socketserver.TCPServer):
+    """
+    Serves public methods of dispatcher (e.g. `execute`) over the binary transport.
+    Connections are read on a fixed pool of connections threads, further accepted connections wait in a queue
+    of queue_size (see `orgasm.server_pool.PooledMixIn`). Calls run on a shared pool of max_workers threads.
+    :param address: (host, port) to listen on
+    :param dispatcher: object whose public methods can be called
+    :param max_workers: number of threads executing calls
+    :param compress_threshold: compress responses larger than this many bytes, None disables compression
+    :param connections: number of connections served at once
+    :param queue_size: number of accepted connections waiting for a free connection thread
+    :param queue_full: "block", "reject" or "drop", rejected connections are closed as the transport has
+        no way to report the error
+    """
+    allow_reuse_address = True
+
+    def __init__(self, address, dispatcher, max_workers=32, compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+                 connections=32, queue_size=128, queue_full="block"):
+        self.dispatcher = dispatcher
+        self.compress_threshold = compress_threshold
+        self.workers = connections
+        self.queue_size = queue_size
+        self.queue_full = queue_full
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orgasm-rpc")
+        super().__init__(address, BinaryRPCHandler)
+
+    def resolve(self, method):
+        if not isinstance(method, str) or method.startswith("_"):
+            raise AttributeError("Method %s is not supported" % method)
+        return getattr(self.dispatcher, method)
+
+
+class BinaryRPCHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        write_lock = threading.Lock()
+        def respond(request_id, status, value):
+            with write_lock:
+                write_frame(sock, [request_id, status, value], self.server.compress_threshold)
+        def run(request_id, method, params):
+            try:
+                result = self.server.resolve(method)(*params)
+            except Exception as e:
+                respond(request_id, STATUS_ERROR, "%s: %s" % (type(e).__name__, e))
+                return
+            if inspect.isgenerator(result):
+                stream(request_id, result)
+                return
+            try:
+                respond(request_id, STATUS_OK, result)
+            except TypeError as e:
+                respond(request_id, STATUS_ERROR, "TypeError: %s" % e)
+        def send(request_id, status, value):
+            # only errors of the connection are handled here, the client can not be told about them
+            try:
+                respond(request_id, status, value)
+            except OSError:
+                return False
+            except TypeError as e:
+                # item of streamed result can not be encoded
+                send(request_id, STATUS_ERROR, "TypeError: %s" % e)
+                return False
+            return True
+        def stream(request_id, result):
+            try:
+                batch = []
+                while True:
+                    try:
+                        item = next(result)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        # error of the command (including OSError subclasses) is reported to the client,
+                        # after items produced before it
+                        if not batch or send(request_id, STATUS_CHUNK, batch):
+                            send(request_id, STATUS_ERROR, "%s: %s" % (type(e).__name__, e))
+                        return
+                    batch.append(item)
+                    if len(batch) >= STREAM_BATCH_SIZE:
+                        if not send(request_id, STATUS_CHUNK, batch):
+                            return
+                        batch = []
+                if batch and not send(request_id, STATUS_CHUNK, batch):
+                    return
+                send(request_id, STATUS_END, None)
+            finally:
+                result.close()
+        while not self.server.closing:
+            try:
+                request_id, method, params = read_frame(sock)
+            except (ConnectionError, OSError, ValueError):
+                return
+            self.server.executor.submit(run, request_id, method, params)
+
+
+class BinaryRPCClient:
+    """
+    Thread-safe client for the binary RPC transport.
+    Calls from many threads share one connection and are pipelined: requests are sent immediately,
+    responses are matched to requests by id as they arrive.
+
+    Example:
+        client = BinaryRPCClient("localhost", 8001)
+        client.execute("sum", {"a": 1, "b": 2})
+        futures = [client.call_async("execute", "sum", {"a": i, "b": 1}) for i in range(100)]
+    """
+    def __init__(self, host, port, compress_threshold=DEFAULT_COMPRESS_THRESHOLD, timeout=None):
+        self.compress_threshold = compress_threshold
+        self.timeout = timeout
+        self._sock = socket.create_connection((host, port))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._ids = itertools.count()
+        # request id -> Future, or queue.Queue for streams opened with `stream`
+        self._pending = {}
+        # items of streamed results received so far for requests made with `call_async`
+        self._chunks = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    def _read_responses(self):
+        error = ConnectionError("Connection closed")
+        try:
+            while True:
+                request_id, status, value = read_frame(self._sock)
+                with self._lock:
+                    if status == STATUS_CHUNK:
+                        waiter = self._pending.get(request_id)
+                    else:
+                        waiter = self._pending.pop(request_id, None)
+                if waiter is None:
+                    continue
+                if isinstance(waiter, queue.Queue):
+                    waiter.put((status, value))
+                elif status == STATUS_CHUNK:
+                    self._chunks.setdefault(request_id, []).extend(value)
+                elif status == STATUS_END:
+                    waiter.set_result(self._chunks.pop(request_id, []))
+                elif status == STATUS_OK:
+                    waiter.set_result(value)
+                else:
+                    self._chunks.pop(request_id, None)
+                    waiter.set_exception(RPCError(value))
+        except Exception as e:
+            error = e
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._closed = True
+        for waiter in pending.values():
+            if isinstance(waiter, queue.Queue):
+                waiter.put((None, error))
+            else:
+                waiter.set_exception(error)
+
+    def _send(self, waiter, method, params):
+        request_id = next(self._ids)
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("Connection closed")
+            self._pending[request_id] = waiter
+        try:
+            with self._write_lock:
+                write_frame(self._sock, [request_id, method, list(params)], self.compress_threshold)
+        except Exception:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+        return request_id
+
+    def call_async(self, method, *params) -> Future:
+        """
+        Send request without waiting for the response.
+        :return: Future resolved with the result, streamed results are collected into a list
+        """
+        future = Future()
+        self._send(future, method, params)
+        return future
+
+    def call(self, method, *params):
+        return self.call_async(method, *params).result(self.timeout)
+
+    def stream(self, method, *params):
+        """
+        Call method returning generator and iterate over items as they arrive.
+        Non-streamed result is yielded as a single item.
+        """
+        items = queue.Queue()
+        request_id = self._send(items, method, params)
+        try:
+            while True:
+                status, value = items.get(timeout=self.timeout)
+                if status == STATUS_CHUNK:
+                    yield from value
+                elif status == STATUS_OK:
+                    yield value
+                    return
+                elif status == STATUS_END:
+                    return
+                elif status == STATUS_ERROR:
+                    raise RPCError(value)
+                else:
+                    raise value
+        finally:
+            # stop collecting items if iteration was abandoned
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    def execute(self, command, params=None):
+        """
+        Execute command on the server, same as `execute` of XML-RPC server.
+        """
+        return self.call("execute", command, params or {})
+
+    def execute_stream(self, command, params=None):
+        """
+        Execute command on the server and iterate over items of its result as they are produced.
+        """
+        return self.stream("execute_stream", command, params or {})
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def serve_binary_rpc(dispatcher, port, host="0.0.0.0", max_workers=32, compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+                     connections=32, queue_size=128, queue_full="block"):
+    """
+    Start binary RPC server for dispatcher in a background thread, see `BinaryRPCServer` for options.
+    :return: BinaryRPCServer
+    """
+    server = BinaryRPCServer(
+        (host, port), dispatcher, max_workers=max_workers, compress_threshold=compress_threshold,
+        connections=connections, queue_size=queue_size, queue_full=queue_full,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True, name="orgasm-binary-rpc").start()
+    return server
@@ -0,0 +1,162 @@
+# Worker pool for socketserver based servers, replacement for ThreadingMixIn which starts a new thread
+# for every connection. Accepted connections are put into a bounded queue served by a fixed number of threads.
+import queue
+import select
+import threading
+import time
+
+QUEUE_FULL_BLOCK = "block"
+QUEUE_FULL_REJECT = "reject"
+QUEUE_FULL_DROP = "drop"
+
+# seconds between checks of the queue while a keep-alive connection is idle
+IDLE_POLL_INTERVAL = 0.05
+
+
+def has_buffered_data(sock, rfile) -> bool:
+    """
+    Whether next request can be read from buffered reader of the connection without blocking,
+    e.g. a pipelined request already read into its buffer.
+    """
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(rfile.peek(1))
+    except OSError:
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+class PooledMixIn:
+    """
+    Mix-in class handling connections on a fixed pool of worker threads.
+
+    When the queue of accepted connections is full, behaviour is set by queue_full:
+        "block" - stop accepting until a worker is free, further connections wait in the listen backlog,
+        "reject" - answer with `reject_request` (e.g. 503 response) and close the connection,
+        "drop" - close the connection right away.
+    `server_close` stops accepting and waits up to drain_timeout seconds for queued and running requests,
+    connections still queued after that are closed.
+    """
+    workers = 32
+    queue_size = 128
+    queue_full = QUEUE_FULL_BLOCK
+    drain_timeout = 30
+
+    # set when server is shutting down, handlers should not keep connections alive
+    closing = False
+    _pool = None
+
+    def _start_pool(self):
+        self._requests = queue.Queue(maxsize=self.queue_size)
+        self._pool = []
+        self.rejected = 0
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="orgasm-server-%d" % i, daemon=True)
+            thread.start()
+            self._pool.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            self._start_pool()
+        if self.queue_full == QUEUE_FULL_BLOCK:
+            # wait for a free worker, but not past shutdown
+            while not self.closing:
+                try:
+                    self._requests.put((request, client_address), timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+            self.shutdown_request(request)
+            return
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected += 1
+            if self.queue_full == QUEUE_FULL_REJECT:
+                try:
+                    self.reject_request(request, client_address)
+                except OSError:
+                    pass
+            self.shutdown_request(request)
+
+    def reject_request(self, request, client_address):
+        """
+        Answer connection rejected because the queue is full. Does nothing by default.
+        """
+
+    def has_backlog(self):
+        """
+        Whether connections are waiting for a free worker.
+        """
+        return self._pool is not None and not self._requests.empty()
+
+    def wait_for_request(self, sock, timeout=None, rfile=None) -> bool:
+        """
+        Wait until the next request arrives on an idle keep-alive connection. The queue is checked meanwhile,
+        so the connection gives its worker up as soon as another connection waits for one.
+        :param sock: connection socket
+        :param timeout: seconds the connection may stay idle, None waits without limit
+        :param rfile: buffered reader of the connection, request already in its buffer counts as arrived
+        :return: True when a request can be read, False when the connection should be closed
+        """
+        if rfile is not None and has_buffered_data(sock, rfile):
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.closing and not self.has_backlog():
+            wait = IDLE_POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+            try:
+                if select.select([sock], [], [], wait)[0]:
+                    return True
+            except (OSError, ValueError):
+                # connection was closed
+                return False
+        return False
+
+    def shutdown(self):
+        # serve_forever may be waiting for room in the queue
+        self.closing = True
+        super().shutdown()
+
+    def server_close(self):
+        self.closing = True
+        super().server_close()
+        if self._pool is None:
+            return
+        # workers exit after serving everything queued before the sentinels
+        deadline = time.monotonic() + self.drain_timeout
+        for _ in self._pool:
+            try:
+                self._requests.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                # workers did not drain the queue in time
+                break
+        for thread in self._pool:
+            thread.join(max(0, deadline - time.monotonic()))
+        # connections still queued after drain_timeout are closed without being served
+        while True:
+            try:
+                item = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self.shutdown_request(item[0])
+        self._pool = None
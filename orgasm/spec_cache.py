@@ -0,0 +1,145 @@
+# On-disk cache of command specs for the command line interface. Tab completion under argcomplete runs the whole
+# program on every Tab press; with a fresh cache it is answered from the cached specs without importing
+# command modules or calling VALID_VALUES providers.
+#
+# The cache is keyed on module names, and is valid while size and mtime of every source file the commands
+# were defined in are unchanged. Values of callable VALID_VALUES providers are stored with their expiration
+# (provider ttl), expired values are not served from the cache.
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+CACHE_VERSION = 1
+
+TYPE_NAMES = {int: "int", float: "float", str: "str", bool: "bool", Path: "Path"}
+TYPES = {name: arg_type for arg_type, name in TYPE_NAMES.items()}
+
+
+def cache_directory() -> Path:
+    """
+    Directory of spec caches: ORGASM_CACHE_DIR, or orgasm in XDG_CACHE_HOME (~/.cache by default).
+    """
+    directory = os.environ.get("ORGASM_CACHE_DIR")
+    if directory:
+        return Path(directory)
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "orgasm"
+
+def cache_path(module_names) -> Path:
+    key = hashlib.sha1(("\0".join([sys.executable] + list(module_names))).encode()).hexdigest()[:20]
+    return cache_directory() / ("specs-%s.json" % key)
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def source_files(classes):
+    """
+    Source files of modules defining the classes.
+    """
+    files = set()
+    for cls in classes:
+        module = sys.modules.get(cls.__module__)
+        path = getattr(module, "__file__", None)
+        if path:
+            files.add(os.path.abspath(path))
+    return sorted(files)
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def encode_specs(registry):
+    """
+    Convert specs of registry to JSON. Only what the command line interface needs is kept:
+    types are stored by name, values which can not be stored in JSON are dropped.
+    """
+    from orgasm import valid_values_cache
+    now = time.time()
+    encoded = []
+    for spec in registry.specs:
+        providers = registry.command(spec["name"]).valid_values_providers
+        args = []
+        for arg in spec["args"]:
+            valid_values = arg["valid_values"] if _jsonable(arg["valid_values"]) else None
+            expires = None
+            provider = providers.get(arg["name"])
+            if callable(provider):
+                ttl = getattr(provider, "valid_values_ttl", None)
+                ttl = valid_values_cache.ttl if ttl is None else ttl
+                expires = None if ttl is None else now + ttl
+            encoded_arg = {
+                "name": arg["name"],
+                "required": arg["required"],
+                "type": TYPE_NAMES.get(arg["type"]),
+                "help": arg["help"] if isinstance(arg["help"], str) else "",
+                "valid_values": valid_values,
+                "valid_values_expires": expires,
+            }
+            if "default" in arg:
+                encoded_arg["default"] = arg["default"] if _jsonable(arg["default"]) else None
+            args.append(encoded_arg)
+        encoded.append({"name": spec["name"], "args": args})
+    return encoded
+
+def decode_specs(encoded):
+    """
+    Convert cached specs back to the format used by the command line interface.
+    """
+    for spec in encoded:
+        for arg in spec["args"]:
+            arg["type"] = TYPES.get(arg["type"]) if arg["type"] is not None else None
+    return encoded
+
+def write_spec_cache(module_names, registry):
+    """
+    Store specs of registry built from classes of the modules.
+    """
+    files = source_files(registry.classes)
+    data = {
+        "version": CACHE_VERSION,
+        "modules": list(module_names),
+        "files": {path: _file_stamp(path) for path in files},
+        "specs": encode_specs(registry),
+    }
+    path = cache_path(module_names)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name("%s.%d.tmp" % (path.name, os.getpid()))
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        # readers never see half written cache
+        os.replace(tmp, path)
+    except OSError as e:
+        print("Could not write spec cache %s: %s" % (path, e), file=sys.stderr)
+
+def load_spec_cache(module_names):
+    """
+    Load cached specs of modules without importing them.
+    :return: list of specs or None if there is no cache or a source file changed
+    """
+    try:
+        with open(cache_path(module_names)) as f:
+            data = json.load(f)
+        if data.get("version") != CACHE_VERSION or data.get("modules") != list(module_names):
+            return None
+        for path, stamp in data["files"].items():
+            if _file_stamp(path) != stamp:
+                return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return decode_specs(data["specs"])
+
+def has_expired_values(spec) -> bool:
+    """
+    Whether cached values of some callable VALID_VALUES provider of the command expired.
+    """
+    now = time.time()
+    return any(
+        arg.get("valid_values_expires") is not None and arg["valid_values_expires"] <= now for arg in spec["args"]
+    )
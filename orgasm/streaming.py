@@ -0,0 +1,26 @@
+# Helpers for streamed (generator) results of commands.
+import functools
+
+
+def primed(func):
+    """
+    Decorator for generator functions wrapping streamed results and releasing something in their finally block
+    (instance of command class, concurrency limit slot, metrics of the call, ...).
+    Finally block of a generator closed before its first item was asked for never runs, e.g. when a client
+    disconnects before the response body starts. Returned generator is therefore advanced right away
+    to its first `yield`, which must be inside the try block and yields nothing:
+
+        @primed
+        def wrap(result):
+            try:
+                yield
+                yield from result
+            finally:
+                release()
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        generator = func(*args, **kwargs)
+        next(generator)
+        return generator
+    return wrapper
@@ -0,0 +1,182 @@
+# Token stores for http_auth. Stores keep only sha256 digests of tokens, never raw tokens.
+import abc
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+
+class TokenStore(abc.ABC):
+    """
+    Interface of token stores. `save` and `lookup` have signatures of `db_save` and `db_lookup`
+    callables expected by `http_auth`, so store methods can be passed there directly.
+    """
+    def __init__(self):
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """
+        Register callable which is called with list of digests whenever tokens are saved, revoked
+        or swept, e.g. to invalidate cached validation results.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def notify(self, digests):
+        for listener in self._listeners:
+            listener(digests)
+
+    @abc.abstractmethod
+    def save(self, user_id: str, digest: str, issued: datetime, expiration: datetime):
+        """
+        Store token digest of user.
+        """
+
+    def save_many(self, records):
+        """
+        Save many tokens at once.
+        :param records: iterable of (user_id, digest, issued, expiration) tuples
+        """
+        for record in records:
+            self.save(*record)
+
+    @abc.abstractmethod
+    def lookup(self, digest: str):
+        """
+        :return: tuple (user_id, digest, expiration) or (None, None, None) if token is unknown
+        """
+
+    @abc.abstractmethod
+    def revoke(self, digest: str) -> bool:
+        """
+        Remove token.
+        :return: True if token existed
+        """
+
+    @abc.abstractmethod
+    def revoke_user(self, user_id: str) -> int:
+        """
+        Remove all tokens of user.
+        :return: number of removed tokens
+        """
+
+    @abc.abstractmethod
+    def sweep_expired(self, now: datetime = None) -> int:
+        """
+        Remove expired tokens and notify listeners.
+        :return: number of removed tokens
+        """
+
+
+class SQLiteTokenStore(TokenStore):
+    """
+    Token store in SQLite database in WAL mode. Lookups are indexed by digest, writes are
+    transactional so concurrent issuance from many threads or processes does not lose tokens.
+    Every thread uses its own connection.
+    Expired tokens are swept by the store itself, at most once per sweep_interval, on saves and lookups.
+    :param path: path to database file
+    :param sweep_interval: seconds between sweeps of expired tokens, None disables sweeping
+    """
+    def __init__(self, path: str, sweep_interval: float = 3600):
+        super().__init__()
+        self.path = str(path)
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() if sweep_interval is not None else None
+        self._sweep_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "digest TEXT PRIMARY KEY, user_id TEXT NOT NULL, issued REAL NOT NULL, expiration REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tokens_expiration ON tokens (expiration)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tokens_user_id ON tokens (user_id)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, user_id: str, digest: str, issued: datetime, expiration: datetime):
+        self.save_many([(user_id, digest, issued, expiration)])
+
+    def save_many(self, records):
+        rows = [(digest, user_id, issued.timestamp(), expiration.timestamp()) for user_id, digest, issued, expiration in records]
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tokens (digest, user_id, issued, expiration) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        self.notify([row[0] for row in rows])
+        self._maybe_sweep()
+
+    def lookup(self, digest: str):
+        self._maybe_sweep()
+        row = self._connection().execute(
+            "SELECT user_id, expiration FROM tokens WHERE digest = ?", (digest,)
+        ).fetchone()
+        if row is None:
+            return None, None, None
+        return row[0], digest, datetime.fromtimestamp(row[1])
+
+    def revoke(self, digest: str) -> bool:
+        with self._connection() as conn:
+            removed = conn.execute("DELETE FROM tokens WHERE digest = ?", (digest,)).rowcount > 0
+        self.notify([digest])
+        return removed
+
+    def revoke_user(self, user_id: str) -> int:
+        digests = self._delete("user_id = ?", (user_id,))
+        self.notify(digests)
+        return len(digests)
+
+    def sweep_expired(self, now: datetime = None) -> int:
+        now = now or datetime.now()
+        digests = self._delete("expiration < ?", (now.timestamp(),))
+        if digests:
+            self.notify(digests)
+        return len(digests)
+
+    def _delete(self, where, params):
+        """
+        Delete tokens matching where clause. Digests are selected and deleted in one write transaction,
+        so they are exactly the deleted rows.
+        :return: list of digests of deleted tokens
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            digests = [row[0] for row in conn.execute("SELECT digest FROM tokens WHERE " + where, params)]
+            if digests:
+                conn.execute("DELETE FROM tokens WHERE " + where, params)
+        return digests
+
+    def _maybe_sweep(self):
+        if self._next_sweep is None or time.monotonic() < self._next_sweep:
+            return
+        # one thread sweeps, others go on
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.sweep_expired()
+        finally:
+            self._sweep_lock.release()
+
+
+_sqlite_stores = {}
+_sqlite_stores_lock = threading.Lock()
+
+def get_sqlite_token_store(path: str) -> SQLiteTokenStore:
+    """
+    Get SQLite token store for database file, shared per path.
+    """
+    with _sqlite_stores_lock:
+        store = _sqlite_stores.get(str(path))
+        if store is None:
+            store = _sqlite_stores[str(path)] = SQLiteTokenStore(path)
+        return store
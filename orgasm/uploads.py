@@ -0,0 +1,203 @@
+# Spooling of uploaded files for the web interface. Uploads are written to the spool directory chunk by chunk
+# while the request body is parsed, so they are never buffered in memory or copied a second time.
+import hashlib
+import mmap
+import os
+import secrets
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# how often (in seconds) unused deduplicated uploads are looked for
+SWEEP_INTERVAL = 60
+
+
+class UploadTooLarge(Exception):
+    """
+    Upload exceeded maximal size allowed for the command.
+    """
+    def __init__(self, max_size):
+        super().__init__("Upload exceeds maximal size of %d bytes" % max_size)
+        self.max_size = max_size
+
+
+class UploadedPath(type(Path())):
+    """
+    Path of uploaded file passed to commands. Besides being a regular path it carries information about upload.
+    :ivar filename: file name given by the client
+    :ivar size: size in bytes
+    :ivar digest: hex digest of the content or None if hashing was not enabled for the command
+    :ivar hash_name: name of hashlib algorithm used for digest
+    """
+    filename = None
+    size = 0
+    digest = None
+    hash_name = None
+    dedup = False
+
+
+class SpoolFile:
+    """
+    Writable file in the spool directory. Size limit is enforced and content is hashed while it is written.
+    Behaves as a regular binary file otherwise.
+    """
+    def __init__(self, path, max_size=None, hash_name=None, dedup=False):
+        self.path = path
+        self.max_size = max_size
+        self.hash_name = hash_name
+        self.dedup = dedup
+        self.size = 0
+        self._hash = hashlib.new(hash_name) if hash_name else None
+        self._file = open(path, "w+b")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.discard()
+            raise UploadTooLarge(self.max_size)
+        if self._hash is not None:
+            self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest() if self._hash is not None else None
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class UploadSpool:
+    """
+    Directory where uploads are spooled.
+    Regular uploads are removed once the command is done with them. Deduplicated uploads are stored read-only
+    under their sha256 digest, so identical uploads share one file which is kept until it is not used
+    for dedup_ttl seconds.
+    :param directory: spool directory, defaults to orgasm-uploads in the system temporary directory
+    :param dedup_ttl: seconds after last use when deduplicated upload is removed
+    """
+    def __init__(self, directory=None, dedup_ttl=3600):
+        self.directory = Path(directory or os.path.join(tempfile.gettempdir(), "orgasm-uploads"))
+        self.dedup_ttl = dedup_ttl
+        self.partial_directory = self.directory / "partial"
+        self.blob_directory = self.directory / "blobs"
+        self.partial_directory.mkdir(parents=True, exist_ok=True)
+        self.blob_directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # digest -> number of requests using the blob right now
+        self._blob_users = {}
+        self._last_sweep = 0
+
+    def open(self, max_size=None, hash_name=None, dedup=False):
+        """
+        Create new spool file for upload.
+        :param max_size: maximal size in bytes, None means unlimited
+        :param hash_name: hashlib algorithm to compute digest with while file is written
+        :param dedup: deduplicate upload, implies sha256 hashing
+        """
+        if dedup:
+            hash_name = "sha256"
+        return SpoolFile(self.partial_directory / ("upload-" + secrets.token_hex(16)), max_size, hash_name, dedup)
+
+    def finish(self, spool_file, filename=None) -> UploadedPath:
+        """
+        Close fully received spool file and get its path for the command.
+        Deduplicated upload is moved to the blob store, or dropped if identical blob already exists.
+        """
+        spool_file.close()
+        path = spool_file.path
+        if spool_file.dedup:
+            blob = self.blob_directory / spool_file.digest
+            with self._lock:
+                if blob.exists():
+                    os.unlink(path)
+                    # keep blob alive for another dedup_ttl
+                    os.utime(blob)
+                else:
+                    os.chmod(path, 0o444)
+                    os.replace(path, blob)
+                self._blob_users[spool_file.digest] = self._blob_users.get(spool_file.digest, 0) + 1
+            path = blob
+        upload = UploadedPath(path)
+        upload.filename = filename
+        upload.size = spool_file.size
+        upload.digest = spool_file.digest
+        upload.hash_name = spool_file.hash_name
+        upload.dedup = spool_file.dedup
+        return upload
+
+    def release(self, upload):
+        """
+        Remove upload when the command is done with it, deduplicated uploads are only marked as unused.
+        """
+        if isinstance(upload, SpoolFile):
+            upload.discard()
+            return
+        if getattr(upload, "dedup", False):
+            with self._lock:
+                users = self._blob_users.get(upload.digest, 1) - 1
+                if users > 0:
+                    self._blob_users[upload.digest] = users
+                else:
+                    self._blob_users.pop(upload.digest, None)
+            self.sweep()
+            return
+        try:
+            os.unlink(upload)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, force=False):
+        """
+        Remove deduplicated uploads which were not used for dedup_ttl seconds.
+        Runs at most once per SWEEP_INTERVAL unless forced.
+        :return: number of removed files
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < SWEEP_INTERVAL:
+                return 0
+            self._last_sweep = now
+            removed = 0
+            for blob in self.blob_directory.iterdir():
+                if blob.name in self._blob_users:
+                    continue
+                try:
+                    if blob.stat().st_mtime + self.dedup_ttl < now:
+                        blob.unlink()
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+            return removed
+
+
+def map_upload(path):
+    """
+    Memory-map uploaded file read-only.
+    :return: tuple (memoryview, close) where close releases the mapping
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # empty files can not be mapped
+            return memoryview(b""), lambda: None
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    def close():
+        try:
+            view.release()
+            mapping.close()
+        except BufferError:
+            # command kept a view of the buffer, mapping is closed when it is garbage collected
+            pass
+    return view, close
@@ -1,9 +1,15 @@
 
-from orgasm import execute_command, get_command_specs
+import inspect
+import time
+from orgasm import execute_command, get_command_specs, get_registry, request_log
+from orgasm.limits import Overloaded
+from orgasm.metrics import PROMETHEUS_CONTENT_TYPE, metrics
+from orgasm.uploads import UploadSpool, UploadTooLarge, map_upload
 from pathlib import Path
 
 # Flask application serving the web interface
-def serve_web(classes, command_view_templates: dict = None, index_template=None, command_result_templates=None):
+def serve_web(classes, command_view_templates: dict = None, index_template=None, command_result_templates=None,
+              port=8080, host="127.0.0.1", debug=True, server="flask", upload_dir=None, max_upload_size=None, **options):
     """
     classes: list of classes with command methods
     command_view_templates: 
@@ -12,15 +18,88 @@ def serve_web(classes, command_view_templates: dict = None, index_template=None,
         If command is not in the dict, default template will be used.
     index_template: path to index template file. If None, default template will be used.
     command_result_templates: dict with template files for command results. Keys represent respective commands.
+    debug: run Flask development server in debug mode
+    upload_dir: spool directory for uploaded files, see `orgasm.uploads.UploadSpool`
+    max_upload_size:
+        default maximal size of uploaded file in bytes, None means unlimited.
+        Commands can set their own limit with `@attr(max_upload_size=...)`, enable hashing of uploads
+        with `@attr(upload_hash="sha256")` and deduplication of identical uploads with `@attr(upload_dedup=True)`.
+        Path arguments receive `orgasm.uploads.UploadedPath`, memoryview arguments receive
+        read-only memory-mapped content of the upload. Uploads are removed after the command finishes.
+    server: "flask" for Flask development server or "prefork" for pre-forked worker processes,
+        options are passed to `orgasm.prefork.serve_prefork`
+    """
+    def app_factory():
+        return create_web_app(classes, command_view_templates, index_template, command_result_templates,
+                              upload_dir=upload_dir, max_upload_size=max_upload_size)
+    if server == "prefork":
+        from orgasm.prefork import serve_prefork
+        return serve_prefork(app_factory, host=host, port=port, **options)
+    if server != "flask":
+        raise ValueError(f"Unknown server {server}")
+    from orgasm.keepalive import KeepAliveRequestHandler
+    app_factory().run(port=port, host=host, debug=debug, request_handler=KeepAliveRequestHandler)
 
+def create_web_app(classes, command_view_templates: dict = None, index_template=None, command_result_templates=None,
+                   upload_dir=None, max_upload_size=None):
+    """
+    Create Flask app serving web interface for commands. See `serve_web` for description of parameters.
     """
     from flask import Flask, render_template, request, jsonify, redirect, url_for, render_template_string
+    from flask import stream_template, stream_template_string
 
+    registry = get_registry(classes)
     app = Flask(__name__)
+    spool = UploadSpool(upload_dir)
+
+    class Request(app.request_class):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            # uploads go straight to the spool, command is given in query string so its limits are known here
+            attrs = registry.get(self.args["command"])["attrs"] if self.args.get("command") in registry else {}
+            spool_file = spool.open(
+                attrs.get("max_upload_size", max_upload_size),
+                attrs.get("upload_hash"),
+                attrs.get("upload_dedup", False),
+            )
+            self.spooled.append(spool_file)
+            return spool_file
+
+        @property
+        def spooled(self):
+            if "orgasm.spooled" not in self.environ:
+                self.environ["orgasm.spooled"] = []
+            return self.environ["orgasm.spooled"]
+    app.request_class = Request
+
+    @app.errorhandler(Overloaded)
+    def overloaded(e):
+        return str(e), 429 if e.scope == "command" else 503, {"Retry-After": str(e.retry_after)}
+
+    @app.errorhandler(UploadTooLarge)
+    def upload_too_large(e):
+        return str(e), 413
+
+    @app.after_request
+    def release_uploads(response):
+        # after the response is sent, streamed results may still read uploads until then
+        spooled = request.spooled
+        mapped = request.environ.get("orgasm.mapped", [])
+        def release():
+            for close in mapped:
+                close()
+            for spool_file in spooled:
+                spool.release(getattr(spool_file, "upload", spool_file))
+        if spooled:
+            response.call_on_close(release)
+        return response
+
+    @app.route('/metrics')
+    def command_metrics():
+        return metrics.render_prometheus(), 200, {"Content-Type": PROMETHEUS_CONTENT_TYPE}
 
     @app.route('/')
     def index():
-        commands = get_command_specs(classes)
+        commands = registry.specs
         html = render_template_string('''
         <html>
             <head>
@@ -44,30 +123,54 @@ def serve_web(classes, command_view_templates: dict = None, index_template=None,
     def command():
         command = request.form['command'] if "command" not in request.args else request.args['command']
         params = {} 
-        specs = get_command_specs(classes)
-        command = next((c for c in specs if c['name'] == command), None)
-        if command is None:
+        if command not in registry:
             return 'Command not found', 404
-        print("Command: ", command['name'])
-        print("Args: ", command['args'])
-        print("Request form: ", request.form)
+        command = registry.get(command)
+        started = time.perf_counter()
         if request.method == 'GET' and len(command['args']) > 0:
             return redirect(url_for('command_view', command=command['name']))
         for arg in command['args']:
             if arg['name'] in request.form and request.form[arg['name']] not in [None, ""]:
                 params[arg['name']] = arg['type'](request.form[arg['name']])
-            if arg["type"] == Path:
-                from random import choice
-                from string import ascii_lowercase, digits
-                def random_string(n):
-                    return ''.join(choice(ascii_lowercase + digits) for _ in range(n))
-                # copy file to temporary directory in request form 
+            if arg["type"] in (Path, memoryview) and arg['name'] in request.files:
+                # file was already streamed to the spool while form was parsed
                 file = request.files[arg['name']]
-                local_file_path = f"/tmp/{file.filename}." + random_string(8)
-                file.save(local_file_path)
-                params[arg['name']] = Path(local_file_path)
-        print("Params: ", params)
-        result = execute_command(classes, command["name"], params)
+                if not file.filename:
+                    continue
+                spool_file = file.stream
+                spool_file.upload = spool.finish(spool_file, file.filename)
+                if arg["type"] == Path:
+                    params[arg['name']] = spool_file.upload
+                else:
+                    params[arg['name']], close = map_upload(spool_file.upload)
+                    request.environ.setdefault("orgasm.mapped", []).append(close)
+        try:
+            result = execute_command(registry, command["name"], params)
+        except Exception as e:
+            request_log.logger.request("web", command["name"], params, started, error=e,
+                                       status=(429 if e.scope == "command" else 503) if isinstance(e, Overloaded) else 500)
+            raise
+        request_log.logger.request("web", command["name"], params, started, result, status=200)
+        if inspect.isgenerator(result):
+            # items are rendered and sent to the browser as they are produced
+            return app.response_class(stream_template_string('''
+        <html>
+            <head>
+                <title>Command Executor</title>
+            </head>
+            <body>
+                <h1>Command Executor</h1>
+                <ul>
+                {% for item in result %}
+                    <li>{{ item }}</li>
+                {% endfor %}
+                </ul>
+            </body>
+        </html>
+        ''', result=result) if (
+                command_result_templates is None or
+                command['name'] not in command_result_templates
+            ) else stream_template(command_result_templates[command['name']], result=result))
         return render_template_string('''
         <html>
             <head>
@@ -86,15 +189,19 @@ def serve_web(classes, command_view_templates: dict = None, index_template=None,
 
     @app.route('/command_specs')
     def command_specs():
-        specs = get_command_specs(classes)
+        specs = registry.specs
         # custom serialization for type objects which converts them into string 
         def serialize(obj):
             if isinstance(obj, type):
                 return obj.__name__
             if isinstance(obj, dict):
                 return {k: serialize(v) for k, v in obj.items()}
-            if isinstance(obj, list):
+            if isinstance(obj, (list, tuple)):
                 return [serialize(v) for v in obj]
+            if callable(obj):
+                return getattr(obj, "__name__", str(obj))
+            if not isinstance(obj, (str, int, float, bool, type(None))):
+                return str(obj)
             return obj
         # create deep copy of specs dict which will transform every item tusing serialize func
         specs_serialized = serialize(specs)
@@ -102,14 +209,14 @@ def serve_web(classes, command_view_templates: dict = None, index_template=None,
 
     @app.route('/command/<command>')
     def command_view(command):
-        commands = get_command_specs(classes)
-        command = next((c for c in commands if c['name'] == command), None)
+        command = registry.get(command) if command in registry else None
         type_input_mapping = {
             int: 'number',
             str: 'text',
             bool: 'checkbox',
             float: 'number',
-            Path: 'file'
+            Path: 'file',
+            memoryview: 'file',
         }
         if command is None:
             return 'Command not found', 404
@@ -123,7 +230,7 @@ def serve_web(classes, command_view_templates: dict = None, index_template=None,
             <body>
                 <h1>{{ command["name"] }}</h1>
                 <p>{{ command["description"] }}</p>
-                <form enctype="multipart/form-data" action="{{ url_for('command') }}" method="post">
+                <form enctype="multipart/form-data" action="{{ url_for('command', command=command["name"]) }}" method="post">
                     <input type="hidden" name="command" value="{{ command["name"] }}">
                     {% for param in command["args"] %}
                         <label for="{{ param["name"] }}">{{ param["name"] }}</label>
@@ -151,4 +258,5 @@ def serve_web(classes, command_view_templates: dict = None, index_template=None,
         ) else render_template(command_view_templates[command['name']], command=command, type_input_mapping=type_input_mapping)
         return html
 
-    app.run(port=8080, debug=True)
\ No newline at end of file
+    registry.warmup()
+    return app
\ No newline at end of file
@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from orgasm import attr, execute_command, get_registry, instance_scope
+from orgasm.http_rest import iter_ndjson
+from orgasm.metrics import metrics
+
+
+@instance_scope("pool", pool_size=1)
+class PooledCommands:
+    def numbers(self, count: int):
+        for i in range(count):
+            yield i
+
+
+class LimitedCommands:
+    @attr(max_concurrency=1)
+    def letters(self):
+        yield from "abc"
+
+
+def call_with_timeout(func, timeout=5):
+    """
+    Call func in a thread, None if it did not return in time (e.g. it is blocked by a leaked instance or slot).
+    """
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return results[0] if results else None
+
+
+class UnstartedStreamTest(unittest.TestCase):
+    def test_closing_unstarted_stream_releases_pool_instance(self):
+        registry = get_registry([PooledCommands])
+        # client disconnected before the response body started
+        iter_ndjson(execute_command(registry, "numbers", {"count": 3})).close()
+        result = call_with_timeout(lambda: list(execute_command(registry, "numbers", {"count": 3})))
+        self.assertEqual(result, [0, 1, 2])
+
+    def test_closing_unstarted_stream_releases_concurrency_slot(self):
+        registry = get_registry([LimitedCommands])
+        execute_command(registry, "letters", {}).close()
+        result = call_with_timeout(lambda: list(execute_command(registry, "letters", {})))
+        self.assertEqual(result, ["a", "b", "c"])
+
+    def test_closing_unstarted_stream_ends_call_in_metrics(self):
+        registry = get_registry([PooledCommands])
+        command_metrics = metrics.command(registry.get("numbers")["name"])
+        in_flight = command_metrics.in_flight
+        execute_command(registry, "numbers", {"count": 3}).close()
+        self.assertEqual(command_metrics.in_flight, in_flight)
+
+
+if __name__ == "__main__":
+    unittest.main()